@@ -0,0 +1,12 @@
+"""
+Benchmarks of the address site.
+
+Each module runs on its own, from the top of the repository, and
+can save its results as JSON (--out) to compare runs:
+
+    python -m benchmarks.bench_json
+    python -m benchmarks.bench_utils
+    python -m benchmarks.bench_routes
+    python -m benchmarks.bench_workers
+
+"""
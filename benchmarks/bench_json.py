@@ -0,0 +1,117 @@
+"""
+This compares the JSON codec backends with the json_util way.
+
+"legacy" is how JSONHelper used to work: json.dumps with
+json_util.default after a key scan for _id, and json.loads with
+json_util's object hook on every object.  Each backend of
+libraries.jsoncodec is then timed on the same work:
+
+- encode: a list of addresses, ids converted as JSONHelper does
+- decode: a posted list of addresses, no extended JSON in it
+- decode_ext: the same list with every id as {"$oid": ...}
+
+    python -m benchmarks.bench_json --sizes 100,10000 --out json.json
+
+"""
+
+from benchmarks.common import makeAddresses, measure, saveResults
+from bson import json_util
+from libraries import jsoncodec
+import argparse
+import json
+
+
+def legacyIdToStr(row):
+    for key in row:
+        if key == '_id':
+            row[key] = str(row[key])
+            break
+
+
+def legacyEncode(addresses):
+    for address in addresses:
+        legacyIdToStr(address)
+    return json.dumps(addresses, default=json_util.default)
+
+
+def legacyDecode(text):
+    return json.loads(text, object_hook=json_util.object_hook)
+
+
+def codecEncode(addresses):
+    for address in addresses:
+        if '_id' in address:
+            address['_id'] = str(address['_id'])
+    return jsoncodec.dumps(addresses)
+
+
+def run(sizes, repeat):
+    """Run every case at every size.
+
+    :param sizes: the numbers of addresses to try
+    :type sizes: list
+    :param repeat: how many runs to time each case with
+    :type repeat: int
+    :returns: one result per size, case and implementation
+    :rtype: list
+
+    """
+
+    results = []
+    implementations = [('legacy', legacyEncode, legacyDecode)]
+    for name in sorted(jsoncodec.BACKENDS):
+        backend = jsoncodec.BACKENDS[name]()
+        implementations.append((name, codecEncode, backend.loads))
+
+    for size in sizes:
+        addresses = makeAddresses(size)
+        posted = json.dumps(makeAddresses(size, withIds=False))
+        extended = json_util.dumps(addresses)
+        for name, encode, decode in implementations:
+            if name != 'legacy':
+                jsoncodec.use(name)
+            cases = [
+                ('encode', lambda: encode(
+                    [dict(address) for address in addresses])),
+                ('decode', lambda: decode(posted)),
+                ('decode_ext', lambda: decode(extended)),
+            ]
+            for case, fn in cases:
+                timing = measure(fn, repeat=repeat)
+                timing.update({'size': size, 'case': case,
+                               'implementation': name})
+                results.append(timing)
+    jsoncodec.use()
+    return results
+
+
+def report(results):
+    """Print the results, with each one's speedup over legacy."""
+
+    legacy = dict(((r['size'], r['case']), r['best']) for r in results
+                  if r['implementation'] == 'legacy')
+    print('%8s %-11s %-8s %12s %9s' % (
+        'size', 'case', 'impl', 'best ms', 'speedup'))
+    for r in results:
+        print('%8d %-11s %-8s %12.3f %8.2fx' % (
+            r['size'], r['case'], r['implementation'], r['best'] * 1000,
+            legacy[(r['size'], r['case'])] / r['best']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='comma separated numbers of addresses')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help='file to save the results to as JSON')
+    options = parser.parse_args(argv)
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    results = run(sizes, options.repeat)
+    report(results)
+    if options.out:
+        saveResults(options.out, 'json', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+This times the address routes end to end, inside the process.
+
+AddressServer's WSGI application (middleware, cork, models and all)
+is called directly, without gunicorn or sockets, for:
+
+- /addresses: the JSON list of every address
+- /csv: the export of every address
+- /christmas_card: the export of the Christmas card addresses
+
+Each size gets its own user with that many addresses, logged in
+through /login like a browser.  The database is the MongoDB at
+--mongo-url (a scratch database there is filled and dropped), or
+mongomock in memory when no url is given, which shows the cost of
+the application but not of the database.
+
+    python -m benchmarks.bench_routes --sizes 100,10000
+    python -m benchmarks.bench_routes --mongo-url mongodb://localhost
+
+"""
+
+from benchmarks.common import makeAddresses, measure, saveResults
+from datetime import datetime
+import argparse
+import io
+import logging
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PATHS = ('/addresses', '/csv', '/christmas_card')
+PASSWORD = 'benchmark'
+
+
+def makeServer(options, webOptions=None):
+    """Return the application, set up against the benchmark database.
+
+    :param options: the command line options
+    :param webOptions: [web server] options to change (optional)
+    :type webOptions: dict
+    :returns: the server
+    :rtype: AddressServer
+
+    """
+
+    from configobj import ConfigObj
+    from models import connection
+
+    os.environ.setdefault('EMAIL_SENDER', 'bench@example.com')
+    os.environ.setdefault('EMAIL_PASSWORD', 'unused')
+    os.environ.setdefault('ENCRYPT_KEY', 'b' * 32)
+    os.environ['MONGOHQ_DB'] = options.db
+    if options.mongo_url:
+        os.environ['MONGOHQ_URL'] = options.mongo_url
+    else:
+        import mongomock
+        os.environ['MONGOHQ_URL'] = 'mongodb://in-memory'
+        connection.setClient(os.environ['MONGOHQ_URL'],
+                             mongomock.MongoClient())
+
+    # gunicorn parses the command line too, so keep ours out of it
+    sys.argv = sys.argv[:1]
+    # Importing the site sets up logging for serving, not for this
+    import show_address_site
+    logging.getLogger().setLevel(logging.WARNING)
+
+    settings = ConfigObj(options.config)
+    settings.setdefault('cache', {})['enabled'] = str(options.cache)
+    settings.setdefault('compression', {})['enabled'] = str(options.gzip)
+    settings['web server'].update(webOptions or {})
+    server = show_address_site.AddressServer(
+        dict(settings['web server']), settings)
+    store = server.loginPlugin._store
+    store.roles['user'] = 100
+    return server
+
+
+def addUser(server, userName, count):
+    """Create a user with some addresses."""
+
+    from models.address import AddressModel
+
+    plugin = server.loginPlugin
+    plugin._store.users[userName] = {
+        'role': 'user', 'email_addr': userName + '@example.com',
+        'desc': userName, 'creation_date': str(datetime.utcnow()),
+        'last_login': str(datetime.utcnow()),
+        'hash': plugin._hash(userName, PASSWORD).decode('ascii')}
+    helper = AddressModel(server.MONGO_URL, server.MONGO_DB)
+    addresses = makeAddresses(count, userName, withIds=False)
+    for start in range(0, count, 1000):
+        helper.createMultiple(addresses[start:start + 1000], userName)
+
+
+def call(app, method, path, headers=None, body=b''):
+    """Call the application like a server would, reading the body.
+
+    :returns: the status, headers and size of the body
+    :rtype: tuple
+
+    """
+
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+               'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+               'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+               'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+               'wsgi.multiprocess': False, 'wsgi.run_once': False,
+               'wsgi.version': (1, 0), 'CONTENT_LENGTH': str(len(body))}
+    if body:
+        environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+    for name, value in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    response = {}
+
+    def start_response(status, responseHeaders, exc_info=None):
+        response['status'] = status
+        response['headers'] = responseHeaders
+
+    result = app(environ, start_response)
+    size = 0
+    try:
+        for chunk in result:
+            size += len(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], size
+
+
+def login(app, userName):
+    """Log in and return the session cookie."""
+
+    body = ('username=%s&password=%s' % (userName, PASSWORD)).encode()
+    status, headers, size = call(app, 'POST', '/login', body=body)
+    for name, value in headers:
+        cookie = value.split(';')[0].strip()
+        if name.lower() == 'set-cookie' and \
+                cookie.startswith('beaker.session.id='):
+            return cookie
+    raise RuntimeError('Could not log in as %s: %s' % (userName, status))
+
+
+def run(server, sizes, repeat, gzip):
+    """Time every path at every size.
+
+    :param server: the server to call
+    :type server: AddressServer
+    :param sizes: the numbers of addresses to try
+    :type sizes: list
+    :param repeat: how many runs to time each path with
+    :type repeat: int
+    :param gzip: whether to ask for gzipped responses
+    :type gzip: bool
+    :returns: one result per size and path
+    :rtype: list
+
+    """
+
+    app = server.load()
+    results = []
+    for size in sizes:
+        userName = 'bench%d' % size
+        addUser(server, userName, size)
+        headers = {'Cookie': login(app, userName)}
+        if gzip:
+            headers['Accept-Encoding'] = 'gzip'
+        for path in PATHS:
+            status, _, bodySize = call(app, 'GET', path, headers)
+            if not status.startswith('200'):
+                raise RuntimeError('%s answered %s' % (path, status))
+            timing = measure(lambda: call(app, 'GET', path, headers),
+                             repeat=repeat)
+            timing.update({'size': size, 'path': path, 'bytes': bodySize})
+            results.append(timing)
+    return results
+
+
+def report(results):
+    """Print the results."""
+
+    print('%8s %-16s %12s %12s %12s' % (
+        'size', 'path', 'best ms', 'median ms', 'bytes'))
+    for r in results:
+        print('%8d %-16s %12.3f %12.3f %12d' % (
+            r['size'], r['path'], r['best'] * 1000, r['median'] * 1000,
+            r['bytes']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='comma separated numbers of addresses')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mongo-url',
+                        help='a MongoDB to use, mongomock if not given')
+    parser.add_argument('--db', default='simpleaddress_benchmark',
+                        help='the scratch database, dropped afterwards')
+    parser.add_argument('--config', default=os.path.join(ROOT, 'app.config'))
+    parser.add_argument('--cache', action='store_true',
+                        help='let the address cache answer repeated lists')
+    parser.add_argument('--gzip', action='store_true',
+                        help='ask for and time compressed responses')
+    parser.add_argument('--out', help='file to save the results to as JSON')
+    options = parser.parse_args(argv)
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    server = makeServer(options)
+    try:
+        results = run(server, sizes, options.repeat, options.gzip)
+    finally:
+        from models.connection import getClient
+        getClient(server.MONGO_URL).drop_database(options.db)
+    report(results)
+    if options.out:
+        saveResults(options.out, 'routes', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+This times the helpers of libraries.utils on synthetic addresses.
+
+- encode: JSONHelper.encode of a list of addresses
+- encode_stream: JSONHelper.encodeStream, read to the end, as the
+  address list is sent
+- decode: JSONHelper.decode of posted addresses with their ids
+- csv: CSVHelper.convertToCSV with the address schema
+- id_to_str: idToStr over every address
+- fields: fieldsFromFieldNameArray of the address fields, which
+  does not depend on the number of addresses
+
+    python -m benchmarks.bench_utils --sizes 100,10000,1000000
+
+"""
+
+from benchmarks.common import makeAddresses, measure, saveResults
+from libraries.utils import CSVHelper, JSONHelper, fieldsFromFieldNameArray
+from libraries.utils import idToStr
+from models.address import AddressModel
+import argparse
+import json
+
+
+def copies(addresses):
+    """Return a setup making fresh copies of the addresses."""
+
+    return lambda: [dict(address) for address in addresses]
+
+
+def run(sizes, repeat):
+    """Run every case at every size.
+
+    :param sizes: the numbers of addresses to try
+    :type sizes: list
+    :param repeat: how many runs to time each case with
+    :type repeat: int
+    :returns: one result per size and case
+    :rtype: list
+
+    """
+
+    jsonHelper = JSONHelper()
+    csvHelper = CSVHelper()
+    schema = AddressModel.schema
+    results = []
+
+    def idsToStr(addresses):
+        for address in addresses:
+            idToStr(address)
+
+    for size in sizes:
+        addresses = makeAddresses(size)
+        posted = json.dumps([dict(address, _id=str(address['_id']))
+                             for address in addresses])
+        cases = [
+            ('encode', lambda: jsonHelper.encode(addresses), None),
+            ('encode_stream', lambda items: ''.join(
+                jsonHelper.encodeStream(items)), copies(addresses)),
+            ('decode', lambda: jsonHelper.decode(posted), None),
+            ('csv', lambda: csvHelper.convertToCSV(addresses, schema), None),
+            ('id_to_str', idsToStr, copies(addresses)),
+        ]
+        for case, fn, setup in cases:
+            timing = measure(fn, repeat=repeat, setup=setup)
+            timing.update({'size': size, 'case': case})
+            results.append(timing)
+        del addresses, posted
+
+    spec = [field.name if field.fieldType == '' else
+            (field.name, field.fieldType) for field in schema]
+    timing = measure(lambda: fieldsFromFieldNameArray(spec), repeat=repeat,
+                     number=1000)
+    timing.update({'size': len(spec), 'case': 'fields'})
+    results.append(timing)
+    return results
+
+
+def report(results):
+    """Print the results, with the time per address."""
+
+    print('%8s %-14s %12s %12s %10s' % (
+        'size', 'case', 'best ms', 'median ms', 'us/item'))
+    for r in results:
+        print('%8d %-14s %12.3f %12.3f %10.3f' % (
+            r['size'], r['case'], r['best'] * 1000, r['median'] * 1000,
+            r['best'] * 1e6 / r['size']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='100,1000,10000,100000',
+                        help='comma separated numbers of addresses')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help='file to save the results to as JSON')
+    options = parser.parse_args(argv)
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    results = run(sizes, options.repeat)
+    report(results)
+    if options.out:
+        saveResults(options.out, 'utils', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
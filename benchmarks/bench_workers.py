@@ -0,0 +1,219 @@
+"""
+This compares AddressServer's concurrency modes on the same workload.
+
+For each mode, AddressServer itself serves the site under gunicorn,
+with the worker options worker_options gives the mode (and the
+hashing pool, caches and cork each worker sets up for itself).
+Client threads, each logged in as one of the benchmark users, keep
+it busy for a while with the first page of their addresses, and
+now and then a login, which waits on the hashing pool.  Throughput
+and latency percentiles are reported per mode.
+
+    python -m benchmarks.bench_workers --modes sync,threaded,async
+        --workers 3 --threads 4 --concurrency 32 --duration 10
+
+The database is the MongoDB at --mongo-url (a scratch database
+there is filled and dropped), or mongomock in memory when no url
+is given, filled before gunicorn forks so every worker has a copy.
+The async mode needs gevent and is skipped without it.
+
+"""
+
+from benchmarks.common import percentile, saveResults
+import argparse
+import importlib.util
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def userName(i):
+    """Return the name of a benchmark user."""
+
+    return 'worker%04d' % i
+
+
+def serve(options):
+    """Serve the site in one mode, for the benchmark users, until killed.
+
+    :param options: the command line options, with the mode in serve
+    :returns: (nothing)
+
+    """
+
+    from benchmarks.bench_routes import addUser, makeServer
+
+    server = makeServer(options, {
+        'mode': options.serve, 'workers': str(options.workers),
+        'threads': str(options.threads), 'loglevel': 'warning',
+        'bind': '127.0.0.1:%d' % options.port})
+    for i in range(options.users):
+        addUser(server, userName(i), options.addresses)
+    server.run()
+
+
+def waitForPort(port, timeout=60):
+    """Wait until something listens on a local port."""
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('The server did not start on port %d' % port)
+
+
+def signIn(user):
+    """Post a user's login and return the status."""
+
+    from benchmarks.bench_routes import PASSWORD
+
+    body = urllib.parse.urlencode({'username': user.userName,
+                                   'password': PASSWORD})
+    status, _ = user.request('POST', '/login', body.encode('utf-8'),
+                             'application/x-www-form-urlencoded')
+    return status
+
+
+def runLoad(users, loginShare, duration):
+    """Keep the site busy, a thread per user, and time every request.
+
+    :param users: the logged in users
+    :type users: list
+    :param loginShare: the fraction of requests that are logins
+    :type loginShare: float
+    :param duration: how long to run, in seconds
+    :type duration: float
+    :returns: sorted latencies of the successful requests, errors
+    :rtype: tuple
+
+    """
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(user):
+        mine = []
+        failed = 0
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                if user.rng.random() < loginShare:
+                    ok = signIn(user) < 400
+                else:
+                    ok = user.list() < 400
+            except Exception:
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(user,))
+               for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0]
+
+
+def benchMode(mode, options, serveArguments):
+    """Serve the site in a mode, load it and return the result."""
+
+    from benchmarks.bench_routes import PASSWORD
+    from tools.load_test import VirtualUser
+
+    command = [sys.executable, '-m', 'benchmarks.bench_workers',
+               '--serve', mode] + serveArguments
+    server = subprocess.Popen(command, cwd=ROOT)
+    try:
+        waitForPort(options.port)
+        baseUrl = 'http://127.0.0.1:%d' % options.port
+        users = [VirtualUser(baseUrl, userName(i % options.users), PASSWORD,
+                             random.Random(i))
+                 for i in range(options.concurrency)]
+        for user in users:
+            user.login()
+        runLoad(users, options.login_share, min(2, options.duration))
+        latencies, errors = runLoad(users, options.login_share,
+                                    options.duration)
+    finally:
+        server.terminate()
+        server.wait()
+        if options.mongo_url:
+            from models.connection import getClient
+            getClient(options.mongo_url).drop_database(options.db)
+    return {'mode': mode, 'requests': len(latencies), 'errors': errors,
+            'throughput': len(latencies) / float(options.duration),
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modes', default='sync,threaded,async')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='client threads, each logged in as a user')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--addresses', type=int, default=100,
+                        help='addresses of each user')
+    parser.add_argument('--login-share', type=float, default=0.05,
+                        help='the fraction of requests that are logins')
+    parser.add_argument('--mongo-url',
+                        help='a MongoDB to use, mongomock if not given')
+    parser.add_argument('--db', default='simpleaddress_benchmark',
+                        help='the scratch database, dropped afterwards')
+    parser.add_argument('--config', default=os.path.join(ROOT, 'app.config'))
+    parser.add_argument('--cache', action='store_true',
+                        help='let the address cache answer repeated lists')
+    parser.add_argument('--gzip', action='store_true',
+                        help='compress the responses')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help='file to save the results to as JSON')
+    serveArguments = list(sys.argv[1:] if argv is None else argv)
+    options = parser.parse_args(serveArguments)
+
+    if options.serve:
+        serve(options)
+        return
+
+    results = []
+    print('%-9s %9s %7s %10s %9s %9s' % (
+        'mode', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+    for mode in options.modes.split(','):
+        if mode == 'async' and importlib.util.find_spec('gevent') is None:
+            # worker_options would run it threaded, which is measured
+            print('%-9s skipped, gevent is not installed' % mode)
+            continue
+        result = benchMode(mode, options, serveArguments)
+        results.append(result)
+        print('%-9s %9d %7d %10.1f %9.2f %9.2f' % (
+            mode, result['requests'], result['errors'],
+            result['throughput'], (result['p50'] or 0) * 1000,
+            (result['p99'] or 0) * 1000))
+    if options.out:
+        saveResults(options.out, 'workers', results, vars(options))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+This holds what the benchmarks share: timing and sample data.
+
+"""
+
+from bson.objectid import ObjectId
+import gc
+import json
+import platform
+import sys
+import time
+
+
+def measure(fn, repeat=5, number=1, setup=None):
+    """Time a function, returning the best and median run.
+
+    The best run is the least disturbed by the rest of the machine,
+    the median shows how steady the timings were.
+
+    :param fn: the function to time, called without arguments
+    :type fn: callable
+    :param repeat: how many runs to make
+    :type repeat: int
+    :param number: how many calls make one run
+    :type number: int
+    :param setup: called before each call, untimed, and its result
+                  passed to fn (for functions that change their input)
+    :type setup: callable
+    :returns: best and median seconds per call
+    :rtype: dict
+
+    """
+
+    timings = []
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            if setup is None:
+                started = time.perf_counter()
+                for _ in range(number):
+                    fn()
+                timings.append((time.perf_counter() - started) / number)
+                continue
+            elapsed = 0.0
+            for _ in range(number):
+                argument = setup()
+                started = time.perf_counter()
+                fn(argument)
+                elapsed += time.perf_counter() - started
+            timings.append(elapsed / number)
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+    timings.sort()
+    return {'best': timings[0], 'median': timings[len(timings) // 2]}
+
+
+def makeAddresses(count, userName='bench', withIds=True):
+    """Return address documents like the ones in the database.
+
+    :param count: how many addresses to make
+    :type count: int
+    :param userName: the owner of the addresses
+    :type userName: str
+    :param withIds: give each address an ObjectId, as mongo does
+    :type withIds: bool
+    :returns: the addresses
+    :rtype: list
+
+    """
+
+    addresses = []
+    for i in range(count):
+        address = {
+            'first_name': 'First%d' % i, 'last_name': 'Last%d' % (i % 977),
+            'spouse': 'Spouse%d' % i if i % 3 else '',
+            'email_address': 'person%d@example.com' % i,
+            'street_1': '%d Main Street' % (i % 9999), 'street_2': '',
+            'city': 'Springfield', 'state': 'IL', 'zip': '%05d' % (i % 99999),
+            'country': 'USA', 'home_phone': '555-%04d' % (i % 10000),
+            'mobile_phone': '', 'relationship': 'Friend', 'title': '',
+            'children': '', 'label_name': 'The Last%d Family' % (i % 977),
+            'send_christmas_card': i % 2 == 0, 'userName': userName,
+            '_modified': i + 1,
+        }
+        if withIds:
+            address['_id'] = ObjectId()
+        addresses.append(address)
+    return addresses
+
+
+def environment():
+    """Return what the results were measured on."""
+
+    return {'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'system': platform.system(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def saveResults(path, name, results, settings=None):
+    """Write results as JSON, along with the environment.
+
+    :param path: the file to write
+    :type path: str
+    :param name: the name of the benchmark
+    :type name: str
+    :param results: the results
+    :type results: list
+    :param settings: what the benchmark was run with (optional)
+    :type settings: dict
+    :returns: (nothing)
+
+    """
+
+    with open(path, 'w') as out:
+        json.dump({'benchmark': name, 'environment': environment(),
+                   'settings': settings or {}, 'results': results},
+                  out, indent=2, sort_keys=True)
+
+
+def percentile(values, fraction):
+    """Return a percentile of some values, nearest rank.
+
+    :param values: the values, sorted
+    :type values: list
+    :param fraction: the percentile as a fraction, such as 0.99
+    :type fraction: float
+    :returns: the value at that rank, or None without values
+    :rtype: float
+
+    """
+
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))
+    return values[rank]
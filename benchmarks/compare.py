@@ -0,0 +1,76 @@
+"""
+This compares two saved runs of a benchmark.
+
+Results are matched on everything but their timings (size, case,
+path...), and the best time of each is shown with the change.
+
+    python -m benchmarks.compare before.json after.json
+
+"""
+
+import argparse
+import json
+
+# What a benchmark measured, as opposed to what it ran
+MEASURED = ('best', 'median', 'bytes', 'requests', 'errors', 'throughput',
+            'p50', 'p99', 'max')
+
+
+def resultKey(result):
+    """Return what identifies a result across runs."""
+
+    return tuple(sorted((name, value) for name, value in result.items()
+                        if name not in MEASURED))
+
+
+def compare(before, after, threshold=0.1):
+    """Return the results of two runs side by side.
+
+    :param before: the saved results of the first run
+    :type before: dict
+    :param after: the saved results of the second run
+    :type after: dict
+    :param threshold: the change flagged as a regression, 0.1 is 10%
+    :type threshold: float
+    :returns: key, best before, best after, ratio and regressed
+    :rtype: list of tuples
+
+    """
+
+    old = dict((resultKey(result), result) for result in before['results'])
+    rows = []
+    for result in after['results']:
+        key = resultKey(result)
+        if key not in old or 'best' not in result:
+            continue
+        ratio = result['best'] / old[key]['best']
+        rows.append((key, old[key]['best'], result['best'], ratio,
+                     ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown flagged as a regression')
+    options = parser.parse_args(argv)
+
+    with open(options.before) as before, open(options.after) as after:
+        rows = compare(json.load(before), json.load(after),
+                       options.threshold)
+    print('%-40s %12s %12s %8s' % (
+        'result', 'before ms', 'after ms', 'change'))
+    regressions = 0
+    for key, old, new, ratio, regressed in rows:
+        name = ' '.join(str(value) for _, value in key)
+        print('%-40s %12.3f %12.3f %+7.1f%%%s' % (
+            name[:40], old * 1000, new * 1000, (ratio - 1) * 100,
+            '  <- slower' if regressed else ''))
+        regressions += regressed
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,219 @@
+"""
+This is the static asset pipeline.
+
+The stylesheets and scripts of each page are concatenated into one
+bundle per page, minified, and written under a name carrying a hash
+of their content next to a gzipped copy.  Since a bundle's name
+changes with its content, clients can cache it forever, and the
+gzipped copy is made once at build time instead of on every request.
+
+build() runs at deploy time (see tools/build_assets.py), and the
+manifest it writes maps each bundle to its current file.  Without
+a manifest the pages fall back to the source files.
+
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+
+try:
+    from rcssmin import cssmin
+except ImportError:
+    cssmin = None
+try:
+    from rjsmin import jsmin
+except ImportError:
+    jsmin = None
+
+# Bundle name -> source files, relative to the static directory
+BUNDLES = {
+    'main.css': ['css/main.css'],
+    'form.css': ['css/form.css'],
+    'app.js': ['js/ui-bootstrap-tpls-0.6.0.js', 'js/controllers.js'],
+}
+MANIFEST = 'manifest.json'
+DIST_URL = '/assets/'
+
+IMPORT = re.compile(r'''@import\s+url\(\s*['"]?([^'")]+)['"]?\s*\)\s*;?''')
+COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+
+_state = {'manifest': {}}
+
+
+def readCSS(path, remoteImports):
+    """Return a stylesheet with its local imports inlined.
+
+    Imports of other sites must come first in a stylesheet, so
+    they are taken out and collected instead.
+
+    :param path: the path of the stylesheet
+    :type path: str
+    :param remoteImports: where to collect imports of other sites
+    :type remoteImports: list
+    :returns: the stylesheet
+    :rtype: str
+
+    """
+
+    with open(path, encoding='utf-8') as cssFile:
+        css = cssFile.read()
+
+    def inline(match):
+        url = match.group(1)
+        if '//' in url or ':' in url:
+            if match.group(0) not in remoteImports:
+                remoteImports.append(match.group(0).rstrip(';') + ';')
+            return ''
+        return readCSS(os.path.join(os.path.dirname(path), url),
+                       remoteImports)
+
+    return IMPORT.sub(inline, css)
+
+
+def minifyCSS(css):
+    """Return a minified stylesheet.
+
+    Without rcssmin, only comments and extra whitespace go.
+
+    """
+
+    if cssmin is not None:
+        return cssmin(css, keep_bang_comments=True)
+    css = COMMENT.sub('', css)
+    css = re.sub(r'\s+', ' ', css)
+    # Not around ':', where a space can be a descendant combinator
+    return re.sub(r'\s*([{};,>])\s*', r'\1', css).strip()
+
+
+def minifyJS(js):
+    """Return a minified script, or the same script without rjsmin.
+
+    rjsmin only removes comments and whitespace, so the argument
+    names AngularJS injects by are kept.
+
+    """
+
+    if jsmin is not None:
+        return jsmin(js, keep_bang_comments=True)
+    return js
+
+
+def bundle(staticDir, sources):
+    """Return the concatenated, minified content of some sources.
+
+    :param staticDir: the static directory
+    :type staticDir: str
+    :param sources: the source files, relative to staticDir
+    :type sources: list
+    :returns: the bundle
+    :rtype: bytes
+
+    """
+
+    if sources[0].endswith('.css'):
+        remoteImports = []
+        css = '\n'.join(readCSS(os.path.join(staticDir, source),
+                                remoteImports) for source in sources)
+        return '\n'.join(remoteImports + [minifyCSS(css)]).encode('utf-8')
+
+    scripts = []
+    for source in sources:
+        with open(os.path.join(staticDir, source), encoding='utf-8') as js:
+            scripts.append(minifyJS(js.read()))
+    # A semicolon keeps one script's last statement out of the next
+    return ';\n'.join(scripts).encode('utf-8')
+
+
+def gzipped(data):
+    """Return data gzipped the same way every time.
+
+    :param data: the data to compress
+    :type data: bytes
+    :returns: the compressed data
+    :rtype: bytes
+
+    """
+
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9,
+                       mtime=0) as gz:
+        gz.write(data)
+    return out.getvalue()
+
+
+def build(staticDir, distDir):
+    """Write every bundle, its gzipped copy and the manifest.
+
+    Files of earlier builds are removed.
+
+    :param staticDir: the static directory
+    :type staticDir: str
+    :param distDir: where to write the bundles
+    :type distDir: str
+    :returns: the manifest
+    :rtype: dict
+
+    """
+
+    if not os.path.isdir(distDir):
+        os.makedirs(distDir)
+    manifest = {}
+    for name, sources in sorted(BUNDLES.items()):
+        data = bundle(staticDir, sources)
+        stem, ext = os.path.splitext(name)
+        digest = hashlib.sha1(data).hexdigest()[:10]
+        fileName = '%s.%s%s' % (stem, digest, ext)
+        with open(os.path.join(distDir, fileName), 'wb') as out:
+            out.write(data)
+        with open(os.path.join(distDir, fileName + '.gz'), 'wb') as out:
+            out.write(gzipped(data))
+        manifest[name] = fileName
+
+    current = set(manifest.values())
+    current |= set(fileName + '.gz' for fileName in manifest.values())
+    for fileName in os.listdir(distDir):
+        if fileName != MANIFEST and fileName not in current:
+            os.remove(os.path.join(distDir, fileName))
+    with open(os.path.join(distDir, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+    return manifest
+
+
+def loadManifest(distDir):
+    """Read the manifest of the last build, if there is one.
+
+    :param distDir: where the bundles are
+    :type distDir: str
+    :returns: the manifest
+    :rtype: dict
+
+    """
+
+    try:
+        with open(os.path.join(distDir, MANIFEST)) as manifestFile:
+            _state['manifest'] = json.load(manifestFile)
+    except (IOError, ValueError):
+        _state['manifest'] = {}
+    return _state['manifest']
+
+
+def urls(name):
+    """Return the urls to load a bundle with.
+
+    This is the built bundle when there is one, else its sources.
+
+    :param name: the name of the bundle
+    :type name: str
+    :returns: the urls
+    :rtype: list
+
+    """
+
+    fileName = _state['manifest'].get(name)
+    if fileName is not None:
+        return [DIST_URL + fileName]
+    return ['/' + source for source in BUNDLES[name]]
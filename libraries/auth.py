@@ -0,0 +1,160 @@
+"""
+This is cork with a short-lived cache of authenticated users.
+
+Through the MongoDB backend, every cork require() and current_user
+reads the user and its role from the database.  The session cookie
+is already validated by beaker, so once cork has accepted the user
+of a session, that user and role are kept for a few seconds and
+later requests of the session skip the database altogether.
+
+Password hashing, slow on purpose, can also be run on a bounded
+executor so a burst of logins cannot take over the worker.  That
+pays off with scrypt or another costly hash: cork's PBKDF2 runs
+only 10 iterations, cheaper than handing it to another thread.
+
+"""
+
+from cork import AuthException, Cork
+from cork.cork import User
+
+
+class CachedCork(Cork):
+
+    """
+    This class is cork with an authenticated user cache.
+
+    Anything that changes a user (logout, password reset, role
+    change, deletion) drops that user from the cache, and role
+    changes drop everyone since levels may have moved.  With a
+    hashPool, every password hash runs on it and raises Overloaded
+    when it is full.
+
+    """
+
+    def __init__(self, authCache, *args, **kwargs):
+        self.hashPool = kwargs.pop('hashPool', None)
+        super(CachedCork, self).__init__(*args, **kwargs)
+        self.authCache = authCache
+
+    def require_username(self, fail_redirect=None):
+        """Ensure the user is logged in and return the user name.
+
+        This is require() without a role, answered from the cache
+        when the session's user was recently authenticated.
+
+        :param fail_redirect: redirect unauthorized users (optional)
+        :type fail_redirect: str
+        :returns: the user name of the current user
+        :rtype: str
+
+        """
+
+        session = self._beaker_session
+        sessionUser = session.get('username') if session is not None else None
+        if sessionUser is not None:
+            user = self.authCache.get(sessionUser, 'user')
+            if user is not None:
+                return user['username']
+
+        self.require(fail_redirect=fail_redirect)
+        cu = self.current_user
+        self.authCache.set(cu.username, 'user',
+                           {'username': cu.username, 'role': cu.role,
+                            'level': cu.level})
+        return cu.username
+
+    def invalidate(self, username):
+        """Drop a user from the cache.
+
+        :param username: the name of the user
+        :type username: str
+        :returns: (nothing)
+
+        """
+
+        if username is not None:
+            self.authCache.invalidate(username)
+
+    @property
+    def current_user(self):
+        """Current authenticated user, as cork's current_user."""
+
+        session = self._beaker_session
+        username = session.get('username', None)
+        if username is None:
+            raise AuthException("Unauthenticated user")
+        if username in self._store.users:
+            return CachedUser(username, self, session=session)
+        raise AuthException("Unknown user: %s" % username)
+
+    def user(self, username):
+        """Existing user, as cork's user()."""
+
+        if username is not None and username in self._store.users:
+            return CachedUser(username, self)
+        return None
+
+    def logout(self, success_redirect='/login', fail_redirect='/login'):
+        """Log the user out and drop it from the cache."""
+
+        session = self._beaker_session
+        if session is not None:
+            self.invalidate(session.get('username'))
+        super(CachedCork, self).logout(success_redirect, fail_redirect)
+
+    def register(self, *args, **kwargs):
+        """Register a new user, admitted to the hash pool up front.
+
+        Cork sends the registration email before hashing, so the
+        hash must not be the step that gets refused.
+
+        """
+
+        if self.hashPool is None:
+            return super(CachedCork, self).register(*args, **kwargs)
+        with self.hashPool.admit():
+            return super(CachedCork, self).register(*args, **kwargs)
+
+    def _hash_pbkdf2(self, username, pwd, salt=None):
+        return self.runHash(Cork._hash_pbkdf2, username, pwd, salt)
+
+    def _hash_scrypt(self, username, pwd, salt=None):
+        return self.runHash(Cork._hash_scrypt, username, pwd, salt)
+
+    def runHash(self, hashFunction, username, pwd, salt):
+        """Run a password hash on the hash pool, if there is one."""
+
+        if self.hashPool is None:
+            return hashFunction(username, pwd, salt=salt)
+        return self.hashPool.run(hashFunction, username, pwd, salt=salt)
+
+    def create_role(self, role, level):
+        """Create a new role and drop every cached user."""
+
+        super(CachedCork, self).create_role(role, level)
+        self.authCache.clear()
+
+    def delete_role(self, role):
+        """Delete a role and drop every cached user."""
+
+        super(CachedCork, self).delete_role(role)
+        self.authCache.clear()
+
+
+class CachedUser(User):
+
+    """
+    This class is cork's user, dropping itself from the cache.
+
+    Password resets, role changes and deletions all go through
+    update or delete here.
+
+    """
+
+    def update(self, role=None, pwd=None, email_addr=None):
+        super(CachedUser, self).update(role, pwd, email_addr)
+        self._cork.invalidate(self.username)
+
+    def delete(self):
+        super(CachedUser, self).delete()
+        self._cork.invalidate(self.username)
@@ -0,0 +1,182 @@
+"""
+This is a small caching layer with pluggable backends.
+
+Entries live in namespaces (such as a user name) so everything
+cached for one namespace can be dropped at once.  CacheBackend is
+the interface; LRUCache implements it inside the worker process,
+and a cache shared by all workers (memcached, redis, ...) only
+has to implement the same three methods.
+
+"""
+
+from collections import OrderedDict
+from libraries.metrics import REGISTRY
+import threading
+import time
+
+HITS = REGISTRY.counter('cache_hits_total', 'Cache lookups that hit.',
+                        ('cache',))
+MISSES = REGISTRY.counter('cache_misses_total', 'Cache lookups that missed.',
+                          ('cache',))
+EVICTIONS = REGISTRY.counter('cache_evictions_total',
+                             'Entries evicted to stay under the limits.',
+                             ('cache',))
+ENTRIES = REGISTRY.gauge('cache_entries', 'Entries in the cache.',
+                         ('cache',))
+SIZE = REGISTRY.gauge('cache_bytes', 'Approximate size of the cache.',
+                      ('cache',))
+
+
+class CacheBackend(object):
+
+    """
+    The interface every cache backend implements.
+
+    Values handed to set must not be changed afterwards, and
+    values returned by get must not be changed by the caller.
+    Values bigger than maxEntryBytes are not worth caching.
+
+    """
+
+    maxEntryBytes = 1024 * 1024
+
+    def get(self, namespace, key):
+        """Return the cached value, or None if there is none.
+
+        :param namespace: the namespace of the entry
+        :type namespace: str
+        :param key: the key of the entry within the namespace
+        :type key: str
+        :returns: the cached value
+        :rtype: object
+
+        """
+
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, size=1):
+        """Cache a value.
+
+        :param namespace: the namespace of the entry
+        :type namespace: str
+        :param key: the key of the entry within the namespace
+        :type key: str
+        :param value: the value to cache
+        :type value: object
+        :param size: the approximate size of the value in bytes
+        :type size: int
+        :returns: (nothing)
+
+        """
+
+        raise NotImplementedError
+
+    def invalidate(self, namespace):
+        """Drop every entry of a namespace.
+
+        :param namespace: the namespace to drop
+        :type namespace: str
+        :returns: (nothing)
+
+        """
+
+        raise NotImplementedError
+
+    def clear(self):
+        """Drop every entry of every namespace.
+
+        :returns: (nothing)
+
+        """
+
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+
+    """
+    An in-process cache with least recently used eviction.
+
+    It is bounded by the number of entries and by their total
+    size, and entries expire after a time to live.  It is safe
+    to use from several threads.
+
+    """
+
+    def __init__(self, name, maxEntries=1000, maxBytes=32 * 1024 * 1024,
+                 ttl=300, maxEntryBytes=1024 * 1024):
+        self.name = name
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.maxEntryBytes = min(maxEntryBytes, maxBytes)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # (namespace, key) -> (value, size, expires), oldest first
+        self.entries = OrderedDict()
+        self.namespaces = {}
+        self.size = 0
+
+    def get(self, namespace, key):
+        with self.lock:
+            entry = self.entries.get((namespace, key))
+            if entry is not None and entry[2] < time.time():
+                self.remove((namespace, key))
+                entry = None
+            if entry is None:
+                MISSES.inc(cache=self.name)
+                return None
+            self.entries.move_to_end((namespace, key))
+        HITS.inc(cache=self.name)
+        return entry[0]
+
+    def set(self, namespace, key, value, size=1):
+        if size > self.maxEntryBytes:
+            return
+        with self.lock:
+            if (namespace, key) in self.entries:
+                self.remove((namespace, key))
+            self.entries[(namespace, key)] = (value, size,
+                                              time.time() + self.ttl)
+            self.namespaces.setdefault(namespace, set()).add(key)
+            self.size += size
+            while len(self.entries) > self.maxEntries or \
+                    self.size > self.maxBytes:
+                self.remove(next(iter(self.entries)))
+                EVICTIONS.inc(cache=self.name)
+            self.updateGauges()
+
+    def invalidate(self, namespace):
+        with self.lock:
+            for key in list(self.namespaces.get(namespace, ())):
+                self.remove((namespace, key))
+            self.updateGauges()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.namespaces.clear()
+            self.size = 0
+            self.updateGauges()
+
+    def remove(self, entryKey):
+        """Remove an entry, with the lock held.
+
+        :param entryKey: the namespace and key of the entry
+        :type entryKey: tuple
+        :returns: (nothing)
+
+        """
+
+        value, size, expires = self.entries.pop(entryKey)
+        self.size -= size
+        namespace, key = entryKey
+        keys = self.namespaces[namespace]
+        keys.discard(key)
+        if not keys:
+            del self.namespaces[namespace]
+
+    def updateGauges(self):
+        """Publish the number of entries and size, with the lock held."""
+
+        ENTRIES.set(len(self.entries), cache=self.name)
+        SIZE.set(self.size, cache=self.name)
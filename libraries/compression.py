@@ -0,0 +1,285 @@
+"""
+This is WSGI middleware compressing responses with gzip or deflate.
+
+Only text that is big enough is compressed: the start of the body
+is held back until it reaches the minimum size, and anything
+smaller goes out as it is.  Streamed bodies stay streamed, each
+chunk is compressed and flushed as it comes, so a large export
+still starts arriving right away.  Responses that are already
+encoded (such as the prebuilt bundles) are passed through.
+Every response of a type that is compressed varies on
+Accept-Encoding, whether or not this one was, so shared caches
+don't hand an uncompressed copy to every client or the reverse.
+
+"""
+
+from libraries.metrics import REGISTRY
+import time
+import zlib
+
+COMPRESSIBLE = ('application/json', 'application/javascript', 'text/')
+
+BYTES_IN = REGISTRY.counter('compression_bytes_in_total',
+                            'Bytes of responses before compression.',
+                            ('encoding',))
+BYTES_OUT = REGISTRY.counter('compression_bytes_out_total',
+                             'Bytes of responses after compression.',
+                             ('encoding',))
+RATIO = REGISTRY.histogram('compression_ratio',
+                           'Compressed size over original size.',
+                           ('encoding',),
+                           buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6,
+                                    0.8, 1.0))
+CPU_TIME = REGISTRY.histogram('compression_cpu_seconds',
+                              'CPU time spent compressing a response.',
+                              ('encoding',),
+                              buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005,
+                                       0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+SKIPPED = REGISTRY.counter('compression_skipped_total',
+                           'Responses sent uncompressed.', ('reason',))
+
+
+def chooseEncoding(acceptEncoding):
+    """Return the encoding to use for an Accept-Encoding header.
+
+    :param acceptEncoding: the Accept-Encoding header of the request
+    :type acceptEncoding: str
+    :returns: 'gzip', 'deflate' or None
+    :rtype: str
+
+    """
+
+    accepted = {}
+    for part in acceptEncoding.lower().split(','):
+        pieces = part.strip().split(';')
+        quality = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[pieces[0].strip()] = quality
+    for encoding in ('gzip', 'deflate'):
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def headerValue(headers, name):
+    """Return a header of a response, or '' if it has none."""
+
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return ''
+
+
+def compressible(headers):
+    """Return whether a response is of a type that is compressed."""
+
+    return headerValue(headers, 'Content-Type').startswith(COMPRESSIBLE) \
+        and 'no-transform' not in headerValue(headers, 'Cache-Control')
+
+
+def varyOnEncoding(headers):
+    """Return the headers with Accept-Encoding added to Vary."""
+
+    vary = [value for key, value in headers if key.lower() == 'vary']
+    if any('accept-encoding' in value.lower() or value.strip() == '*'
+           for value in vary):
+        return list(headers)
+    headers = [(key, value) for key, value in headers
+               if key.lower() != 'vary']
+    headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+    return headers
+
+
+class CompressionMiddleware(object):
+
+    """
+    This class compresses the responses of a WSGI application.
+
+    :param app: the application to wrap
+    :param minimumSize: smallest body worth compressing, in bytes
+    :param level: the zlib compression level, 1 (fast) to 9 (small)
+
+    """
+
+    def __init__(self, app, minimumSize=1024, level=6):
+        self.app = app
+        self.minimumSize = minimumSize
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        encoding = chooseEncoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+
+            def varyingStartResponse(status, headers, exc_info=None):
+                if compressible(headers):
+                    headers = varyOnEncoding(headers)
+                return start_response(status, headers, exc_info)
+
+            return self.app(environ, varyingStartResponse)
+        response = CompressedResponse(self, encoding, start_response)
+        body = self.app(environ, response.start_response)
+        return response.iterate(body)
+
+
+class CompressedResponse(object):
+
+    """
+    This class holds back the start of one response.
+
+    The application's start_response is recorded, and the real one
+    is called once enough of the body is known to decide.
+
+    """
+
+    def __init__(self, middleware, encoding, start_response):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.realStartResponse = start_response
+        self.status = None
+        self.headers = None
+        self.excInfo = None
+        self.written = []
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = list(headers)
+        self.excInfo = exc_info
+        return self.written.append
+
+    def header(self, name):
+        """Return a header of the response, or '' if it has none."""
+
+        return headerValue(self.headers, name)
+
+    def skipReason(self):
+        """Return why the response is not compressed, or None."""
+
+        if self.status[:3] in ('204', '206', '304') or \
+                self.status[0] in '13':
+            return 'status'
+        if self.header('Content-Encoding'):
+            return 'encoded'
+        if 'no-transform' in self.header('Cache-Control'):
+            return 'no-transform'
+        if not self.header('Content-Type').startswith(COMPRESSIBLE):
+            return 'type'
+        length = self.header('Content-Length')
+        if length.isdigit() and int(length) < self.middleware.minimumSize:
+            return 'size'
+        return None
+
+    def iterate(self, body):
+        """Yield the body of the response, compressed if worth it."""
+
+        try:
+            chunks = iter(body)
+            buffered = list(self.written)
+            size = sum(len(chunk) for chunk in buffered)
+            finished = False
+            # Hold back the start of the body to know if it is big enough
+            while size < self.middleware.minimumSize:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    finished = True
+                    break
+                buffered.append(chunk)
+                size += len(chunk)
+
+            reason = self.skipReason()
+            if reason is None and finished and \
+                    size < self.middleware.minimumSize:
+                reason = 'size'
+            if reason is not None:
+                SKIPPED.inc(reason=reason)
+                headers = self.headers
+                if compressible(headers):
+                    headers = varyOnEncoding(headers)
+                self.realStartResponse(self.status, headers, self.excInfo)
+                for chunk in buffered:
+                    yield chunk
+                for chunk in chunks:
+                    yield chunk
+                return
+
+            self.realStartResponse(self.status, self.compressedHeaders(),
+                                   self.excInfo)
+            for chunk in self.compress(buffered, chunks, finished):
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    def compressedHeaders(self):
+        """Return the headers of the compressed response."""
+
+        headers = []
+        for key, value in self.headers:
+            lower = key.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag' and not value.startswith('W/'):
+                # The bytes differ from the uncompressed ones
+                value = 'W/' + value
+            headers.append((key, value))
+        headers = varyOnEncoding(headers)
+        headers.append(('Content-Encoding', self.encoding))
+        return headers
+
+    def compress(self, buffered, chunks, finished):
+        """Yield the compressed body, a flushed piece per chunk.
+
+        :param buffered: the chunks already read
+        :type buffered: list
+        :param chunks: the rest of the body
+        :type chunks: iterator
+        :param finished: whether buffered is the whole body
+        :type finished: bool
+        :returns: the compressed pieces
+        :rtype: generator of bytes
+
+        """
+
+        # gzip has a header and trailer, deflate is a bare zlib stream
+        wbits = 31 if self.encoding == 'gzip' else 15
+        compressor = zlib.compressobj(self.middleware.level, zlib.DEFLATED,
+                                      wbits)
+        sizeIn = 0
+        sizeOut = 0
+        cpu = 0.0
+
+        def pieces():
+            yield b''.join(buffered)
+            if not finished:
+                for chunk in chunks:
+                    yield chunk
+
+        for chunk in pieces():
+            if not chunk:
+                continue
+            started = time.thread_time()
+            out = compressor.compress(chunk) + \
+                compressor.flush(zlib.Z_SYNC_FLUSH)
+            cpu += time.thread_time() - started
+            sizeIn += len(chunk)
+            sizeOut += len(out)
+            if out:
+                yield out
+        started = time.thread_time()
+        out = compressor.flush()
+        cpu += time.thread_time() - started
+        sizeOut += len(out)
+        yield out
+
+        BYTES_IN.inc(sizeIn, encoding=self.encoding)
+        BYTES_OUT.inc(sizeOut, encoding=self.encoding)
+        if sizeIn:
+            RATIO.observe(float(sizeOut) / sizeIn, encoding=self.encoding)
+        CPU_TIME.observe(cpu, encoding=self.encoding)
@@ -0,0 +1,152 @@
+"""
+This is a thread pool that refuses work instead of piling it up.
+
+Some work is slow on purpose (password hashing) and a burst of it
+must not hold up everything else a worker does.  BoundedExecutor
+runs such work on a few threads of its own and admits only as
+many tasks as it has threads plus a short queue; anything beyond
+that raises Overloaded right away so the caller can shed load.
+Work nobody waits for, like explaining slow queries, can be
+submitted to such a pool the same way.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from libraries.metrics import REGISTRY
+import os
+import threading
+import time
+
+QUEUED = REGISTRY.gauge('executor_queue_depth',
+                        'Tasks waiting for a thread of the pool.', ('pool',))
+RUNNING = REGISTRY.gauge('executor_running',
+                         'Tasks running on the pool.', ('pool',))
+REJECTED = REGISTRY.counter('executor_rejected_total',
+                            'Tasks refused because the pool was full.',
+                            ('pool',))
+WAIT = REGISTRY.histogram('executor_wait_seconds',
+                          'Time tasks waited for a thread.', ('pool',))
+DURATION = REGISTRY.histogram('executor_task_seconds',
+                              'Time tasks ran on the pool.', ('pool',))
+
+
+class Overloaded(Exception):
+
+    """Raised when a pool has no room for another task."""
+
+
+class BoundedExecutor(object):
+
+    """
+    This class runs tasks on a pool of threads with admission control.
+
+    A caller holding a slot (through admit) is not asked for another
+    one, so a whole operation can be admitted up front and the slow
+    steps inside it still run on the pool.  The threads are created
+    lazily per process, so an executor made before a fork is safe.
+
+    """
+
+    def __init__(self, name, maxWorkers=2, maxQueued=8):
+        self.name = name
+        self.maxWorkers = maxWorkers
+        self.maxQueued = maxQueued
+        self.slots = threading.BoundedSemaphore(maxWorkers + maxQueued)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pid = None
+
+    def getPool(self):
+        """Return the thread pool of the current process."""
+
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pool = ThreadPoolExecutor(
+                    self.maxWorkers, thread_name_prefix=self.name)
+                self.pid = os.getpid()
+            return self.pool
+
+    @contextmanager
+    def admit(self):
+        """Hold a slot of the pool for the current thread.
+
+        :raises: Overloaded if every slot is taken
+
+        """
+
+        if getattr(self.local, 'admitted', False):
+            yield
+            return
+        self.takeSlot()
+        self.local.admitted = True
+        try:
+            yield
+        finally:
+            self.local.admitted = False
+            self.slots.release()
+
+    def takeSlot(self):
+        """Take a slot of the pool.
+
+        :raises: Overloaded if every slot is taken
+
+        """
+
+        if not self.slots.acquire(False):
+            REJECTED.inc(pool=self.name)
+            raise Overloaded('The %s pool is full.' % self.name)
+
+    def run(self, fn, *args, **kwargs):
+        """Run a function on the pool and wait for its result.
+
+        :param fn: the function to run
+        :type fn: callable
+        :returns: what the function returns
+        :raises: Overloaded if every slot is taken
+
+        """
+
+        with self.admit():
+            QUEUED.inc(pool=self.name)
+            return self.getPool().submit(self.call, time.time(), fn,
+                                         args, kwargs).result()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run a function on the pool without waiting for it.
+
+        The task holds its slot until it is done.
+
+        :param fn: the function to run
+        :type fn: callable
+        :returns: the future of the task
+        :rtype: Future
+        :raises: Overloaded if every slot is taken
+
+        """
+
+        self.takeSlot()
+        try:
+            QUEUED.inc(pool=self.name)
+            future = self.getPool().submit(self.call, time.time(), fn,
+                                           args, kwargs)
+        except Exception:
+            QUEUED.dec(pool=self.name)
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future: self.slots.release())
+        return future
+
+    def call(self, queued, fn, args, kwargs):
+        """Run a task on a thread of the pool, keeping the metrics."""
+
+        QUEUED.dec(pool=self.name)
+        RUNNING.inc(pool=self.name)
+        started = time.time()
+        WAIT.observe(started - queued, pool=self.name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DURATION.observe(time.time() - started, pool=self.name)
+            RUNNING.dec(pool=self.name)
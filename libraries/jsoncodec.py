@@ -0,0 +1,249 @@
+"""
+This is the JSON codec the application encodes and decodes with.
+
+It speaks MongoDB extended JSON like bson's json_util (ObjectIds as
+{"$oid": ...}, dates as {"$date": ...}) but takes shortcuts where it
+can: ObjectIds are converted directly instead of going through
+json_util's chain of type checks, and payloads without any "$" in
+them are decoded without an object hook, since there is nothing
+extended in them to convert.
+
+The backend is orjson when it is installed and the standard json
+module otherwise, which writes and reads exactly what json.dumps
+and json.loads always have.  orjson writes compact JSON with
+non-ASCII text left as UTF-8, refuses NaN and Infinity and reads
+integers past 64 bits as floats; the json backend can be asked to
+do the same (matchOrjson), so both give the same bytes and values.
+The one difference left then is floats with an exponent, which
+orjson writes as 1e16 where json writes 1e+16: the same number.
+
+"""
+
+from bson import json_util
+from bson.objectid import ObjectId
+import json
+import math
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The integers orjson reads as integers, not floats
+INT_RANGE = (-2 ** 63, 2 ** 64 - 1)
+
+
+def default(o):
+    """Return the extended JSON of what json cannot encode itself.
+
+    :param o: the object to encode
+    :returns: its extended JSON form
+    :rtype: dict
+    :raises: TypeError for objects extended JSON has no form for
+
+    """
+
+    if type(o) is ObjectId:
+        return {'$oid': str(o)}
+    return json_util.default(o)
+
+
+def applyHook(o):
+    """Convert the extended JSON of already parsed data, bottom up.
+
+    :param o: the parsed data
+    :returns: the data with extended JSON converted
+    """
+
+    if type(o) is dict:
+        for key, value in o.items():
+            if type(value) in (dict, list):
+                o[key] = applyHook(value)
+        return json_util.object_hook(o)
+    if type(o) is list:
+        return [applyHook(item) if type(item) in (dict, list) else item
+                for item in o]
+    return o
+
+
+def hasNonFinite(o):
+    """Check if data holds a NaN or infinite float anywhere.
+
+    :param o: the data
+    :returns: whether a float in it is not finite
+    :rtype: bool
+
+    """
+
+    if type(o) is float:
+        return not math.isfinite(o)
+    if isinstance(o, dict):
+        return any(hasNonFinite(value) for value in o.values())
+    if isinstance(o, (list, tuple)):
+        return any(hasNonFinite(item) for item in o)
+    return False
+
+
+def rejectConstant(name):
+    """Refuse NaN and Infinity when decoding, as orjson does."""
+
+    raise ValueError('%s is not valid JSON.' % name)
+
+
+def parseFloat(s):
+    """Read a float, refusing one too big to be finite, as orjson does."""
+
+    value = float(s)
+    if math.isinf(value):
+        raise ValueError('%s is too big for a float.' % s)
+    return value
+
+
+def parseInt(s):
+    """Read an integer, as a float past 64 bits, as orjson does."""
+
+    value = int(s)
+    if not INT_RANGE[0] <= value <= INT_RANGE[1]:
+        return parseFloat(s)
+    return value
+
+
+def isExtended(s):
+    """Check if a JSON text may hold extended JSON.
+
+    Every extended JSON key starts with "$", so text without one
+    has nothing to convert.
+
+    """
+
+    return ('$' in s) if isinstance(s, str) else (b'$' in s)
+
+
+class StdlibBackend(object):
+
+    """
+    The codec on the standard json module.
+
+    :param matchOrjson: write and read JSON the way orjson does,
+                        instead of the way json.dumps and json.loads do
+
+    """
+
+    name = 'json'
+
+    def __init__(self, matchOrjson=False):
+        if matchOrjson:
+            self.encoder = json.JSONEncoder(
+                default=default, ensure_ascii=False, allow_nan=False,
+                separators=(',', ':'))
+            numbers = {'parse_float': parseFloat, 'parse_int': parseInt,
+                       'parse_constant': rejectConstant}
+        else:
+            self.encoder = json.JSONEncoder(default=default)
+            numbers = {}
+        self.decoder = json.JSONDecoder(**numbers)
+        self.hookDecoder = json.JSONDecoder(
+            object_hook=json_util.object_hook, **numbers)
+
+    def dumps(self, o):
+        return self.encoder.encode(o)
+
+    def loads(self, s):
+        if isinstance(s, bytes):
+            s = s.decode('utf-8')
+        if isExtended(s):
+            return self.hookDecoder.decode(s)
+        return self.decoder.decode(s)
+
+
+class OrjsonBackend(object):
+
+    """
+    The codec on orjson, with dates left to extended JSON.
+
+    What orjson writes differently from json is handed to the json
+    backend (integers past 64 bits) or refused like json refuses it
+    (NaN and Infinity, which orjson writes as null).
+
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME | \
+            orjson.OPT_NON_STR_KEYS
+        self.fallback = StdlibBackend(matchOrjson=True)
+
+    def dumps(self, o):
+        try:
+            data = orjson.dumps(o, default=default, option=self.options)
+        except orjson.JSONEncodeError:
+            return self.fallback.dumps(o)
+        if b'null' in data and hasNonFinite(o):
+            raise ValueError('NaN and Infinity are not valid JSON.')
+        return data.decode('utf-8')
+
+    def loads(self, s):
+        data = orjson.loads(s)
+        if isExtended(s):
+            return applyHook(data)
+        return data
+
+
+BACKENDS = {'json': StdlibBackend}
+if orjson is not None:
+    BACKENDS['orjson'] = OrjsonBackend
+
+_state = {'backend': None}
+
+
+def use(name='auto', matchOrjson=False):
+    """Choose the backend, 'auto' for the fastest one installed.
+
+    :param name: 'auto', 'json' or 'orjson'
+    :type name: str
+    :param matchOrjson: have the json backend write and read JSON the
+                        way the orjson one does (for the same output
+                        whether or not orjson is installed)
+    :type matchOrjson: bool
+    :returns: the backend
+    :raises: ValueError if that backend is not installed
+
+    """
+
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in BACKENDS else 'json'
+    if name not in BACKENDS:
+        raise ValueError('The %s JSON backend is not installed.' % name)
+    if name == 'json':
+        _state['backend'] = StdlibBackend(matchOrjson)
+    else:
+        _state['backend'] = BACKENDS[name]()
+    return _state['backend']
+
+
+def dumps(o):
+    """Return the JSON of an object.
+
+    :param o: the object to encode
+    :returns: its JSON
+    :rtype: str
+
+    """
+
+    return _state['backend'].dumps(o)
+
+
+def loads(s):
+    """Return the object of some JSON.
+
+    :param s: the JSON to decode
+    :type s: str or bytes
+    :returns: the decoded object
+
+    """
+
+    return _state['backend'].loads(s)
+
+
+use()
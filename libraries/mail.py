@@ -0,0 +1,176 @@
+"""
+This is an outbound email queue for cork.
+
+Cork's mailer talks SMTP from the request (or from a new thread per
+email with nothing to bound or retry it).  QueuedMailer only puts
+the message on a bounded queue, and one thread per worker process
+delivers it, retrying with a growing delay when the SMTP server
+fails.  When the queue is full the email is refused right away
+instead of piling up behind a slow server.
+
+"""
+
+from cork.cork import Mailer
+from libraries.metrics import REGISTRY
+from smtplib import SMTP, SMTP_SSL
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+QUEUE_DEPTH = REGISTRY.gauge('email_queue_depth',
+                             'Emails waiting to be delivered.')
+SENT = REGISTRY.counter('email_sent_total', 'Emails delivered.')
+FAILURES = REGISTRY.counter('email_failures_total',
+                            'Failed delivery attempts.', ('outcome',))
+REJECTED = REGISTRY.counter('email_rejected_total',
+                            'Emails refused because the queue was full.')
+LATENCY = REGISTRY.histogram('email_delivery_seconds',
+                             'Time from queueing an email to delivering it.',
+                             buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                                      30.0, 60.0, 300.0))
+
+
+class MailQueueFull(Exception):
+
+    """Raised when an email cannot be queued."""
+
+
+class QueuedMailer(Mailer):
+
+    """
+    This class is cork's mailer with a queue and a delivery thread.
+
+    The thread is started on the first email, so a mailer created
+    before a fork still delivers from the process that uses it.
+
+    """
+
+    def __init__(self, sender, smtp_url, maxQueued=100, retries=3,
+                 retryDelay=10, timeout=30, join_timeout=5):
+        super(QueuedMailer, self).__init__(sender, smtp_url,
+                                           join_timeout=join_timeout,
+                                           use_threads=False)
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.timeout = timeout
+        self.queue = queue.Queue(maxQueued)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _send(self, email_addr, msg):
+        """Queue an email built by send_email.
+
+        :param email_addr: the recipient
+        :type email_addr: str
+        :param msg: the whole message
+        :type msg: str
+        :raises: MailQueueFull if the queue is full
+
+        """
+
+        self.start()
+        try:
+            self.queue.put_nowait((email_addr, msg, time.time()))
+        except queue.Full:
+            REJECTED.inc()
+            raise MailQueueFull('The email queue is full.')
+        QUEUE_DEPTH.set(self.queue.qsize())
+
+    def start(self):
+        """Start the delivery thread if it is not running."""
+
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run,
+                                               name='email-queue')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        """Deliver queued emails, forever."""
+
+        while True:
+            email_addr, msg, queued = self.queue.get()
+            try:
+                self.deliverWithRetries(email_addr, msg)
+                SENT.inc()
+                LATENCY.observe(time.time() - queued)
+            except Exception:
+                FAILURES.inc(outcome='dropped')
+                log.exception('Giving up on an email to %s', email_addr)
+            finally:
+                self.queue.task_done()
+                QUEUE_DEPTH.set(self.queue.qsize())
+
+    def deliverWithRetries(self, email_addr, msg):
+        """Deliver an email, retrying with a doubling delay.
+
+        :param email_addr: the recipient
+        :type email_addr: str
+        :param msg: the whole message
+        :type msg: str
+        :raises: the last error once the retries are used up
+
+        """
+
+        attempt = 0
+        while True:
+            try:
+                return self.deliver(email_addr, msg)
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+                FAILURES.inc(outcome='retried')
+                log.warning('Email to %s failed, retrying', email_addr,
+                            exc_info=True)
+                time.sleep(self.retryDelay * 2 ** attempt)
+                attempt += 1
+
+    def deliver(self, email_addr, msg):
+        """Deliver an email over SMTP, letting errors through.
+
+        :param email_addr: the recipient
+        :type email_addr: str
+        :param msg: the whole message
+        :type msg: str
+        :returns: (nothing)
+
+        """
+
+        proto = self._conf['proto']
+        if proto == 'ssl':
+            session = SMTP_SSL(self._conf['fqdn'], self._conf['port'],
+                               timeout=self.timeout)
+        else:
+            session = SMTP(self._conf['fqdn'], self._conf['port'],
+                           timeout=self.timeout)
+        try:
+            if proto == 'starttls':
+                session.ehlo()
+                session.starttls()
+                session.ehlo()
+            if self._conf['user']:
+                session.login(self._conf['user'], self._conf['pass'])
+            session.sendmail(self.sender, email_addr, msg)
+        finally:
+            try:
+                session.quit()
+            except Exception:
+                session.close()
+        log.info('Email sent to %s', email_addr)
+
+    def join(self):
+        """Wait up to join_timeout for the queue to drain.
+
+        :returns: whether every queued email was handled
+        :rtype: bool
+
+        """
+
+        deadline = time.time() + self.join_timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        return not self.queue.unfinished_tasks
@@ -0,0 +1,325 @@
+"""
+This is a small, in-process metrics registry.
+
+Counters, gauges and histograms are kept per worker process and
+are safe to update from several threads at once.  Every metric
+can have labels, in which case each combination of label values
+is tracked separately.  The registry renders itself in the
+Prometheus text format for scraping.
+
+"""
+
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric(object):
+
+    """
+    Base class for all metrics.
+
+    It stores the name, documentation and label names, and keeps
+    one value per combination of label values.
+
+    """
+
+    kind = ''
+
+    def __init__(self, name, doc, labelNames=()):
+        self.name = name
+        self.doc = doc
+        self.labelNames = tuple(labelNames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def labelKey(self, labels):
+        """Return the key for the given label values.
+
+        :param labels: the label values
+        :type labels: dict
+        :returns: label values in label name order
+        :rtype: tuple
+
+        """
+
+        return tuple(str(labels.get(name, '')) for name in self.labelNames)
+
+    def samples(self):
+        """Return a copy of the current values.
+
+        :returns: values keyed by label values
+        :rtype: dict
+
+        """
+
+        with self.lock:
+            return dict(self.values)
+
+
+class Counter(Metric):
+
+    """A value that only ever goes up."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter.
+
+        :param amount: how much to add
+        :type amount: float
+        :param labels: the label values
+        :returns: (nothing)
+
+        """
+
+        key = self.labelKey(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    """A value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """Set the gauge to the given value.
+
+        :param value: the new value
+        :type value: float
+        :param labels: the label values
+        :returns: (nothing)
+
+        """
+
+        key = self.labelKey(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        """Increase the gauge.
+
+        :param amount: how much to add
+        :type amount: float
+        :param labels: the label values
+        :returns: (nothing)
+
+        """
+
+        key = self.labelKey(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """Decrease the gauge.
+
+        :param amount: how much to subtract
+        :type amount: float
+        :param labels: the label values
+        :returns: (nothing)
+
+        """
+
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+
+    """
+    A distribution of observed values.
+
+    Each label combination keeps cumulative bucket counts,
+    a count and a sum, the same way Prometheus does.
+
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labelNames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, doc, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record an observed value.
+
+        :param value: the observed value
+        :type value: float
+        :param labels: the label values
+        :returns: (nothing)
+
+        """
+
+        key = self.labelKey(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = {'buckets': [0] * len(self.buckets),
+                         'count': 0, 'sum': 0.0}
+                self.values[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['count'] += 1
+            entry['sum'] += value
+
+    def samples(self):
+        """Return a copy of the current values.
+
+        :returns: values keyed by label values
+        :rtype: dict
+
+        """
+
+        with self.lock:
+            return dict((key, {'buckets': list(entry['buckets']),
+                               'count': entry['count'],
+                               'sum': entry['sum']})
+                        for key, entry in self.values.items())
+
+
+class Registry(object):
+
+    """
+    This class holds every metric of the process.
+
+    Asking for a metric that already exists returns the existing
+    one, so modules can declare their metrics at import time.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metricClass, name, doc, labelNames=(), **kwargs):
+        """Return the named metric, creating it if needed.
+
+        :param metricClass: the type of metric to create
+        :type metricClass: class
+        :param name: the name of the metric
+        :type name: str
+        :param doc: the description of the metric
+        :type doc: str
+        :param labelNames: the names of the labels
+        :type labelNames: tuple
+        :returns: the metric
+        :rtype: Metric
+
+        """
+
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metricClass(name, doc, labelNames, **kwargs)
+                self.metrics[name] = metric
+            return metric
+
+    def counter(self, name, doc, labelNames=()):
+        """Return the named counter."""
+
+        return self.register(Counter, name, doc, labelNames)
+
+    def gauge(self, name, doc, labelNames=()):
+        """Return the named gauge."""
+
+        return self.register(Gauge, name, doc, labelNames)
+
+    def histogram(self, name, doc, labelNames=(), buckets=DEFAULT_BUCKETS):
+        """Return the named histogram."""
+
+        return self.register(Histogram, name, doc, labelNames,
+                             buckets=buckets)
+
+    def collect(self):
+        """Return all metrics sorted by name.
+
+        :returns: the metrics
+        :rtype: list
+
+        """
+
+        with self.lock:
+            return [self.metrics[name] for name in sorted(self.metrics)]
+
+    def exposition(self):
+        """Return every metric in the Prometheus text format.
+
+        :returns: the metrics, one sample per line
+        :rtype: str
+
+        """
+
+        lines = []
+        for metric in self.collect():
+            lines.append('# HELP %s %s' % (metric.name,
+                                           escapeHelp(metric.doc)))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            samples = metric.samples()
+            for key in sorted(samples):
+                labels = list(zip(metric.labelNames, key))
+                value = samples[key]
+                if metric.kind != 'histogram':
+                    lines.append(sampleLine(metric.name, labels, value))
+                    continue
+                bounds = [formatValue(bound) for bound in metric.buckets]
+                for bound, count in zip(bounds, value['buckets']):
+                    lines.append(sampleLine(metric.name + '_bucket',
+                                            labels + [('le', bound)], count))
+                lines.append(sampleLine(metric.name + '_bucket',
+                                        labels + [('le', '+Inf')],
+                                        value['count']))
+                lines.append(sampleLine(metric.name + '_sum', labels,
+                                        value['sum']))
+                lines.append(sampleLine(metric.name + '_count', labels,
+                                        value['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def escapeHelp(text):
+    """Escape the text of a HELP line."""
+
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def escapeLabel(text):
+    """Escape a label value."""
+
+    return escapeHelp(text).replace('"', '\\"')
+
+
+def formatValue(value):
+    """Return a sample value the way Prometheus writes it."""
+
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if isinstance(value, int):
+        return '%d' % value
+    return repr(float(value))
+
+
+def sampleLine(name, labels, value):
+    """Return one line of the exposition.
+
+    :param name: the name of the sample
+    :type name: str
+    :param labels: label names and values
+    :type labels: list of tuples
+    :param value: the value of the sample
+    :type value: float
+    :returns: the line
+    :rtype: str
+
+    """
+
+    if labels:
+        name += '{%s}' % ','.join('%s="%s"' % (label, escapeLabel(text))
+                                  for label, text in labels)
+    return '%s %s' % (name, formatValue(value))
+
+
+REGISTRY = Registry()
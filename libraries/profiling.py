@@ -0,0 +1,236 @@
+"""
+This is the on-demand profiler of a live worker.
+
+Nothing is profiled until an operator asks, and until then the
+only cost is one check per request.  There are two ways to look:
+
+- sampling the worker: a thread takes the stack of every other
+  thread of the worker many times a second, for some seconds, and
+  writes them out as collapsed stacks, the input of flamegraph.pl
+  and speedscope.
+- profiling requests: a fraction of the requests served for some
+  seconds are run under cProfile, each written to a pstats file.
+
+Files go to the configured directory, named after the worker's pid
+so the workers of a server can be told apart.
+
+"""
+
+from collections import Counter
+import cProfile
+import itertools
+import logging
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state = {'outputDir': 'profiles', 'interval': 0.005, 'seconds': 30.0,
+          'requestRate': 0.0, 'requestsUntil': 0.0, 'sampler': None}
+_sequence = itertools.count()
+
+
+def configure(outputDir, interval=0.005, seconds=30.0):
+    """Set where profiles go and how they are taken.
+
+    :param outputDir: the directory to write profiles to
+    :type outputDir: str
+    :param interval: seconds between samples of the worker
+    :type interval: float
+    :param seconds: how long to profile when not told otherwise
+    :type seconds: float
+    :returns: (nothing)
+
+    """
+
+    _state['outputDir'] = outputDir
+    _state['interval'] = interval
+    _state['seconds'] = seconds
+
+
+def outputPath(kind, extension):
+    """Return a new file name for a profile of this worker."""
+
+    if not os.path.isdir(_state['outputDir']):
+        os.makedirs(_state['outputDir'])
+    name = '%s-%d-%s-%d.%s' % (kind, os.getpid(),
+                               time.strftime('%Y%m%d%H%M%S'),
+                               next(_sequence), extension)
+    return os.path.join(_state['outputDir'], name)
+
+
+def frameName(frame):
+    """Return how a frame shows in a collapsed stack."""
+
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class Sampler(threading.Thread):
+
+    """
+    This class samples the stacks of every thread of the worker.
+
+    :param seconds: how long to sample for
+    :param interval: seconds between samples
+
+    """
+
+    def __init__(self, seconds, interval):
+        super(Sampler, self).__init__(name='profiler')
+        self.daemon = True
+        self.seconds = seconds
+        self.interval = interval
+        self.stacks = Counter()
+        self.path = outputPath('worker', 'collapsed')
+
+    def run(self):
+        deadline = time.time() + self.seconds
+        try:
+            while time.time() < deadline:
+                self.sample()
+                time.sleep(self.interval)
+            self.write()
+        finally:
+            with _lock:
+                _state['sampler'] = None
+
+    def sample(self):
+        """Add the current stack of every other thread."""
+
+        names = dict((thread.ident, thread.name)
+                     for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frameName(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread-%d' % ident))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self):
+        """Write the stacks in the collapsed format."""
+
+        with open(self.path, 'w') as out:
+            for stack, count in self.stacks.most_common():
+                out.write('%s %d\n' % (stack, count))
+        log.info('Wrote %d samples of worker %d to %s',
+                 sum(self.stacks.values()), os.getpid(), self.path)
+
+
+def sampleWorker(seconds=None):
+    """Start sampling this worker, unless it already is.
+
+    :param seconds: how long to sample for, None for the configured time
+    :type seconds: float
+    :returns: the file the stacks will be written to, None if busy
+    :rtype: str
+
+    """
+
+    with _lock:
+        if _state['sampler'] is not None:
+            return None
+        sampler = Sampler(seconds or _state['seconds'], _state['interval'])
+        _state['sampler'] = sampler
+    sampler.start()
+    return sampler.path
+
+
+def profileRequests(rate, seconds=None):
+    """Profile a fraction of the requests of this worker for a while.
+
+    :param rate: the fraction of requests to profile, 0 to 1
+    :type rate: float
+    :param seconds: how long to keep going, None for the configured time
+    :type seconds: float
+    :returns: the directory the profiles will be written to
+    :rtype: str
+
+    """
+
+    _state['requestsUntil'] = time.time() + (seconds or _state['seconds'])
+    _state['requestRate'] = rate
+    return _state['outputDir']
+
+
+def install(signum):
+    """Sample the worker whenever it gets a signal.
+
+    Only the worker the signal is sent to is sampled, never the
+    gunicorn master (which takes SIGUSR2 as its own).
+
+    :param signum: the signal to listen to
+    :type signum: int
+    :returns: (nothing)
+
+    """
+
+    def handler(signum, frame):
+        path = sampleWorker()
+        if path is not None:
+            log.info('Sampling worker %d to %s', os.getpid(), path)
+
+    signal.signal(signum, handler)
+
+
+class ProfilingMiddleware(object):
+
+    """
+    This class runs the requests picked for profiling under cProfile.
+
+    :param app: the application to wrap
+
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if not _state['requestRate'] or \
+                random.random() >= _state['requestRate']:
+            return self.app(environ, start_response)
+        if time.time() > _state['requestsUntil']:
+            _state['requestRate'] = 0.0
+            return self.app(environ, start_response)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            body = self.app(environ, start_response)
+        finally:
+            profiler.disable()
+        return self.profiledBody(environ, body, profiler)
+
+    def profiledBody(self, environ, body, profiler):
+        """Yield the body, profiling while each chunk is made."""
+
+        try:
+            chunks = iter(body)
+            while True:
+                profiler.enable()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                finally:
+                    profiler.disable()
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            route = environ.get('bottle.route')
+            rule = route.rule if route is not None else 'unmatched'
+            name = re.sub(r'\W+', '_', rule).strip('_') or 'index'
+            path = outputPath('request-%s-%s' % (
+                environ.get('REQUEST_METHOD', '').lower(), name), 'pstats')
+            profiler.dump_stats(path)
@@ -0,0 +1,111 @@
+"""
+This is the Jinja environment every page is rendered with.
+
+Templates are compiled once per process and their bytecode is kept
+on disk, so a restarted worker loads them instead of parsing them
+again.  Pages whose output only depends on something fixed (such
+as a model's fields) are rendered once and kept with an ETag of
+their bytes.  The environment is set up in the master process, so
+workers forked from it start with every template compiled.
+
+"""
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from libraries import timing
+import hashlib
+import os
+import threading
+
+_lock = threading.Lock()
+_state = {'env': None, 'rendered': {}}
+
+
+def configure(paths, bytecodeDir=None, autoReload=False, globals=None):
+    """Set up the template environment.
+
+    :param paths: the directories holding the templates
+    :type paths: list
+    :param bytecodeDir: where to keep compiled templates (optional)
+    :type bytecodeDir: str
+    :param autoReload: check templates for changes on every use
+    :type autoReload: bool
+    :param globals: values every template can use (optional)
+    :type globals: dict
+    :returns: (nothing)
+
+    """
+
+    bytecodeCache = None
+    if bytecodeDir:
+        if not os.path.isdir(bytecodeDir):
+            os.makedirs(bytecodeDir)
+        bytecodeCache = FileSystemBytecodeCache(bytecodeDir)
+    env = Environment(loader=FileSystemLoader(paths),
+                      bytecode_cache=bytecodeCache, auto_reload=autoReload,
+                      cache_size=-1)
+    env.globals.update(globals or {})
+    with _lock:
+        _state['env'] = env
+        _state['rendered'] = {}
+
+
+def getEnvironment():
+    """Return the template environment, with defaults if not set up."""
+
+    if _state['env'] is None:
+        configure([os.path.join(os.path.dirname(__file__), '..', 'views')])
+    return _state['env']
+
+
+def warm():
+    """Compile every page template ahead of its first request.
+
+    :returns: the names of the compiled templates
+    :rtype: list
+
+    """
+
+    env = getEnvironment()
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+def render(name, **kwargs):
+    """Render a template.
+
+    :param name: the file name of the template
+    :type name: str
+    :returns: the rendered page
+    :rtype: str
+
+    """
+
+    with timing.phase('render'):
+        return getEnvironment().get_template(name).render(**kwargs)
+
+
+def renderMemoized(name, key=(), **kwargs):
+    """Render a template once for a key, with an ETag.
+
+    The key must change whenever the output would, since the
+    values passed in are only used the first time.
+
+    :param name: the file name of the template
+    :type name: str
+    :param key: what the output depends on, hashable
+    :type key: tuple
+    :returns: the rendered bytes and their ETag
+    :rtype: tuple
+
+    """
+
+    rendered = _state['rendered'].get((name, key))
+    if rendered is None:
+        body = render(name, **kwargs).encode('utf-8')
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        rendered = (body, etag)
+        with _lock:
+            _state['rendered'][(name, key)] = rendered
+    return rendered
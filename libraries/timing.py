@@ -0,0 +1,177 @@
+"""
+This is the per-request timing of the application.
+
+A request is split into phases (session decode, authentication,
+mongo queries, serialization, template rendering) and the time of
+each is added up as the request runs.  Phases are kept on the
+thread serving the request, so code anywhere below the middleware
+can time itself without being handed anything.  They are
+exclusive: time in a phase inside another, such as the mongo
+commands cork sends during auth, only counts for the inner one,
+so the phases of a request never add up to more than it took.
+
+The totals go out in a Server-Timing header and into per-route
+histograms.  The header is sent with the rest of the headers, so
+for a streamed body (the address list, the CSV exports) it only
+covers the time up to the first byte; the histograms are only
+observed once the body is sent, so they cover the whole request.
+
+"""
+
+from contextlib import contextmanager
+from libraries.metrics import REGISTRY
+import threading
+import time
+
+REQUEST_TIME = REGISTRY.histogram('http_request_seconds',
+                                  'Time to serve a request.',
+                                  ('method', 'route', 'status'))
+PHASE_TIME = REGISTRY.histogram('http_request_phase_seconds',
+                                'Time spent in each phase of a request.',
+                                ('route', 'phase'))
+
+_local = threading.local()
+
+
+def record(name, seconds):
+    """Add time to a phase of the current request.
+
+    Outside of a request this does nothing.
+
+    :param name: the name of the phase
+    :type name: str
+    :param seconds: the time to add
+    :type seconds: float
+    :returns: (nothing)
+
+    """
+
+    phases = getattr(_local, 'phases', None)
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+        if _local.nested:
+            # Not the enclosing phase's own time
+            _local.nested[-1] += seconds
+
+
+@contextmanager
+def phase(name):
+    """Time a block of code as a phase of the current request.
+
+    Time recorded for other phases inside the block is left out.
+
+    :param name: the name of the phase
+    :type name: str
+
+    """
+
+    phases = getattr(_local, 'phases', None)
+    if phases is None:
+        yield
+        return
+    _local.nested.append(0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        phases[name] = phases.get(name, 0.0) + seconds - _local.nested.pop()
+        if _local.nested:
+            _local.nested[-1] += seconds
+
+
+def serverTiming(phases, total):
+    """Return the Server-Timing header of a request.
+
+    :param phases: seconds spent in each phase
+    :type phases: dict
+    :param total: seconds the application took up to the headers
+    :type total: float
+    :returns: the header value, in milliseconds
+    :rtype: str
+
+    """
+
+    parts = ['%s;dur=%.1f' % (name, seconds * 1000)
+             for name, seconds in phases.items()]
+    parts.append('app;dur=%.1f' % (total * 1000))
+    return ', '.join(parts)
+
+
+def routeOf(environ):
+    """Return the route rule a request matched, not its raw path."""
+
+    route = environ.get('bottle.route')
+    if route is None:
+        return 'unmatched'
+    return route.rule
+
+
+class TimingMiddleware(object):
+
+    """
+    This class times the requests of a WSGI application.
+
+    :param app: the application to wrap
+    :param header: whether to send the Server-Timing header
+
+    """
+
+    def __init__(self, app, header=True):
+        self.app = app
+        self.header = header
+
+    def __call__(self, environ, start_response):
+        phases = {}
+        _local.phases = phases
+        # Time of the inner phases of each phase now running
+        _local.nested = []
+        started = time.perf_counter()
+        state = {'status': '500'}
+
+        def timed_start_response(status, headers, exc_info=None):
+            state['status'] = status[:3]
+            if self.header:
+                headers = list(headers)
+                headers.append(('Server-Timing', serverTiming(
+                    phases, time.perf_counter() - started)))
+            return start_response(status, headers, exc_info)
+
+        def finished():
+            _local.phases = None
+            route = routeOf(environ)
+            REQUEST_TIME.observe(time.perf_counter() - started,
+                                 method=environ.get('REQUEST_METHOD'),
+                                 route=route, status=state['status'])
+            for name, seconds in phases.items():
+                PHASE_TIME.observe(seconds, route=route, phase=name)
+
+        try:
+            body = self.app(environ, timed_start_response)
+        except Exception:
+            finished()
+            raise
+        return TimedBody(body, finished)
+
+
+class TimedBody(object):
+
+    """
+    This class passes a response body through and calls back once
+    the server is done with it, so streamed bodies count in full.
+
+    """
+
+    def __init__(self, body, finished):
+        self.body = body
+        self.finished = finished
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.finished()
@@ -8,12 +8,14 @@ printing out data object fields automatically, and more.
 
 """
 
-from bson import json_util
 from bson.objectid import ObjectId
+from libraries import jsoncodec, timing
+from operator import itemgetter
+from pymongo.cursor import Cursor
+import base64
+import binascii
 import io
 import csv
-import json
-from pymongo.cursor import Cursor
 
 
 class JSONHelper:
@@ -41,9 +43,39 @@ class JSONHelper:
             for item in o:
                 idToStr(item)
                 results.append(item)
-            return json.dumps(results, default=json_util.default)
+            with timing.phase('serialize'):
+                return jsoncodec.dumps(results)
         else:
-            return json.dumps(o, default=json_util.default)
+            with timing.phase('serialize'):
+                return jsoncodec.dumps(o)
+
+    def encodeStream(self, o, chunkSize=100):
+        """Yield a JSON array of the items, a chunk at a time.
+
+        Unlike encode, the items are never all held in memory, so
+        a large cursor can be sent as it is read from the database.
+
+        :param o: the items to JSON serialize (cursor or iterable)
+        :param chunkSize: the number of items in each chunk
+        :type chunkSize: int
+        :returns: pieces of the JSON array
+        :rtype: generator of str
+
+        """
+
+        yield '['
+        separator = ''
+        chunk = []
+        for item in o:
+            idToStr(item)
+            chunk.append(jsoncodec.dumps(item))
+            if len(chunk) >= chunkSize:
+                yield separator + ','.join(chunk)
+                separator = ','
+                chunk = []
+        if chunk:
+            yield separator + ','.join(chunk)
+        yield ']'
 
     def pullId(self, data):
         """Separate the id of the dict from the rest of the data.
@@ -55,6 +87,8 @@ class JSONHelper:
 
         """
 
+        if type(data) is not dict:
+            return None, data
         thisId = data.get('_id', None)
         if thisId:
             del data['_id']
@@ -72,7 +106,8 @@ class JSONHelper:
 
         """
 
-        data = json.loads(o, object_hook=json_util.object_hook)
+        with timing.phase('serialize'):
+            data = jsoncodec.loads(o)
         if type(data) is list:
             ids = []
             objs = []
@@ -99,22 +134,46 @@ class CSVHelper:
 
         :param o: the object to convert to csv
         :param orderFields: the fields to convert
-        :type orderFields: list of fields
+        :type orderFields: Schema or list of fields
         :returns: string in csv form
         :rtype: str
 
         """
 
+        return b''.join(self.streamCSV(o, orderedFields))
+
+    def streamCSV(self, o, orderedFields, chunkSize=100):
+        """Yield the csv form of the object, a chunk of rows at a time.
+
+        Only one chunk of rows is ever buffered, so a large cursor
+        can be exported as it is read from the database.
+
+        :param o: the object to convert to csv
+        :param orderFields: the fields to convert
+        :type orderFields: Schema or list of fields
+        :param chunkSize: the number of rows in each chunk
+        :type chunkSize: int
+        :returns: encoded pieces of the csv
+        :rtype: generator of bytes
+
+        """
+
+        if not isinstance(orderedFields, Schema):
+            orderedFields = Schema(orderedFields)
+        values = orderedFields.values
         output = io.StringIO()
         writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
-        writer.writerow(orderedFields)
+        writer.writerow(orderedFields.fields)
+        rows = 0
         for item in o:
-            idToStr(item)
-            orderedValues = []
-            for field in orderedFields:
-                orderedValues.append(item.get(field.name, ''))
-            writer.writerow(orderedValues)
-        return str.encode(output.getvalue())
+            writer.writerow(values(item))
+            rows += 1
+            if rows >= chunkSize:
+                yield str.encode(output.getvalue())
+                output.seek(0)
+                output.truncate()
+                rows = 0
+        yield str.encode(output.getvalue())
 
     def convertFromCSV(self, fileName):
         """Return a list of dictionaries from a csv file.
@@ -146,10 +205,8 @@ def idToStr(row):
 
     """
 
-    for key in row:
-        if key == '_id':
-            row[key] = str(row[key])
-            break
+    if '_id' in row:
+        row['_id'] = str(row['_id'])
 
 
 def strToId(thisStr):
@@ -165,6 +222,41 @@ def strToId(thisStr):
     return ObjectId(thisStr)
 
 
+def encodeCursor(values):
+    """Return an opaque, url safe cursor for a list of sort key values.
+
+    :param values: the sort key values of the last object on a page
+    :type values: list
+    :returns: the cursor
+    :rtype: str
+
+    """
+
+    data = jsoncodec.dumps(values)
+    return base64.urlsafe_b64encode(str.encode(data)).decode('ascii')
+
+
+def decodeCursor(cursor):
+    """Return the sort key values of a cursor made by encodeCursor.
+
+    :param cursor: the cursor
+    :type cursor: str
+    :returns: the sort key values
+    :rtype: list
+    :raises: ValueError if the cursor is not valid
+
+    """
+
+    try:
+        data = base64.urlsafe_b64decode(str.encode(cursor)).decode('utf-8')
+        values = jsoncodec.loads(data)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('The cursor is not valid.')
+    if type(values) is not list:
+        raise ValueError('The cursor is not valid.')
+    return values
+
+
 def fieldsFromFieldNameArray(fieldNames):
     """Return a list of fields based on field names.
 
@@ -198,17 +290,14 @@ class Field:
 
     """
 
-    name = ''
-    placeholder = ''
-    fieldType = ''
+    __slots__ = ('name', 'fieldType', 'placeholder')
 
     def __init__(self, name, fieldType='', placeholder=''):
         self.name = name
         self.fieldType = fieldType
+        self.placeholder = placeholder
         if placeholder == '':
             self.parsePlaceholderFromName()
-        else:
-            self.placeholder = placeholder
 
     def parsePlaceholderFromName(self):
         """Get the placeholder from the field name.
@@ -228,3 +317,54 @@ class Field:
 
     def __repr__(self):
         return self.placeholder
+
+
+class Schema:
+
+    """
+    Schema class holding the fields of a model, built once.
+
+    The fields, their names and a getter pulling their values out
+    of a row in order are all computed up front, so models can
+    keep one schema per class and share it with every request.
+
+    """
+
+    __slots__ = ('fields', 'names', 'blanks', 'getter')
+
+    def __init__(self, fieldNames):
+        fields = [field if isinstance(field, Field) else None
+                  for field in fieldNames]
+        if None in fields:
+            fields = fieldsFromFieldNameArray(fieldNames)
+        self.fields = tuple(fields)
+        self.names = tuple(field.name for field in self.fields)
+        self.blanks = ('',) * len(self.names)
+        if len(self.names) > 1:
+            self.getter = itemgetter(*self.names)
+        else:
+            # itemgetter of one name returns a value, not a tuple
+            names = self.names
+            self.getter = lambda row: tuple(row[name] for name in names)
+
+    def values(self, row):
+        """Return the values of the fields in a row, in order.
+
+        :param row: the row to read
+        :type row: dict
+        :returns: the values, with '' for missing fields
+        :rtype: tuple
+
+        """
+
+        try:
+            return self.getter(row)
+        except KeyError:
+            # Only rows missing a field look up each one with a default
+            return tuple(map(row.get, self.names, self.blanks))
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
@@ -8,7 +8,8 @@ with anything.
 """
 
 from .dataobject import DataModel
-from libraries.utils import fieldsFromFieldNameArray
+from libraries.utils import Schema
+from pymongo import ASCENDING, IndexModel
 
 
 class AddressModel(DataModel):
@@ -21,31 +22,35 @@ class AddressModel(DataModel):
 
     """
 
-    def __init__(self, mongoUrl, dbName, collectionName='simpleaddresses'):
-        super(AddressModel, self).__init__(mongoUrl, dbName, collectionName)
-
-    def getCreationFields(self):
-        """Return list of fields for creating a new address.
-
-        :returns: creation fields
-        :rtype: list
-
-        """
-
-        self.fields = ["first_name", "last_name", "spouse", "email_address",
-                       "street_1", "street_2", "city", "state", "zip",
-                       "country", "home_phone", "mobile_phone",
-                       "relationship", "title", "children", "label_name",
-                       ("send_christmas_card", "checkBox")]
-        return super(AddressModel, self).getCreationFields()
+    schema = Schema(["first_name", "last_name", "spouse", "email_address",
+                     "street_1", "street_2", "city", "state", "zip",
+                     "country", "home_phone", "mobile_phone",
+                     "relationship", "title", "children", "label_name",
+                     ("send_christmas_card", "checkBox")])
+    # What the address list shows: names and a short address
+    listSchema = Schema(["first_name", "last_name", "street_1", "street_2",
+                         "city", "state", "zip"])
+    christmasSchema = Schema(["label_name", "street_1", "street_2", "city",
+                              "state", "zip", "country"])
+    searchFields = ["first_name", "last_name", "spouse"]
+    # Paged lists also sort on _id to break ties between equal names
+    indexes = [IndexModel([("userName", ASCENDING)]),
+               IndexModel([("userName", ASCENDING), ("last_name", ASCENDING),
+                           ("first_name", ASCENDING), ("_id", ASCENDING)]),
+               IndexModel([("userName", ASCENDING),
+                           ("send_christmas_card", ASCENDING)])]
+
+    def __init__(self, mongoUrl, dbName, collectionName='simpleaddresses',
+                 cache=None):
+        super(AddressModel, self).__init__(mongoUrl, dbName, collectionName,
+                                           cache)
 
     def getChristmasFields(self):
-        """Return list of fields needed for Christmas cards.
+        """Return the fields needed for Christmas cards.
 
         :returns: christmas fields
-        :rtype: list
+        :rtype: tuple
 
         """
 
-        return fieldsFromFieldNameArray(["label_name", "street_1", "street_2",
-                                         "city", "state", "zip", "country"])
+        return self.christmasSchema.fields
@@ -0,0 +1,253 @@
+"""
+This is the shared MongoDB connection pool for a worker process.
+
+MongoClient is expensive to create (TCP/TLS handshake, server
+discovery, a new pool of sockets) and is not safe to share across
+a fork, so one client per mongo URL is created lazily in each
+process and then reused by every model and by cork.  Pool sizes
+and timeouts come from the [mongo] section of the config file.
+
+"""
+
+from cork.mongodb_backend import MongoDBBackend, MongoMultiValueTable
+from cork.mongodb_backend import MongoSingleValueTable
+from libraries import timing
+from libraries.metrics import REGISTRY
+from pymongo import MongoClient, monitoring
+import os
+import threading
+import time
+
+# Config file option -> MongoClient keyword argument
+POOL_OPTIONS = {
+    'max_pool_size': 'maxPoolSize',
+    'min_pool_size': 'minPoolSize',
+    'max_idle_time_ms': 'maxIdleTimeMS',
+    'wait_queue_timeout_ms': 'waitQueueTimeoutMS',
+    'connect_timeout_ms': 'connectTimeoutMS',
+    'socket_timeout_ms': 'socketTimeoutMS',
+    'server_selection_timeout_ms': 'serverSelectionTimeoutMS',
+}
+
+POOL_SIZE = REGISTRY.gauge('mongo_pool_connections',
+                           'Open connections in the mongo pool.',
+                           ('address',))
+POOL_IN_USE = REGISTRY.gauge('mongo_pool_checked_out',
+                             'Connections currently checked out.',
+                             ('address',))
+CHECKOUT_WAIT = REGISTRY.histogram('mongo_pool_checkout_wait_seconds',
+                                   'Time spent waiting for a connection.',
+                                   ('address',))
+POOL_MAX_SIZE = REGISTRY.gauge('mongo_pool_max_size',
+                               'Configured maximum size of the mongo pool.')
+CHECKOUT_FAILURES = REGISTRY.counter('mongo_pool_checkout_failures_total',
+                                     'Connection checkouts that failed.',
+                                     ('address', 'reason'))
+
+_lock = threading.Lock()
+_state = {'pid': None, 'clients': {}, 'standIns': {}, 'options': {},
+          'batchSize': 100}
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+
+    """
+    This class turns pool events into metrics.
+
+    Checkout events are published on the thread asking for the
+    connection, so the start time is kept per thread.
+
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def pool_created(self, event):
+        POOL_SIZE.set(0, address=event.address)
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        POOL_SIZE.set(0, address=event.address)
+
+    def connection_created(self, event):
+        POOL_SIZE.inc(address=event.address)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_SIZE.dec(address=event.address)
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.time()
+
+    def connection_check_out_failed(self, event):
+        CHECKOUT_FAILURES.inc(address=event.address, reason=event.reason)
+
+    def connection_checked_out(self, event):
+        started = getattr(self.local, 'started', None)
+        if started is not None:
+            CHECKOUT_WAIT.observe(time.time() - started,
+                                  address=event.address)
+            self.local.started = None
+        POOL_IN_USE.inc(address=event.address)
+
+    def connection_checked_in(self, event):
+        POOL_IN_USE.dec(address=event.address)
+
+
+class CommandTimingListener(monitoring.CommandListener):
+
+    """
+    This class adds the time of every mongo command to the mongo
+    phase of the request that sent it.
+
+    Command events are published on the thread running the
+    command, which is the one serving the request.
+
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        timing.record('mongo', event.duration_micros / 1e6)
+
+    def failed(self, event):
+        timing.record('mongo', event.duration_micros / 1e6)
+
+
+def configure(options):
+    """Set the pool options used for clients created from now on.
+
+    :param options: the [mongo] section of the config file
+    :type options: dict
+    :returns: (nothing)
+
+    """
+
+    clientOptions = {}
+    for key, value in options.items():
+        if key in POOL_OPTIONS:
+            clientOptions[POOL_OPTIONS[key]] = int(value)
+    _state['options'] = clientOptions
+    _state['batchSize'] = int(options.get('cursor_batch_size',
+                                          _state['batchSize']))
+    # pymongo's own default when nothing is configured
+    POOL_MAX_SIZE.set(clientOptions.get('maxPoolSize', 100))
+
+
+def getClient(mongoUrl):
+    """Return the shared client of this process for the given url.
+
+    A client created before a fork is never reused by the child,
+    it gets its own client the first time it asks for one.  Only
+    stand-ins (see setClient) are kept, each process then having
+    its own copy.
+
+    :param mongoUrl: the url of the mongo server
+    :type mongoUrl: str
+    :returns: the pooled client
+    :rtype: MongoClient
+
+    """
+
+    with _lock:
+        if _state['pid'] != os.getpid():
+            _state['pid'] = os.getpid()
+            _state['clients'] = dict(_state['standIns'])
+        client = _state['clients'].get(mongoUrl)
+        if client is None:
+            client = MongoClient(mongoUrl,
+                                 event_listeners=[PoolMetricsListener(),
+                                                  CommandTimingListener()],
+                                 **_state['options'])
+            _state['clients'][mongoUrl] = client
+        return client
+
+
+def setClient(mongoUrl, client):
+    """Use the given client for a url in this process.
+
+    This is for stand-ins, such as an in-memory mongo for the
+    benchmarks; the application itself always uses getClient.
+    Unlike real clients they are kept across a fork, so workers
+    start with a copy of what was set up before it.
+
+    :param mongoUrl: the url the client stands for
+    :type mongoUrl: str
+    :param client: the client to use
+    :type client: MongoClient
+    :returns: (nothing)
+
+    """
+
+    with _lock:
+        if _state['pid'] != os.getpid():
+            _state['pid'] = os.getpid()
+            _state['clients'] = dict(_state['standIns'])
+        _state['clients'][mongoUrl] = client
+        _state['standIns'][mongoUrl] = client
+
+
+def getCursorBatchSize():
+    """Return how many documents a cursor fetches per round trip.
+
+    :returns: the configured cursor batch size
+    :rtype: int
+
+    """
+
+    return _state['batchSize']
+
+
+def getDatabase(mongoUrl, dbName):
+    """Return a database on the shared client.
+
+    :param mongoUrl: the url of the mongo server
+    :type mongoUrl: str
+    :param dbName: the name of the database
+    :type dbName: str
+    :returns: the database
+    :rtype: Database
+
+    """
+
+    return getClient(mongoUrl)[dbName]
+
+
+class SharedMongoDBBackend(MongoDBBackend):
+
+    """
+    This is cork's MongoDB backend on top of the shared client.
+
+    Cork's own backend always opens its own MongoClient, so this
+    sets up the same tables against the pooled one instead.
+
+    """
+
+    def __init__(self, dbName, mongoUrl, initialize=False):
+        db = getDatabase(mongoUrl, dbName)
+        self.users = MongoMultiValueTable('users', 'login', db.users)
+        self.pending_registrations = MongoMultiValueTable(
+            'pending_registrations', 'pending_registration',
+            db.pending_registrations)
+        self.roles = MongoSingleValueTable('roles', 'role', db.roles)
+
+        if initialize:
+            self._initialize_storage()
+
+    def ensureIndexes(self):
+        """Create unique indexes on the key of every cork table.
+
+        Cork looks up users, roles and pending registrations by key
+        on every authenticated request, so those must not scan.
+
+        :returns: (nothing)
+
+        """
+
+        for table in (self.users, self.roles, self.pending_registrations):
+            table._coll.create_index(table._key_name, unique=True)
@@ -9,8 +9,50 @@ inherited from.
 
 """
 
-from pymongo import MongoClient
-from libraries.utils import fieldsFromFieldNameArray
+from . import queries
+from .connection import getDatabase
+from bson.objectid import ObjectId
+from contextlib import contextmanager
+from datetime import datetime
+from libraries.utils import decodeCursor, encodeCursor
+from libraries.utils import Schema
+from pymongo import ASCENDING, DeleteOne, IndexModel, InsertOne
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import bson
+import re
+import time
+
+# Deleted objects are remembered this long for clients catching up
+TOMBSTONE_SECONDS = 3600 * 24 * 30  # 30 days
+# A write that hasn't published its version after this long is taken
+# to have died with its worker (well past the mongo max_time_ms)
+STALE_WRITE_SECONDS = 120
+
+# Criteria matching every value of a type, for the types a page
+# cursor can hold, in the order MongoDB sorts them
+TYPE_CRITERIA = [None, {'$gte': float('-inf')}, {'$gte': ''},
+                 {'$in': [False, True]}]
+
+
+def sortRank(value):
+    """Return where the type of a value sorts in TYPE_CRITERIA.
+
+    :param value: a sort key value
+    :returns: the index, or None for types not in TYPE_CRITERIA
+    :rtype: int
+
+    """
+
+    if value is None:
+        return 0
+    if type(value) is bool:
+        return 3
+    if type(value) in (int, float):
+        return 1
+    if isinstance(value, str):
+        return 2
+    return None
 
 
 class DataModel(object):
@@ -22,19 +64,39 @@ class DataModel(object):
     information needed to speak with the database.
     If not inherited from, field should be defined if
     you easily want to discover the fields needed to
-    create a new object.
+    create a new object.  Indexes the queries rely on should be
+    declared in indexes, as a list of pymongo IndexModels.
+
+    Every write stamps the objects it touches with the next value
+    of a per-user version counter, and deletes leave tombstones,
+    so a client can ask for only what changed since its last sync.
+    Readers only see the committed version, which moves up once no
+    write of the user is in flight, so every object stamped up to
+    it is already written.
+    Given a cache, results of getMultiple are cached per user and
+    committed version, so any write makes them unreachable once it
+    is done.  Every query and
+    write of the objects goes through the queries module, which
+    times them and logs the slow ones.
 
     """
 
-    fields = []
+    schema = Schema([])
+    searchFields = []
+    indexes = []
 
-    def __init__(self, mongoUrl, dbName, tableName):
-        client = MongoClient(mongoUrl)
-        db = client[dbName]
+    def __init__(self, mongoUrl, dbName, tableName, cache=None):
+        db = getDatabase(mongoUrl, dbName)
         self.table = db[tableName]
+        self.versions = db[tableName + '_versions']
+        self.tombstones = db[tableName + '_tombstones']
+        self.cache = cache
+        # Versions read by this object, which lives for one request
+        self.knownVersions = {}
 
     def getMultiple(self, userName, filterCriteria={}, sortColumn='',
-                    secondSortColumn='', asc=True):
+                    secondSortColumn='', asc=True, search='', after=None,
+                    limit=0, projection=None, hint=None):
         """Return a list of objects associated with a user.
 
         :param userName: the name of the user
@@ -47,6 +109,75 @@ class DataModel(object):
         :type secondSortColumn: str
         :param asc: sort direction, true for asc
         :type message: bool
+        :param search: text the search fields should contain (if needed)
+        :type search: str
+        :param after: sort key values to start after (if needed)
+        :type after: list
+        :param limit: the maximum number of objects, 0 for all
+        :type limit: int
+        :param projection: the only fields to return, None for all
+        :type projection: tuple
+        :param hint: the index to use, by name or keys (if needed)
+        :type hint: str or list
+        :returns: objects found
+        :rtype: cursor or iterable
+
+        """
+
+        if self.cache is None:
+            return self.findMultiple(userName, filterCriteria, sortColumn,
+                                     secondSortColumn, asc, search, after,
+                                     limit, projection, hint)
+
+        key = repr((self.getVersion(userName), sorted(filterCriteria.items()),
+                    sortColumn, secondSortColumn, asc, search, after, limit,
+                    projection and tuple(projection)))
+        items = self.cache.get(userName, key)
+        if items is not None:
+            # Callers change what they get (see idToStr), so copy
+            return [dict(item) for item in items]
+        return self.cacheResults(userName, key, self.findMultiple(
+            userName, filterCriteria, sortColumn, secondSortColumn, asc,
+            search, after, limit, projection, hint))
+
+    def cacheResults(self, userName, key, cursor):
+        """Yield the objects of a cursor, caching them once all are read.
+
+        Results bigger than the cache's limit for one entry are
+        passed through without being kept.
+
+        :param userName: the name of the user
+        :type userName: str
+        :param key: the cache key of the results
+        :type key: str
+        :param cursor: the objects to cache
+        :type cursor: cursor
+        :returns: the objects
+        :rtype: generator
+
+        """
+
+        items = []
+        size = 0
+        for item in cursor:
+            if items is not None:
+                size += len(bson.encode(item))
+                if size > self.cache.maxEntryBytes:
+                    items = None
+                else:
+                    items.append(dict(item))
+            yield item
+        if items is not None:
+            self.cache.set(userName, key, items, size)
+
+    def findMultiple(self, userName, filterCriteria={}, sortColumn='',
+                     secondSortColumn='', asc=True, search='', after=None,
+                     limit=0, projection=None, hint=None):
+        """Return a cursor of objects associated with a user.
+
+        This always queries the database; see getMultiple for
+        the parameters.
+
         :returns: objects found
         :rtype: cursor
 
@@ -58,19 +189,182 @@ class DataModel(object):
             asc = -1
 
         # Copy over if anyone passes in a userName so you can't impersonate
-        filterCriteria['userName'] = userName
+        criteria = dict(filterCriteria)
+        criteria['userName'] = userName
+
+        conditions = [criteria]
+        if search:
+            conditions.append(self.searchCriteria(search))
+        if after is not None:
+            conditions.append(self.afterCriteria(
+                self.sortColumns(sortColumn, secondSortColumn), after, asc))
+        if len(conditions) > 1:
+            criteria = {'$and': conditions}
+
+        if limit or after is not None:
+            # Paging needs a total order, so break ties on the id
+            sortKeys = [(column, asc) for column in
+                        self.sortColumns(sortColumn, secondSortColumn)]
+        else:
+            sortKeys = [(column, asc) for column in
+                        (sortColumn, secondSortColumn) if column != '']
+        return queries.find(self.table, criteria, projection, sortKeys,
+                            limit, hint)
+
+    def getPage(self, userName, pageSize, sortColumn='', secondSortColumn='',
+                asc=True, search='', after=None, projection=None):
+        """Return one page of objects and the cursor of the next page.
+
+        Pages are found by their sort key values (keyset paging)
+        rather than by skipping, so every page costs the same.
+
+        :param userName: the name of the user
+        :type userName: str
+        :param pageSize: the number of objects on a page
+        :type pageSize: int
+        :param sortColumn: the sort column to use (if needed)
+        :type sortColumn: str
+        :param secondSortColumn: secondary sort solumn (if needed)
+        :type secondSortColumn: str
+        :param asc: sort direction, true for asc
+        :type message: bool
+        :param search: text the search fields should contain (if needed)
+        :type search: str
+        :param after: the cursor of the page to get, None for the first
+        :type after: str
+        :param projection: the only fields to return, None for all
+        :type projection: tuple
+        :returns: the objects and the next cursor (None on the last page)
+        :rtype: tuple
+
+        """
+
+        if after is not None:
+            after = decodeCursor(after)
+        if projection is not None:
+            # The next cursor is made of the sort columns
+            projection = tuple(projection) + tuple(
+                column for column in (sortColumn, secondSortColumn)
+                if column != '' and column not in projection)
+        # Ask for one more to know if there is a next page
+        items = list(self.getMultiple(userName, {}, sortColumn,
+                                      secondSortColumn, asc, search, after,
+                                      pageSize + 1, projection))
+        nextCursor = None
+        if len(items) > pageSize:
+            items = items[:pageSize]
+            nextCursor = encodeCursor(
+                [items[-1].get(column) for column in
+                 self.sortColumns(sortColumn, secondSortColumn)])
+        return items, nextCursor
+
+    def sortColumns(self, sortColumn, secondSortColumn):
+        """Return the sort columns followed by the id.
+
+        :param sortColumn: the sort column to use (if needed)
+        :type sortColumn: str
+        :param secondSortColumn: secondary sort solumn (if needed)
+        :type secondSortColumn: str
+        :returns: the columns that totally order the objects
+        :rtype: list
+
+        """
 
-        if sortColumn == '':
-            return self.table.find({'$query': filterCriteria})
-        elif secondSortColumn == '':
-            return self.table.find({'$query': filterCriteria,
-                                    '$orderby': {sortColumn: asc}})
+        columns = [column for column in (sortColumn, secondSortColumn)
+                   if column != '']
+        return columns + ['_id']
+
+    def searchCriteria(self, search):
+        """Return criteria matching objects that contain the search text.
+
+        Every word must be found in at least one of the search fields.
+
+        :param search: the text to search for
+        :type search: str
+        :returns: the criteria
+        :rtype: dict
+
+        """
+
+        words = []
+        for word in search.split():
+            pattern = {'$regex': re.escape(word), '$options': 'i'}
+            words.append({'$or': [{field: pattern}
+                                  for field in self.searchFields]})
+        return {'$and': words}
+
+    def afterCriteria(self, columns, values, asc):
+        """Return criteria matching objects sorted after the given values.
+
+        :param columns: the sort columns, ending with the id
+        :type columns: list
+        :param values: the sort column values to start after
+        :type values: list
+        :param asc: sort direction, 1 for asc
+        :type asc: int
+        :returns: the criteria
+        :rtype: dict
+
+        """
+
+        if len(columns) != len(values):
+            raise ValueError('The cursor does not match the sort columns.')
+
+        operator = '$gt' if asc == 1 else '$lt'
+        alternatives = []
+        for i in range(len(columns)):
+            for after in self.valuesAfter(values[i], operator):
+                # Equal to the cursor on the earlier columns (None also
+                # matches a missing field), after it on this one
+                alternative = dict(zip(columns[:i], values[:i]))
+                alternative[columns[i]] = after
+                alternatives.append(alternative)
+        return {'$or': alternatives}
+
+    def valuesAfter(self, value, operator):
+        """Return criteria for the values that sort after a cursor value.
+
+        MongoDB sorts missing fields as null, before every other
+        type, and $gt and $lt only compare values of the same type,
+        so the types sorting after the value's own are matched
+        whole.  Cursors only hold null, numbers, strings, booleans
+        and ObjectIds.
+
+        :param value: the cursor value
+        :param operator: $gt for ascending order, $lt for descending
+        :type operator: str
+        :returns: the criteria on the column, one per alternative
+        :rtype: list
+
+        """
+
+        rank = sortRank(value)
+        if rank is None:
+            return [{operator: value}]
+        criteria = [] if value is None else [{operator: value}]
+        if operator == '$gt':
+            later = range(rank + 1, len(TYPE_CRITERIA))
         else:
-            self.table.ensure_index([('userName', asc), (sortColumn, asc),
-                                     (secondSortColumn, asc)])
-            return self.table.find({'$query': filterCriteria}) \
-                             .sort([(sortColumn, asc),
-                                    (secondSortColumn, asc)])
+            later = range(rank - 1, -1, -1)
+        return criteria + [TYPE_CRITERIA[i] for i in later]
+
+    def get(self, thisId, userName, projection=None):
+        """Return one object of a user.
+
+        :param thisId: the id of the object
+        :type thisId: ObjectId
+        :param userName: the name of the user
+        :type userName: str
+        :param projection: the only fields to return, None for all
+        :type projection: tuple
+        :returns: the object, or None if the user has no such object
+        :rtype: dict
+
+        """
+
+        return queries.findOne(self.table,
+                               {'_id': thisId, 'userName': userName},
+                               projection)
 
     def create(self, item, userName):
         """Create a new item and returns the id.
@@ -85,31 +379,47 @@ class DataModel(object):
         """
 
         item['userName'] = userName
-        return str(self.table.insert(item))
+        with self.writing(userName) as version:
+            item['_modified'] = version
+            return str(queries.insertOne(self.table, item).inserted_id)
+
+    def createMultiple(self, items, userName):
+        """Create a group of items in one bulk write and return the ids.
+
+        :param items: the data to be inserted
+        :type items: list
+        :param userName: the name of the user
+        :type userName: str
+        :returns: id of each inserted item, -1 where it failed
+        :rtype: list
+
+        """
+
+        return self.batch([('create', None, item) for item in items],
+                          userName)
 
     def updateMultiple(self, ids, items, userName):
         """Update a group of items and returns success.
 
+        A group of items is updated in a single bulk write, and
+        success is reported for each of them.
+
         :param ids: the ids of the items to be updated
         :type ids: list or string
         :param items: the objects to be updated
         :type items: list or object
         :param userName: the name of the user
         :type userName: str
-        :returns: success of update
-        :rtype: bool
+        :returns: success of update (for each id given a list)
+        :rtype: bool or list
 
         """
 
         if type(ids) is not list:
             return self.update(ids, items, userName)
-        else:
-            # Return False if any updates didn't succeed
-            success = True
-            for i in range(len(ids)):
-                if not self.update(ids[i], items[i], userName):
-                    success = False
-            return success
+
+        return self.batch([('update', ids[i], items[i])
+                           for i in range(len(ids))], userName)
 
     def update(self, thisId, item, userName):
         """Update a single item and returns success.
@@ -126,9 +436,12 @@ class DataModel(object):
         """
 
         item['userName'] = userName
-        res = self.table.update({'_id': thisId, 'userName': userName},
-                                {'$set': item})
-        if res['updatedExisting']:
+        with self.writing(userName) as version:
+            item['_modified'] = version
+            res = queries.updateOne(self.table,
+                                    {'_id': thisId, 'userName': userName},
+                                    {'$set': item})
+        if res.matched_count:
             return True
         else:
             return False
@@ -145,19 +458,384 @@ class DataModel(object):
 
         """
 
-        res = self.table.remove({'_id': thisId, 'userName': userName})
+        res = queries.deleteOne(self.table,
+                                {'_id': thisId, 'userName': userName})
+        if res.deleted_count:
+            with self.writing(userName) as version:
+                self.addTombstones([thisId], userName, version)
 
-        if res[u'ok'] == 1:
+        if res.acknowledged:
             return True
         else:
             return False
 
+    def deleteMultiple(self, ids, userName):
+        """Delete a group of items in one bulk write and return success.
+
+        :param ids: the ids of the items to be deleted
+        :type ids: list
+        :param userName: the name of the user
+        :type userName: str
+        :returns: success of delete for each id
+        :rtype: list
+
+        """
+
+        return self.batch([('delete', thisId, None) for thisId in ids],
+                          userName)
+
+    def batch(self, operations, userName):
+        """Run a mix of creates, updates and deletes in one bulk write.
+
+        Every operation is scoped to the user, and a result is
+        reported for each of them: the new id (or -1) for a create,
+        success for an update or delete.
+
+        :param operations: (kind, id, item) for each operation, where
+                           kind is create, update or delete
+        :type operations: list of tuples
+        :param userName: the name of the user
+        :type userName: str
+        :returns: the result of each operation
+        :rtype: list
+        :raises: ValueError for an unknown kind of operation
+
+        """
+
+        if not operations:
+            return []
+
+        # The whole batch is one change as far as syncing goes
+        with self.writing(userName) as version:
+            return self.writeBatch(operations, userName, version)
+
+    def writeBatch(self, operations, userName, version):
+        """Run a batch stamped with its version; see batch."""
+
+        writes = []
+        deletedIds = []
+        for kind, thisId, item in operations:
+            if kind == 'create':
+                item['userName'] = userName
+                item['_modified'] = version
+                item['_id'] = ObjectId()
+                writes.append(InsertOne(item))
+            elif kind == 'update':
+                item['userName'] = userName
+                item['_modified'] = version
+                writes.append(UpdateOne({'_id': thisId, 'userName': userName},
+                                        {'$set': item}))
+            elif kind == 'delete':
+                writes.append(DeleteOne({'_id': thisId,
+                                         'userName': userName}))
+                deletedIds.append(thisId)
+            else:
+                raise ValueError('Unknown operation: ' + str(kind))
+
+        # Only the user's own objects are deleted, so only those leave
+        # tombstones and count as deleted
+        owned = set()
+        if deletedIds:
+            found = queries.find(self.table, {'_id': {'$in': deletedIds},
+                                              'userName': userName},
+                                 {'_id': True})
+            owned = set(item['_id'] for item in found)
+
+        result, failed = self.bulkWrite(writes)
+        results = []
+        removedIds = []
+        for i in range(len(operations)):
+            kind, thisId, item = operations[i]
+            if kind == 'create':
+                results.append(-1 if i in failed else str(item['_id']))
+            elif kind == 'delete':
+                removed = i not in failed and thisId in owned
+                if removed and thisId not in removedIds:
+                    removedIds.append(thisId)
+                results.append(removed)
+            else:
+                results.append(i not in failed)
+        if removedIds:
+            self.addTombstones(removedIds, userName, version)
+
+        updates = [i for i in range(len(operations))
+                   if operations[i][0] == 'update' and results[i]]
+        if result['nMatched'] < len(updates):
+            # Some ids don't exist (or aren't the user's), so find them
+            found = queries.find(self.table,
+                                 {'_id': {'$in': [operations[i][1]
+                                                  for i in updates]},
+                                  'userName': userName}, {'_id': True})
+            found = set(item['_id'] for item in found)
+            for i in updates:
+                results[i] = operations[i][1] in found
+        return results
+
+    def bulkWrite(self, operations):
+        """Run operations in a single unordered bulk write.
+
+        Being unordered, one failed operation does not stop the
+        others, and the server is free to run them in any order.
+
+        :param operations: the pymongo write operations
+        :type operations: list
+        :returns: the bulk write result and the indexes of failed operations
+        :rtype: tuple
+
+        """
+
+        if not operations:
+            return {'nInserted': 0, 'nMatched': 0, 'nModified': 0,
+                    'nRemoved': 0, 'writeErrors': []}, set()
+        try:
+            result = queries.bulkWrite(self.table, operations)
+            return result.bulk_api_result, set()
+        except BulkWriteError as bwe:
+            failed = set(error['index']
+                         for error in bwe.details['writeErrors'])
+            return bwe.details, failed
+
+    @contextmanager
+    def writing(self, userName):
+        """Stamp a write with the next version and publish it after.
+
+        :param userName: the name of the user
+        :type userName: str
+        :returns: the version to stamp the write with
+        :rtype: context manager of int
+
+        """
+
+        version, stamp = self.nextVersion(userName)
+        try:
+            yield version
+        finally:
+            self.publishVersion(userName, stamp)
+
+    def nextVersion(self, userName):
+        """Bump the user's version counter and return the new value.
+
+        The write is listed as in flight, under a stamp of its own,
+        until publishVersion, and until then readers don't see the
+        new version.
+
+        :param userName: the name of the user
+        :type userName: str
+        :returns: the new version and the stamp of the write
+        :rtype: tuple
+
+        """
+
+        # An ObjectId holds when it was made, so it dates the write too
+        stamp = ObjectId()
+        counter = queries.findOneAndUpdate(
+            self.versions, {'_id': userName},
+            {'$inc': {'version': 1}, '$push': {'writes': stamp}},
+            upsert=True)
+        return counter['version'], stamp
+
+    def publishVersion(self, userName, stamp):
+        """Count a stamped write as done, committing the versions.
+
+        Once no write of the user is in flight, every version handed
+        out so far is written, so the committed version moves up to
+        the counter.  If another write was stamped meanwhile, the
+        counter has moved and that write will commit it instead.
+
+        :param userName: the name of the user
+        :type userName: str
+        :param stamp: the stamp nextVersion returned for the write
+        :type stamp: ObjectId
+        :returns: (nothing)
+
+        """
+
+        counter = queries.findOneAndUpdate(self.versions, {'_id': userName},
+                                           {'$pull': {'writes': stamp}})
+        if counter is not None and not counter.get('writes'):
+            self.commitVersion(counter)
+        # This object's writes are done, so read the version again
+        self.knownVersions.pop(userName, None)
+        # Every write comes through here once it is done, so drop what
+        # is now stale; results read while it ran were cached under the
+        # version before it, which readers stop asking for once it is
+        # committed
+        if self.cache is not None:
+            self.cache.invalidate(userName)
+
+    def commitVersion(self, counter):
+        """Commit the version of a counter no longer being written.
+
+        :param counter: the counter, as read with no writes in flight
+        :type counter: dict
+        :returns: (nothing)
+
+        """
+
+        queries.updateOne(self.versions,
+                          {'_id': counter['_id'],
+                           'version': counter['version'],
+                           'writes': {'$size': 0}},
+                          {'$max': {'committed': counter['version']}})
+
+    def getVersion(self, userName):
+        """Return the user's committed version, 0 if never written.
+
+        The version is only read once per object, so a request
+        sees the same version throughout.
+
+        :param userName: the name of the user
+        :type userName: str
+        :returns: the version
+        :rtype: int
+
+        """
+
+        if userName not in self.knownVersions:
+            counter = queries.findOne(self.versions, {'_id': userName})
+            self.knownVersions[userName] = self.committedVersion(counter)
+        return self.knownVersions[userName]
+
+    def committedVersion(self, counter):
+        """Return the committed version of a counter.
+
+        A write in flight for longer than STALE_WRITE_SECONDS was
+        lost with a worker, so it is dropped from the counter, and
+        if no other write is in flight the counter is committed as
+        it stands.  Each write has a stamp of its own, so writes
+        after a lost one don't keep it alive.
+
+        :param counter: the counter, as read, or None
+        :type counter: dict
+        :returns: the version
+        :rtype: int
+
+        """
+
+        if counter is None:
+            return 0
+        writes = counter.get('writes') or []
+        oldest = time.time() - STALE_WRITE_SECONDS
+        lost = [stamp for stamp in writes
+                if stamp.generation_time.timestamp() < oldest]
+        if lost:
+            counter = queries.findOneAndUpdate(
+                self.versions, {'_id': counter['_id']},
+                {'$pull': {'writes': {'$in': lost}}})
+            writes = counter.get('writes') or []
+            if not writes:
+                self.commitVersion(counter)
+                return counter['version']
+        # Counters from before versions were committed have none
+        return counter.get('committed', counter['version'] - len(writes))
+
+    def addTombstones(self, ids, userName, version):
+        """Remember that objects were deleted, for clients to sync.
+
+        :param ids: the ids of the deleted objects
+        :type ids: list
+        :param userName: the name of the user
+        :type userName: str
+        :param version: the version of the delete
+        :type version: int
+        :returns: (nothing)
+
+        """
+
+        deletedAt = datetime.utcnow()
+        queries.insertMany(self.tombstones,
+                           [{'deletedId': thisId, 'userName': userName,
+                             '_modified': version, 'deletedAt': deletedAt}
+                            for thisId in ids], ordered=False)
+
+    def getSyncToken(self, userName, version=None):
+        """Return a token to later ask for changes made from now on.
+
+        :param userName: the name of the user
+        :type userName: str
+        :param version: the user's version, if already read
+        :type version: int
+        :returns: the sync token
+        :rtype: str
+
+        """
+
+        if version is None:
+            version = self.getVersion(userName)
+        return encodeCursor([version, int(time.time())])
+
+    def getChanges(self, userName, since, projection=None, limit=0):
+        """Return what changed since a sync token was handed out.
+
+        If the token is older than deletes are remembered, or more
+        changed than the limit, the changes aren't returned and the
+        client must get everything.
+
+        :param userName: the name of the user
+        :type userName: str
+        :param since: a token from getSyncToken or getChanges
+        :type since: str
+        :param projection: the only fields to return, None for all
+        :type projection: tuple
+        :param limit: the most changed objects and deleted ids, 0 for all
+        :type limit: int
+        :returns: changed objects, deleted ids and the next token, or
+                  None for the objects and ids if the client must get
+                  everything
+        :rtype: tuple
+        :raises: ValueError if the token is not valid
+
+        """
+
+        values = decodeCursor(since)
+        if len(values) != 2 or not all(type(v) is int for v in values):
+            raise ValueError('The sync token is not valid.')
+        version, issued = values
+
+        nextToken = self.getSyncToken(userName)
+        if time.time() - issued > TOMBSTONE_SECONDS:
+            return None, None, nextToken
+
+        # One more than the limit shows whether there are too many
+        criteria = {'userName': userName, '_modified': {'$gt': version}}
+        changed = list(queries.find(self.table, criteria, projection,
+                                    limit=limit and limit + 1))
+        if limit and len(changed) > limit:
+            return None, None, nextToken
+        deleted = queries.find(self.tombstones, criteria,
+                               {'deletedId': True},
+                               limit=limit and limit + 1)
+        deletedIds = [tombstone['deletedId'] for tombstone in deleted]
+        if limit and len(deletedIds) > limit:
+            return None, None, nextToken
+        return changed, deletedIds, nextToken
+
+    def ensureIndexes(self):
+        """Create the indexes declared for this object.
+
+        This is meant to run at startup or from the command line,
+        never while handling a request.  Indexes that already exist
+        are left alone.
+
+        :returns: the names of the indexes
+        :rtype: list
+
+        """
+
+        syncIndex = IndexModel([('userName', ASCENDING),
+                                ('_modified', ASCENDING)])
+        self.tombstones.create_indexes([
+            syncIndex,
+            IndexModel([('deletedAt', ASCENDING)],
+                       expireAfterSeconds=TOMBSTONE_SECONDS)])
+        return self.table.create_indexes(self.indexes + [syncIndex])
+
     def getCreationFields(self):
-        """Return list of the fields for creating an item.
+        """Return the fields for creating an item.
 
         :returns: fields for creation of item
-        :rtype: list
+        :rtype: tuple
 
         """
 
-        return fieldsFromFieldNameArray(self.fields)
+        return self.schema.fields
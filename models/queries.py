@@ -0,0 +1,407 @@
+"""
+This is where the data objects' queries and writes are run.
+
+Everything goes through here so each operation is timed the same
+way.  Operations slower than the [mongo] slow_query_ms option are
+logged with the shape of their filter (its fields and operators,
+not the values), how long they took and how many documents they
+returned or touched.  A sample of the slow finds is run again with
+explain() to log how many documents and index keys the server
+examined and the plan it picked, which shows the scans.  That runs
+on a thread of its own so no request waits for it, and at most
+once per [mongo] explain_interval_seconds for each shape of query.
+
+A find returns the cursor wrapped, and its time is only known once
+it has been read: only the time spent waiting on the cursor counts,
+not what the caller does between documents.  A cursor dropped
+before it is read to the end is reported when it is collected.
+
+"""
+
+from .connection import getCursorBatchSize
+from libraries.executor import BoundedExecutor, Overloaded
+from libraries.metrics import REGISTRY
+from pymongo import ReturnDocument
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+OPERATION_TIME = REGISTRY.histogram('mongo_operation_seconds',
+                                    'Time of a data object query or write.',
+                                    ('collection', 'operation'))
+SLOW_OPERATIONS = REGISTRY.counter('mongo_slow_operations_total',
+                                   'Queries and writes over the threshold.',
+                                   ('collection', 'operation'))
+
+_state = {'slowSeconds': 0.1, 'explainRate': 0.1, 'maxTimeMS': 0,
+          'explainInterval': 60.0}
+# When each shape of query was last explained
+_explained = {}
+_explainedLock = threading.Lock()
+# A few explains can wait; more slow queries than that aren't explained
+_explainPool = BoundedExecutor('explain', maxWorkers=1, maxQueued=4)
+
+
+def configure(options):
+    """Set the slow query threshold and limits.
+
+    :param options: the [mongo] section of the config file
+    :type options: dict
+    :returns: (nothing)
+
+    """
+
+    _state['slowSeconds'] = float(options.get('slow_query_ms', 100)) / 1000
+    _state['explainRate'] = float(options.get('explain_sample_rate', 0.1))
+    _state['maxTimeMS'] = int(options.get('max_time_ms', 0))
+    _state['explainInterval'] = float(options.get('explain_interval_seconds',
+                                                  60))
+
+
+def queryShape(value):
+    """Return the shape of a filter: its keys with the values hidden.
+
+    :param value: the filter or part of it
+    :returns: the same structure with '?' for every value
+    """
+
+    if isinstance(value, dict):
+        return dict((key, queryShape(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = queryShape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return '?'
+
+
+def planSummary(plan):
+    """Return the stages of a query plan, innermost first.
+
+    :param plan: the winning plan of an explain()
+    :type plan: dict
+    :returns: the stages, such as 'IXSCAN userName_1 > FETCH'
+    :rtype: str
+
+    """
+
+    stages = []
+    while plan:
+        stage = plan.get('stage', '?')
+        if plan.get('indexName'):
+            stage += ' ' + plan['indexName']
+        stages.append(stage)
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [{}])[0]
+    return ' > '.join(reversed(stages))
+
+
+def explain(cursor):
+    """Return what the server examined for a query, or None.
+
+    :param cursor: an unread copy of the query's cursor
+    :type cursor: Cursor
+    :returns: documents examined, keys examined and the plan
+    :rtype: dict
+
+    """
+
+    try:
+        result = cursor.explain()
+    except Exception as e:
+        log.debug('Could not explain a slow query: %s', e)
+        return None
+    stats = result.get('executionStats', {})
+    return {'docsExamined': stats.get('totalDocsExamined'),
+            'keysExamined': stats.get('totalKeysExamined'),
+            'plan': planSummary(result.get('queryPlanner', {})
+                                .get('winningPlan'))}
+
+
+def logExplain(collection, details, makeCursor):
+    """Explain a slow find and log what the server examined.
+
+    :param collection: the collection searched
+    :type collection: Collection
+    :param details: the shape of the find
+    :type details: dict
+    :param makeCursor: returns a new cursor of the find
+    :type makeCursor: def
+    :returns: (nothing)
+
+    """
+
+    examined = explain(makeCursor())
+    if examined is not None:
+        details = dict(details, **examined)
+        log.warning('Plan of a slow find on %s: %s', collection.name,
+                    ' '.join('%s=%s' % (key, details[key])
+                             for key in sorted(details)))
+
+
+def explainLater(collection, details, makeCursor):
+    """Explain a slow find off the request, unless its shape just was.
+
+    :param collection: the collection searched
+    :type collection: Collection
+    :param details: the shape of the find
+    :type details: dict
+    :param makeCursor: returns a new cursor of the find
+    :type makeCursor: def
+    :returns: (nothing)
+
+    """
+
+    shape = details.copy()
+    shape.pop('returned', None)
+    key = (collection.full_name, repr(sorted(shape.items())))
+    now = time.time()
+    with _explainedLock:
+        if now - _explained.get(key, 0) < _state['explainInterval']:
+            return
+        _explained[key] = now
+    try:
+        _explainPool.submit(logExplain, collection, shape, makeCursor)
+    except Overloaded:
+        log.debug('Too many slow queries waiting to be explained')
+
+
+def report(collection, operation, seconds, details, makeCursor=None):
+    """Record an operation, and log it if it was slow.
+
+    :param collection: the collection operated on
+    :type collection: Collection
+    :param operation: find, update, delete...
+    :type operation: str
+    :param seconds: how long it took
+    :type seconds: float
+    :param details: what to log about it
+    :type details: dict
+    :param makeCursor: returns a new cursor of a find, to explain it
+    :type makeCursor: def
+    :returns: (nothing)
+
+    """
+
+    OPERATION_TIME.observe(seconds, collection=collection.name,
+                           operation=operation)
+    if seconds < _state['slowSeconds']:
+        return
+    SLOW_OPERATIONS.inc(collection=collection.name, operation=operation)
+    if makeCursor is not None and random.random() < _state['explainRate']:
+        explainLater(collection, details, makeCursor)
+    log.warning('Slow %s on %s: %.1f ms %s', operation, collection.name,
+                seconds * 1000, ' '.join('%s=%s' % (key, details[key])
+                                         for key in sorted(details)))
+
+
+class TimedCursor(object):
+
+    """
+    This class reads a find's cursor and reports the find once the
+    cursor is used up, closed or dropped.
+
+    """
+
+    def __init__(self, collection, cursor, makeCursor, details):
+        self.collection = collection
+        self.cursor = cursor
+        self.makeCursor = makeCursor
+        self.details = details
+        self.seconds = 0.0
+        self.returned = 0
+        self.reported = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            document = next(self.cursor)
+        except StopIteration:
+            self.seconds += time.perf_counter() - started
+            self.close()
+            raise
+        self.seconds += time.perf_counter() - started
+        self.returned += 1
+        return document
+
+    next = __next__
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Close the cursor and report the find, once."""
+
+        if self.reported:
+            return
+        self.reported = True
+        self.cursor.close()
+        self.details['returned'] = self.returned
+        report(self.collection, 'find', self.seconds, self.details,
+               self.makeCursor)
+
+
+def find(collection, criteria, projection=None, sort=None, limit=0,
+         hint=None, maxTimeMS=None):
+    """Run a find.
+
+    :param collection: the collection to search
+    :type collection: Collection
+    :param criteria: the filter
+    :type criteria: dict
+    :param projection: the only fields to return, None for all
+    :type projection: tuple
+    :param sort: (field, direction) pairs to sort on (optional)
+    :type sort: list
+    :param limit: the maximum number of documents, 0 for all
+    :type limit: int
+    :param hint: the index to use, by name or keys (optional)
+    :type hint: str or list
+    :param maxTimeMS: the server time limit, None for the configured one
+    :type maxTimeMS: int
+    :returns: the documents found
+    :rtype: TimedCursor
+
+    """
+
+    if maxTimeMS is None:
+        maxTimeMS = _state['maxTimeMS']
+
+    def makeCursor():
+        cursor = collection.find(criteria, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        if hint is not None:
+            cursor = cursor.hint(hint)
+        if maxTimeMS:
+            cursor = cursor.max_time_ms(maxTimeMS)
+        return cursor
+
+    details = {'filter': queryShape(criteria)}
+    if sort:
+        details['sort'] = [field for field, direction in sort]
+    if limit:
+        details['limit'] = limit
+    if hint is not None:
+        details['hint'] = hint
+    return TimedCursor(collection,
+                       makeCursor().batch_size(getCursorBatchSize()),
+                       makeCursor, details)
+
+
+def findOne(collection, criteria, projection=None, hint=None,
+            maxTimeMS=None):
+    """Return the first document a find matches, or None.
+
+    See find for the parameters.
+
+    """
+
+    cursor = find(collection, criteria, projection, limit=1, hint=hint,
+                  maxTimeMS=maxTimeMS)
+    try:
+        return next(cursor, None)
+    finally:
+        cursor.close()
+
+
+def timed(collection, operation, criteria, write):
+    """Run and report a write.
+
+    :param collection: the collection written to
+    :type collection: Collection
+    :param operation: the name of the write
+    :type operation: str
+    :param criteria: the filter of the write, None for inserts
+    :type criteria: dict
+    :param write: runs the write and returns its result
+    :type write: def
+    :returns: the result of the write
+
+    """
+
+    started = time.perf_counter()
+    result = write()
+    details = {}
+    if criteria is not None:
+        details['filter'] = queryShape(criteria)
+    for name in ('matched_count', 'modified_count', 'deleted_count'):
+        if hasattr(result, name):
+            details[name.split('_')[0]] = getattr(result, name)
+    report(collection, operation, time.perf_counter() - started, details)
+    return result
+
+
+def findOneAndUpdate(collection, criteria, update, upsert=False):
+    """Update the first document matching a filter and return it.
+
+    :param collection: the collection written to
+    :type collection: Collection
+    :param criteria: the filter
+    :type criteria: dict
+    :param update: the update to apply
+    :type update: dict
+    :param upsert: whether to insert a document if none matches
+    :type upsert: bool
+    :returns: the document after the update, or None
+    :rtype: dict
+
+    """
+
+    return timed(collection, 'find_and_modify', criteria,
+                 lambda: collection.find_one_and_update(
+                     criteria, update, upsert=upsert,
+                     return_document=ReturnDocument.AFTER))
+
+
+def insertOne(collection, document):
+    """Insert a document and return the result."""
+
+    return timed(collection, 'insert', None,
+                 lambda: collection.insert_one(document))
+
+
+def insertMany(collection, documents, ordered=True):
+    """Insert documents and return the result."""
+
+    return timed(collection, 'insert', None,
+                 lambda: collection.insert_many(documents, ordered=ordered))
+
+
+def updateOne(collection, criteria, update):
+    """Update the first document matching a filter and return the result."""
+
+    return timed(collection, 'update', criteria,
+                 lambda: collection.update_one(criteria, update))
+
+
+def deleteOne(collection, criteria):
+    """Delete the first document matching a filter and return the result."""
+
+    return timed(collection, 'delete', criteria,
+                 lambda: collection.delete_one(criteria))
+
+
+def bulkWrite(collection, operations, ordered=False):
+    """Run a bulk write and return the result.
+
+    A BulkWriteError is reported like a result before it is raised.
+
+    """
+
+    started = time.perf_counter()
+    try:
+        result = collection.bulk_write(operations, ordered=ordered)
+    finally:
+        report(collection, 'bulk_write', time.perf_counter() - started,
+               {'operations': len(operations)})
+    return result
@@ -11,17 +11,35 @@ The rest is custom code to bring it all together.
 """
 
 from bottle import Bottle, hook, HTTPResponse, request, TEMPLATE_PATH
-from bottle import jinja2_template as template, static_file, debug
+from bottle import static_file, debug
 from beaker.middleware import SessionMiddleware
+from bson.errors import InvalidId
 from configobj import ConfigObj
-from cork import Cork, AuthException, AAAException
-from cork.backends import MongoDBBackend
+from cork import AuthException, AAAException
 from gunicorn.app.base import Application
-from libraries.utils import JSONHelper, strToId, CSVHelper
+from libraries.auth import CachedCork
+from libraries.cache import LRUCache
+from libraries.compression import CompressionMiddleware
+from libraries.executor import BoundedExecutor, Overloaded
+from libraries.mail import MailQueueFull, QueuedMailer
+from libraries.metrics import REGISTRY
+from libraries.profiling import ProfilingMiddleware
+from libraries.templates import render as template, renderMemoized
+from libraries.timing import TimingMiddleware
+from libraries.utils import JSONHelper, strToId, idToStr, CSVHelper
+from libraries import assets, profiling, templates, timing
+from models import connection, queries
 from models.address import AddressModel
+from models.connection import SharedMongoDBBackend
+import atexit
+import hashlib
+import hmac
 import logging
+import mimetypes
 import os
+import signal
 import sys
+import threading
 
 logging.basicConfig(format='localhost - - [%(asctime)s] %(message)s',
                     level=logging.DEBUG)
@@ -33,6 +51,9 @@ TEMPLATE_PATH.append(os.path.join(MODULEPATH, "views"))
 LOGIN_PATH = '/login'
 CHANGE_PASSWORD_PATH = '/change_password'
 VALIDATE_REGISTRATION_PATH = '/validate_registration'
+MAX_PAGE_SIZE = 100
+MAX_BATCH_SIZE = 1000
+MAX_CHANGES = 1000
 
 
 class AddressServer(Application):
@@ -46,34 +67,180 @@ class AddressServer(Application):
 
     """
 
-    def __init__(self, options={}):
+    def __init__(self, options={}, settings={}):
         self.usage = None
         self.callable = None
         self.prog = None
         self.options = options
+        self.settings = settings
+        self.workerPid = None
+        self.workerLock = threading.Lock()
         self.do_load_config()
 
-        self.setup_cork()
+        self.MONGO_DB = os.environ.get('MONGOHQ_DB')
+        self.MONGO_URL = os.environ.get('MONGOHQ_URL')
+        connection.configure(self.settings.get('mongo', {}))
+        queries.configure(self.settings.get('mongo', {}))
+        self.setup_templates()
+        self.setup_profiling()
 
         super(AddressServer, self).__init__()
         self.app = Bottle()
         self.add_routes()
         self.add_middleware()
 
+    def setup_templates(self):
+        """Compile the templates before any worker is forked."""
+
+        templateSettings = self.settings.get('templates', {})
+        bytecodeDir = templateSettings.get('bytecode_cache_dir')
+        if bytecodeDir:
+            bytecodeDir = os.path.join(MODULEPATH, bytecodeDir)
+        assets.loadManifest(os.path.join(MODULEPATH, 'static/dist'))
+        templates.configure([os.path.join(MODULEPATH, 'views')], bytecodeDir,
+                            config_flag(templateSettings, 'auto_reload'),
+                            {'assets': assets.urls})
+        templates.warm()
+
+    def setup_profiling(self):
+        """Set up where and how live workers are profiled."""
+
+        profilingSettings = self.settings.get('profiling', {})
+        profiling.configure(
+            os.path.join(MODULEPATH, profilingSettings.get('output_dir',
+                                                           'profiles')),
+            float(profilingSettings.get('sample_interval_ms', 5)) / 1000,
+            float(profilingSettings.get('seconds', 30)))
+
+    @property
+    def loginPlugin(self):
+        """The cork login plugin of the current worker process."""
+
+        if self.workerPid != os.getpid():
+            self.setup_worker()
+        return self._loginPlugin
+
+    def setup_worker(self):
+        """Set up everything that must not be shared across a fork.
+
+        This runs once per worker, right after gunicorn forks it,
+        or lazily on first use when the app runs without gunicorn.
+
+        """
+
+        with self.workerLock:
+            if self.workerPid == os.getpid():
+                return
+            self.setup_cork()
+            self.setup_cache()
+            self.workerPid = os.getpid()
+
+    def ensure_indexes(self):
+        """Create every index the application's queries rely on."""
+
+        AddressModel(self.MONGO_URL, self.MONGO_DB).ensureIndexes()
+        SharedMongoDBBackend(self.MONGO_DB, self.MONGO_URL).ensureIndexes()
+
+    def ensure_indexes_at_startup(self):
+        """Create the indexes once, before any worker is forked.
+
+        This only runs with the [mongo] ensure_indexes_at_startup
+        option on.  A failure is logged rather than raised, so the
+        site still comes up when mongo is unreachable or an index
+        can't be built; --ensure-indexes shows the error.
+
+        """
+
+        if not config_flag(self.settings.get('mongo', {}),
+                           'ensure_indexes_at_startup'):
+            return
+        try:
+            self.ensure_indexes()
+        except Exception:
+            log.exception('Could not create the indexes')
+
+    def setup_cache(self):
+        """Set up the address list cache from the [cache] config."""
+
+        cacheSettings = self.settings.get('cache', {})
+        self.addressCache = None
+        if config_flag(cacheSettings, 'enabled'):
+            self.addressCache = LRUCache(
+                'addresses',
+                maxEntries=int(cacheSettings.get('max_entries', 1000)),
+                maxBytes=int(cacheSettings.get('max_bytes', 32 << 20)),
+                ttl=int(cacheSettings.get('ttl_seconds', 300)),
+                maxEntryBytes=int(cacheSettings.get('max_entry_bytes',
+                                                    1 << 20)))
+
     def setup_cork(self):
-        """Set up cork using environment variables."""
+        """Set up cork using environment variables.
+
+        Emails are queued and sent by a thread of the worker, as set
+        up in the [email] config, and SMTP_URL can point them at
+        another server such as tools/smtp_sink.py.  Authenticated
+        users are cached per worker for the time to live of the
+        [auth] config, so most requests skip the user and role
+        lookups.  Password hashing runs on a pool bounded by the
+        [hashing] config (see hash_pool_size).
+
+        """
 
         EMAIL = os.environ.get('EMAIL_SENDER')
         EMAIL_PASS = os.environ.get('EMAIL_PASSWORD')
-        self.MONGO_DB = os.environ.get('MONGOHQ_DB')
-        self.MONGO_URL = os.environ.get('MONGOHQ_URL')
-        mb = MongoDBBackend(self.MONGO_DB, self.MONGO_URL)
-        self.loginPlugin = Cork(backend=mb, email_sender=EMAIL,
-                                smtp_url='starttls://' + EMAIL + ':' +
-                                EMAIL_PASS + '@smtp.gmail.com:587')
+        SMTP_URL = os.environ.get('SMTP_URL') or \
+            'starttls://' + EMAIL + ':' + EMAIL_PASS + '@smtp.gmail.com:587'
+        authSettings = self.settings.get('auth', {})
+        authCache = LRUCache(
+            'auth',
+            maxEntries=int(authSettings.get('cache_max_entries', 10000)),
+            ttl=int(authSettings.get('cache_ttl_seconds', 30)))
+        mb = SharedMongoDBBackend(self.MONGO_DB, self.MONGO_URL)
+        maxWorkers, maxQueued = self.hash_pool_size()
+        hashPool = BoundedExecutor('hashing', maxWorkers=maxWorkers,
+                                   maxQueued=maxQueued)
+        self._loginPlugin = CachedCork(authCache, backend=mb,
+                                       email_sender=EMAIL, smtp_url=SMTP_URL,
+                                       hashPool=hashPool)
+
+        emailSettings = self.settings.get('email', {})
+        mailer = QueuedMailer(
+            EMAIL, SMTP_URL,
+            maxQueued=int(emailSettings.get('queue_size', 100)),
+            retries=int(emailSettings.get('retries', 3)),
+            retryDelay=float(emailSettings.get('retry_delay_seconds', 10)),
+            timeout=float(emailSettings.get('smtp_timeout_seconds', 30)),
+            join_timeout=float(emailSettings.get('drain_seconds', 5)))
+        self._loginPlugin.mailer = mailer
+        atexit.register(mailer.join)
+
+    def hash_pool_size(self):
+        """Return the size of the hashing pool from the [hashing] config.
+
+        A request waits on its hash, so the pool admits at most one
+        task fewer than a worker has request threads, and the last
+        thread is always free for the rest of the site.  Async
+        workers don't hold a thread per request, so for them the
+        config stands as it is.
+
+        :returns: the most tasks running and the most queued
+        :rtype: tuple
+
+        """
+
+        hashSettings = self.settings.get('hashing', {})
+        maxWorkers = int(hashSettings.get('max_workers', 2))
+        maxQueued = int(hashSettings.get('max_queued', 8))
+        threads = self.worker_options(
+            self.options.get('mode', 'sync')).get('threads')
+        if threads is not None:
+            slots = max(1, threads - 1)
+            maxWorkers = min(maxWorkers, slots)
+            maxQueued = min(maxQueued, slots - maxWorkers)
+        return maxWorkers, maxQueued
 
     def add_middleware(self):
-        """Set up the session middleware."""
+        """Set up the session, profiling, timing and compression middleware."""
 
         ENCRYPT_KEY = os.environ.get('ENCRYPT_KEY')
         session_opts = {
@@ -86,6 +253,21 @@ class AddressServer(Application):
         }
         self.app = SessionMiddleware(self.app, session_opts)
 
+        if config_flag(self.settings.get('profiling', {}), 'enabled'):
+            self.app = ProfilingMiddleware(self.app)
+
+        metricsSettings = self.settings.get('metrics', {})
+        if config_flag(metricsSettings, 'enabled'):
+            self.app = TimingMiddleware(
+                self.app, config_flag(metricsSettings, 'server_timing'))
+
+        compressionSettings = self.settings.get('compression', {})
+        if config_flag(compressionSettings, 'enabled'):
+            self.app = CompressionMiddleware(
+                self.app,
+                minimumSize=int(compressionSettings.get('minimum_size', 1024)),
+                level=int(compressionSettings.get('level', 6)))
+
     def add_routes(self):
         """Add all the application routes."""
 
@@ -116,6 +298,13 @@ class AddressServer(Application):
                        apply=self.check_login)
         self.app.route('/addresses', 'PUT', callback=put_addresses,
                        apply=self.check_login)
+        self.app.route('/addresses/batch', 'POST', callback=batch_addresses,
+                       apply=self.check_login)
+        self.app.route('/addresses', 'DELETE',
+                       callback=delete_multiple_addresses,
+                       apply=self.check_login)
+        self.app.route('/addresses/<addressId>', 'GET', callback=get_address,
+                       apply=self.check_login)
         self.app.route('/addresses/<deleteId>', 'DELETE',
                        callback=delete_addresses, apply=self.check_login)
         self.app.route('/csv', 'GET', callback=csv_export,
@@ -126,6 +315,10 @@ class AddressServer(Application):
 #        self.app.route('/import_csv', 'GET', callback=csv_import,
 #                       apply=self.check_login)
 
+        self.app.route('/metrics', 'GET', callback=metrics)
+        if config_flag(self.settings.get('profiling', {}), 'enabled'):
+            self.app.route('/admin/profile', 'POST', callback=start_profile)
+        self.app.route('/assets/<filename>', 'GET', callback=asset_static)
         self.app.route('/js/<filename>', 'GET', callback=js_static)
         self.app.route('/css/<filename>', 'GET', callback=css_static)
 
@@ -142,8 +335,61 @@ class AddressServer(Application):
         for k, v in self.options.items():
             if k.lower() in self.cfg.settings and v is not None:
                 cfg[k.lower()] = v
+        if 'worker_class' not in cfg:
+            cfg.update(self.worker_options(self.options.get('mode', 'sync')))
+
+        # gunicorn checks the arity of hooks, so no bound methods here
+        def when_ready(server):
+            self.ensure_indexes_at_startup()
+        cfg['when_ready'] = when_ready
+
+        def post_fork(server, worker):
+            self.setup_worker()
+        cfg['post_fork'] = post_fork
+
+        # The worker sets up its own signals after the fork, so this
+        # comes later; send SIGUSR2 to a worker, never to the master
+        def post_worker_init(worker):
+            if config_flag(self.settings.get('profiling', {}), 'enabled'):
+                profiling.install(signal.SIGUSR2)
+        cfg['post_worker_init'] = post_worker_init
         return cfg
 
+    def worker_options(self, mode):
+        """Return the gunicorn options of a concurrency mode.
+
+        sync serves one request at a time per worker.  threaded
+        (gthread) serves up to `threads` requests at once per worker,
+        so a slow query or SMTP call only holds up one thread.  async
+        runs gevent workers, where waiting on the network yields to
+        other requests; it needs gevent installed and falls back to
+        threaded otherwise.  Whatever the mode, a worker's requests
+        share its mongo pool, caches, hashing pool and email queue,
+        and everything about a request lives on the request itself.
+
+        :param mode: 'sync', 'threaded' or 'async'
+        :type mode: str
+        :returns: the options
+        :rtype: dict
+
+        """
+
+        if mode == 'async':
+            try:
+                import gevent  # noqa: F401
+                return {'worker_class': 'gevent',
+                        'worker_connections': int(self.options.get(
+                            'worker_connections', 100))}
+            except ImportError:
+                log.warning('gevent is not installed, running threaded')
+                mode = 'threaded'
+        if mode == 'threaded':
+            return {'worker_class': 'gthread',
+                    'threads': int(self.options.get('threads', 4))}
+        if mode != 'sync':
+            raise ValueError('Unknown concurrency mode: %s' % mode)
+        return {'worker_class': 'sync', 'threads': 1}
+
     def load(self):
         """Load and return the bottle app."""
 
@@ -160,9 +406,17 @@ class AddressServer(Application):
         """
 
         def check_uid(**kwargs):
-            self.loginPlugin.require(fail_redirect=LOGIN_PATH)
-            kwargs["helper"] = AddressModel(self.MONGO_URL, self.MONGO_DB)
-            kwargs["userName"] = self.loginPlugin.current_user.username
+            with timing.phase('session'):
+                # beaker only decodes the cookie when first asked
+                session = request.environ.get('beaker.session')
+                if session is not None:
+                    session.get('username')
+            with timing.phase('auth'):
+                userName = self.loginPlugin.require_username(
+                    fail_redirect=LOGIN_PATH)
+            kwargs["helper"] = AddressModel(self.MONGO_URL, self.MONGO_DB,
+                                            cache=self.addressCache)
+            kwargs["userName"] = userName
             return fn(**kwargs)
         return check_uid
 
@@ -182,6 +436,26 @@ class AddressServer(Application):
         return add_plugin
 
 
+def config_flag(section, name, default=False):
+    """Get a true/false option from a section of the config file.
+
+    :param section: the section of the config file
+    :type section: dict
+    :param name: the name of the option
+    :type name: str
+    :param default: the value if the option is not set
+    :type default: bool
+    :returns: the value of the option
+    :rtype: bool
+
+    """
+
+    value = section.get(name)
+    if value is None:
+        return default
+    return str(value).lower() in ('true', 'yes', 'on', '1')
+
+
 def post_get(name, default=''):
     """Get posted information.
 
@@ -205,7 +479,7 @@ def get_login():
 
     """
 
-    return template('login.html')
+    return static_page('login.html')
 
 
 def post_login(loginPlugin):
@@ -231,6 +505,8 @@ def post_login(loginPlugin):
     # redirects throw an exception, so ignore
     except HTTPResponse:
         raise
+    except Overloaded:
+        return overloaded('login.html')
     except Exception:
         errMessage = 'Login had an unknown error.'
         log.exception(errMessage)
@@ -259,7 +535,7 @@ def get_register(loginPlugin):
 
     """
 
-    return template('registration.html')
+    return static_page('registration.html')
 
 
 def post_register(loginPlugin):
@@ -278,6 +554,11 @@ def post_register(loginPlugin):
         loginPlugin.register(post_get('username'), post_get('password'),
                              post_get('email_address'))
         success = True
+    except Overloaded:
+        return overloaded('registration.html')
+    except MailQueueFull:
+        errMessage = 'We cannot send email right now, please try again later.'
+        log.exception(errMessage)
     except AssertionError:
         errMessage = 'You must fill out user name, password,'
         errMessage += ' and email address to register.'
@@ -327,7 +608,7 @@ def get_reset_password():
 
     """
 
-    return template('get_reset_code.html')
+    return static_page('get_reset_code.html')
 
 
 def post_reset_password(loginPlugin):
@@ -350,6 +631,11 @@ def post_reset_password(loginPlugin):
         loginPlugin.send_password_reset_email(username=userName,
                                               email_addr=emailAddress)
         success = True
+    except Overloaded:
+        return overloaded('get_reset_code.html', success=False)
+    except MailQueueFull:
+        errMessage = 'We cannot send email right now, please try again later.'
+        log.exception(errMessage)
     except AuthException:
         errMessage = 'Your username or email address is invalid.'
         log.exception(errMessage)
@@ -393,6 +679,9 @@ def post_change_password(loginPlugin):
         password = post_get('password')
         loginPlugin.reset_password(reset_code, password)
         success = True
+    except Overloaded:
+        return overloaded('password_reset_form.html', reset_code=reset_code,
+                          success=False)
     except AuthException as aue:
         errMessage = str(aue)
         log.exception(errMessage)
@@ -418,64 +707,211 @@ def index(helper, userName):
 
     """
 
-    address_fields = helper.getCreationFields()
-    return template('home.html', address_fields=address_fields)
+    # The schema is built once per model class, so it keys the page
+    return static_page('home.html', helper.schema,
+                       address_fields=helper.getCreationFields())
 
 
 def get_addresses(helper, userName):
-    """The JSON of all addresses for the given user.
+    """The JSON of the addresses for the given user.
+
+    Without a limit query parameter every address is returned.
+    With one, a single page is returned along with the cursor of
+    the next page, which is passed back as the after parameter.
+    The page can be sorted (sort, order) and searched (search), and
+    only has the fields the list shows; get_address has the rest.
+    Pages also carry a sync token; passing it back as the since
+    parameter returns only what changed after the page was read.
+    Responses have an ETag from the user's version, so a client
+    that already has the data gets a 304 without any query.
 
     :param helper: the helper object to operate on the databaes
     :type helper: DataObject
     :param userName: the user name of the currently logged in user
     :type userName: str
-    :returns: JSON data of all the addresses
-    :rtype: str
+    :returns: JSON data of the addresses, streamed in chunks
+    :rtype: HTTPResponse
 
     """
 
-    addresses = helper.getMultiple(userName=userName)
-    jsonAddresses = JSONHelper().encode(addresses)
+    version = helper.getVersion(userName)
+    etag = version_etag(userName, version)
+    if etag_matches(etag):
+        return not_modified(etag)
+
+    if request.query.since:
+        return get_address_changes(helper, userName, etag)
+    if request.query.limit:
+        return get_addresses_page(helper, userName, version, etag)
+
+    addresses = helper.getMultiple(userName=userName,
+                                   projection=helper.schema.names)
+    jsonAddresses = JSONHelper().encodeStream(addresses)
     return HTTPResponse(jsonAddresses, status=200,
-                        header={'Content-Type': 'application/json'})
+                        headers=cache_headers(etag, 'application/json'))
+
+
+def get_address(addressId, helper, userName):
+    """The JSON of one address with all of its fields.
+
+    Lists only carry what they show, so editing starts from this.
+
+    :param addressId: the id of the address
+    :type addressId: str
+    :param helper: the helper object to operate on the databaes
+    :type helper: DataObject
+    :param userName: the user name of the currently logged in user
+    :type userName: str
+    :returns: JSON data of the address
+    :rtype: HTTPResponse
+
+    """
+
+    try:
+        thisId = strToId(addressId)
+    except (TypeError, InvalidId):
+        return return_error(404, "The address was not found.")
+    address = helper.get(thisId, userName, projection=helper.schema.names)
+    if address is None:
+        return return_error(404, "The address was not found.")
+    idToStr(address)
+    return HTTPResponse(JSONHelper().encode(address), status=200,
+                        headers={'Content-Type': 'application/json'})
+
+
+def get_addresses_page(helper, userName, version, etag):
+    """The JSON of one page of addresses for the given user.
+
+    :param helper: the helper object to operate on the databaes
+    :type helper: DataObject
+    :param userName: the user name of the currently logged in user
+    :type userName: str
+    :param version: the user's version, read before the page
+    :type version: int
+    :param etag: the ETag of the response
+    :type etag: str
+    :returns: JSON data of the page and the next cursor
+    :rtype: HTTPResponse
+
+    """
+
+    try:
+        pageSize = int(request.query.limit)
+    except ValueError:
+        return return_error(400, "The limit must be a number.")
+    if not 0 < pageSize <= MAX_PAGE_SIZE:
+        return return_error(400, "The limit must be between 1 and " +
+                            str(MAX_PAGE_SIZE) + ".")
+
+    fieldNames = helper.schema.names
+    sortColumns = [column for column in request.query.sort.split(',')
+                   if column != '']
+    if len(sortColumns) > 2 or \
+            any(column not in fieldNames for column in sortColumns):
+        return return_error(400, "Sort by up to two address fields.")
+    sortColumns += [''] * (2 - len(sortColumns))
+
+    # The version was read first so changes made meanwhile aren't missed
+    syncToken = helper.getSyncToken(userName, version)
+    try:
+        addresses, nextCursor = helper.getPage(
+            userName, pageSize, sortColumns[0], sortColumns[1],
+            request.query.order != 'desc', request.query.search.strip(),
+            request.query.after or None, helper.listSchema.names)
+    except ValueError:
+        return return_error(400, "The after cursor is not valid.")
+
+    for address in addresses:
+        idToStr(address)
+    jsonPage = JSONHelper().encode({'addresses': addresses,
+                                    'next': nextCursor,
+                                    'token': syncToken})
+    return HTTPResponse(jsonPage, status=200,
+                        headers=cache_headers(etag, 'application/json'))
+
+
+def get_address_changes(helper, userName, etag):
+    """The JSON of the addresses changed since a sync token.
+
+    The addresses have the fields of a page.  If the token is too
+    old to know what changed, or more than MAX_CHANGES changed,
+    reset is true and the client should get all the addresses again.
+
+    :param helper: the helper object to operate on the databaes
+    :type helper: DataObject
+    :param userName: the user name of the currently logged in user
+    :type userName: str
+    :param etag: the ETag of the response
+    :type etag: str
+    :returns: JSON data of the changed and deleted addresses
+    :rtype: HTTPResponse
+
+    """
+
+    try:
+        addresses, deletedIds, syncToken = helper.getChanges(
+            userName, request.query.since, helper.listSchema.names,
+            MAX_CHANGES)
+    except ValueError:
+        return return_error(400, "The since token is not valid.")
+
+    if addresses is None:
+        changes = {'reset': True, 'token': syncToken}
+    else:
+        for address in addresses:
+            idToStr(address)
+        changes = {'reset': False, 'addresses': addresses,
+                   'deleted': [str(deletedId) for deletedId in deletedIds],
+                   'token': syncToken}
+    return HTTPResponse(JSONHelper().encode(changes), status=200,
+                        headers=cache_headers(etag, 'application/json'))
 
 
 def post_addresses(helper, userName):
-    """Create a new address.
+    """Create a new address, or a list of them in one bulk write.
 
     :param helper: the helper object to operate on the databaes
     :type helper: DataObject
     :param userName: the user name of the currently logged in user
     :type userName: str
-    :returns: JSON data indicating success or not
+    :returns: JSON data indicating success or not (for each address)
     :rtype: str
 
     """
 
     throwAway, newAddress = JSONHelper().decode(request.body.read())
 
+    if type(newAddress) is list:
+        postIds = helper.createMultiple(newAddress, userName=userName)
+        return bulk_response(postIds, [postId != -1 for postId in postIds],
+                             "Create did not work.")
+
     postId = helper.create(newAddress, userName=userName)
     if postId != -1:
         return HTTPResponse(JSONHelper().encode({'_id': postId}), status=200,
-                            header={'Content-Type': 'application/json'})
+                            headers={'Content-Type': 'application/json'})
     else:
         return return_error(400, "Create did not work.")
 
 
 def put_addresses(helper, userName):
-    """Save changes to an address.
+    """Save changes to an address, or a list of them in one bulk write.
 
     :param helper: the helper object to operate on the databaes
     :type helper: DataObject
     :param userName: the user name of the currently logged in user
     :type userName: str
-    :returns: JSON data indicating success or not
+    :returns: JSON data indicating success or not (for each address)
     :rtype: str
 
     """
 
     ids, decodeds = JSONHelper().decode(request.body.read())
 
+    if type(ids) is list:
+        successes = helper.updateMultiple(ids, decodeds, userName=userName)
+        return bulk_response(ids, successes, "Update did not work.")
+
     if helper.updateMultiple(ids, decodeds, userName=userName):
         return HTTPResponse(status=200)
     else:
@@ -502,6 +938,165 @@ def delete_addresses(deleteId, helper, userName):
         return return_error(400, "Delete did not work")
 
 
+def delete_multiple_addresses(helper, userName):
+    """Delete a list of addresses in one bulk write.
+
+    The body is a JSON list of objects with the _id to delete.
+
+    :param helper: the helper object to operate on the databaes
+    :type helper: DataObject
+    :param userName: the user name of the currently logged in user
+    :type userName: str
+    :returns: JSON data indicating success or not for each address
+    :rtype: str
+
+    """
+
+    ids, throwAway = JSONHelper().decode(request.body.read())
+    if type(ids) is not list:
+        return return_error(400, "Send a list of addresses to delete.")
+
+    successes = helper.deleteMultiple(ids, userName=userName)
+    return bulk_response(ids, successes, "Delete did not work.")
+
+
+def batch_addresses(helper, userName):
+    """Create, update and delete addresses in one bulk write.
+
+    The body is a JSON list of operations, each an object with
+    an op (create, update or delete) and the address it is for.
+    Updates and deletes find the address by its _id.
+
+    :param helper: the helper object to operate on the databaes
+    :type helper: DataObject
+    :param userName: the user name of the currently logged in user
+    :type userName: str
+    :returns: JSON data indicating success or not for each operation
+    :rtype: str
+
+    """
+
+    try:
+        throwAway, decodeds = JSONHelper().decode(request.body.read())
+    except (ValueError, TypeError, InvalidId):
+        return return_error(400, "Send a list of operations.")
+    if type(decodeds) is not list:
+        return return_error(400, "Send a list of operations.")
+    if len(decodeds) > MAX_BATCH_SIZE:
+        return return_error(400, "Send at most " + str(MAX_BATCH_SIZE) +
+                            " operations at a time.")
+
+    operations = []
+    for decoded in decodeds:
+        operation = batch_operation(decoded)
+        if operation is None:
+            return return_error(400, "Each operation needs an op and an "
+                                "address (with a valid _id unless "
+                                "creating).")
+        operations.append(operation)
+
+    results = helper.batch(operations, userName=userName)
+    ids = []
+    successes = []
+    for i in range(len(operations)):
+        if operations[i][0] == 'create':
+            ids.append(results[i])
+            successes.append(results[i] != -1)
+        else:
+            ids.append(operations[i][1])
+            successes.append(results[i])
+    return bulk_response(ids, successes, "Batch did not work.")
+
+
+def batch_operation(decoded):
+    """Return one operation of a batch, checked.
+
+    :param decoded: the decoded JSON of the operation
+    :returns: the kind, the id and the address, or None if not valid
+    :rtype: tuple
+
+    """
+
+    if type(decoded) is not dict:
+        return None
+    kind = decoded.get('op')
+    address = decoded.get('address') or {}
+    if kind not in ('create', 'update', 'delete') or type(address) is not dict:
+        return None
+    try:
+        thisId, address = JSONHelper().pullId(address)
+    except (TypeError, InvalidId):
+        return None
+    if kind != 'create' and thisId is None:
+        return None
+    return kind, thisId, address
+
+
+def overloaded(page, **kwargs):
+    """Return a page asking the user to try again shortly.
+
+    :param page: the template of the page the user was on
+    :type page: str
+    :param kwargs: more values for the template
+    :returns: the page with a 503 status
+    :rtype: HTTPResponse
+
+    """
+
+    errMessage = 'The server is busy right now, please try again shortly.'
+    log.warning('Shedding load on %s', request.path)
+    return HTTPResponse(template(page, errMessage=errMessage, **kwargs),
+                        status=503, headers={'Retry-After': '5'})
+
+
+def static_page(name, key=(), **kwargs):
+    """Return a page rendered once for what its output depends on.
+
+    :param name: the file name of the template
+    :type name: str
+    :param key: everything the output depends on
+    :type key: tuple
+    :param kwargs: the values for the template
+    :returns: the page, or 304 if the client has it
+    :rtype: HTTPResponse
+
+    """
+
+    body, etag = renderMemoized(name, key, **kwargs)
+    if etag_matches(etag):
+        return not_modified(etag)
+    return HTTPResponse(body, headers=cache_headers(
+        etag, 'text/html; charset=UTF-8'))
+
+
+def bulk_response(ids, successes, msg):
+    """Return the JSON result of a bulk operation for each id.
+
+    :param ids: the id each operation was for
+    :type ids: list
+    :param successes: whether each operation worked
+    :type successes: list
+    :param msg: the message to return to the user if any failed
+    :type msg: str
+    :returns: the JSON results, with an error if any failed
+    :rtype: HTTPResponse
+
+    """
+
+    results = []
+    for i in range(len(ids)):
+        thisId = str(ids[i]) if ids[i] not in (None, -1) else None
+        results.append({'_id': thisId, 'success': successes[i]})
+
+    if all(successes):
+        return HTTPResponse(JSONHelper().encode(results), status=200,
+                            headers={'Content-Type': 'application/json'})
+    else:
+        json_err = JSONHelper().encode({'error': msg, 'results': results})
+        return HTTPResponse(json_err, status=400,
+                            headers={'Content-Type': 'application/json'})
+
+
 def csv_export(helper, userName):
     """Export all addresses in the database as a csv file.
 
@@ -509,18 +1104,21 @@ def csv_export(helper, userName):
     :type helper: DataObject
     :param userName: the user name of the currently logged in user
     :type userName: str
-    :returns: HTTP response with the csv file download
+    :returns: HTTP response with the csv file download, streamed in chunks
     :rtype: HTTPResponse
 
     """
 
-    addresses = helper.getMultiple(userName=userName)
-    csvAddresses = CSVHelper().convertToCSV(addresses,
-                                            helper.getCreationFields())
-    disposition = "attachment;filename=addresses.csv"
-    return HTTPResponse(body=csvAddresses, status=200,
-                        headers={'Content-Type': 'text/csv',
-                                'Content-disposition': disposition})
+    etag = version_etag(userName, helper.getVersion(userName))
+    if etag_matches(etag):
+        return not_modified(etag)
+
+    addresses = helper.getMultiple(userName=userName,
+                                   projection=helper.schema.names)
+    csvAddresses = CSVHelper().streamCSV(addresses, helper.schema)
+    headers = cache_headers(etag, 'text/csv')
+    headers['Content-disposition'] = "attachment;filename=addresses.csv"
+    return HTTPResponse(body=csvAddresses, status=200, headers=headers)
 
 
 def christmas_card_csv_export(helper, userName):
@@ -530,18 +1128,21 @@ def christmas_card_csv_export(helper, userName):
     :type helper: DataObject
     :param userName: the user name of the currently logged in user
     :type userName: str
-    :returns: HTTP response with the csv file download
+    :returns: HTTP response with the csv file download, streamed in chunks
     :rtype: HTTPResponse
 
     """
 
-    addresses = helper.getMultiple(userName, {'send_christmas_card': True})
-    csvAddresses = CSVHelper().convertToCSV(addresses,
-                                            helper.getChristmasFields())
-    disposition = "attachment;filename=christmas_card.csv"
-    return HTTPResponse(csvAddresses, status=200,
-                        headers={'Content-Type': 'text/csv',
-                                'Content-disposition': disposition})
+    etag = version_etag(userName, helper.getVersion(userName))
+    if etag_matches(etag):
+        return not_modified(etag)
+
+    addresses = helper.getMultiple(userName, {'send_christmas_card': True},
+                                   projection=helper.christmasSchema.names)
+    csvAddresses = CSVHelper().streamCSV(addresses, helper.christmasSchema)
+    headers = cache_headers(etag, 'text/csv')
+    headers['Content-disposition'] = "attachment;filename=christmas_card.csv"
+    return HTTPResponse(csvAddresses, status=200, headers=headers)
 
 
 #This is really for testing purposes and needs updated to use for real.
@@ -557,6 +1158,120 @@ def christmas_card_csv_export(helper, userName):
 #        return return_error(400, "Import did not work.")
 
 
+def metrics():
+    """The metrics of this worker, for Prometheus to scrape.
+
+    Only operators can see them (see operators_only).  Every worker
+    keeps its own metrics, so each scrape sees the one it hit.
+
+    :returns: the metrics in the Prometheus text format
+    :rtype: HTTPResponse
+
+    """
+
+    refused = operators_only()
+    if refused is not None:
+        return refused
+    return HTTPResponse(REGISTRY.exposition(), status=200, headers={
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+        'Cache-Control': 'no-store'})
+
+
+def start_profile():
+    """Start profiling the worker serving this request.
+
+    With mode=worker (the default) every thread of the worker is
+    sampled for `seconds` and written as collapsed stacks; with
+    mode=requests, the `rate` fraction of its requests are run
+    under cProfile for `seconds`, each written as a pstats file.
+    Like /metrics, only operators can reach it, and only the
+    worker that gets the request is profiled.
+
+    :returns: JSON of where the profile will be written
+    :rtype: HTTPResponse
+
+    """
+
+    refused = operators_only()
+    if refused is not None:
+        return refused
+    try:
+        seconds = float(request.query.seconds or 0) or None
+        rate = float(request.query.rate or 0.1)
+    except ValueError:
+        return return_error(400, 'seconds and rate must be numbers.')
+    if seconds is not None and not 0 < seconds <= 600:
+        return return_error(400, 'seconds must be up to 600.')
+    if not 0 < rate <= 1:
+        return return_error(400, 'rate must be between 0 and 1.')
+
+    mode = request.query.mode or 'worker'
+    if mode == 'worker':
+        path = profiling.sampleWorker(seconds)
+        if path is None:
+            return return_error(409, 'This worker is already sampled.')
+    elif mode == 'requests':
+        path = profiling.profileRequests(rate, seconds)
+    else:
+        return return_error(400, 'mode must be worker or requests.')
+    return HTTPResponse(JSONHelper().encode({'pid': os.getpid(),
+                                             'mode': mode, 'path': path}),
+                        status=202,
+                        headers={'Content-Type': 'application/json'})
+
+
+def operators_only():
+    """Refuse a request that does not come from an operator.
+
+    Operators send the METRICS_TOKEN environment variable as a
+    bearer token, and without one set the page does not exist.
+
+    :returns: the response refusing the request, None to go on
+    :rtype: HTTPResponse
+
+    """
+
+    token = os.environ.get('METRICS_TOKEN')
+    if not token:
+        return HTTPResponse(status=404)
+    given = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(given.encode('utf-8'),
+                               ('Bearer ' + token).encode('utf-8')):
+        return HTTPResponse(status=401,
+                            headers={'WWW-Authenticate': 'Bearer'})
+    return None
+
+
+def asset_static(filename):
+    """Get built bundles, gzipped if the client takes that.
+
+    Bundle names change with their content, so they never need
+    to be checked again.
+
+    :param filename: the name of the bundle file
+    :type filename: str
+    :returns: The given bundle
+    :rtype: HTTPResponse
+
+    """
+
+    root = os.path.join(MODULEPATH, 'static/dist')
+    mimetype = mimetypes.guess_type(filename)[0] or 'auto'
+    encodings = request.headers.get('Accept-Encoding', '')
+    if 'gzip' in encodings and \
+            os.path.isfile(os.path.join(root, filename + '.gz')):
+        response = static_file(filename + '.gz', root=root, mimetype=mimetype)
+        if response.status_code == 200:
+            response.set_header('Content-Encoding', 'gzip')
+    else:
+        response = static_file(filename, root=root, mimetype=mimetype)
+    if response.status_code in (200, 304):
+        response.set_header('Cache-Control',
+                            'public, max-age=31536000, immutable')
+        response.set_header('Vary', 'Accept-Encoding')
+    return response
+
+
 def js_static(filename):
     """Get static javascript files.
 
@@ -583,6 +1298,78 @@ def css_static(filename):
     return static_file(filename, root=os.path.join(MODULEPATH, 'static/css'))
 
 
+def version_etag(userName, version):
+    """Return the ETag of a response built from the user's data.
+
+    The user's committed version changes once every write made so
+    far is done, so an ETag never labels data older than its version;
+    the user, path and query string tell apart the views of that data.
+    It is weak since compression changes the bytes but not the data.
+
+    :param userName: the user name of the currently logged in user
+    :type userName: str
+    :param version: the user's committed version
+    :type version: int
+    :returns: the ETag
+    :rtype: str
+
+    """
+
+    view = '\0'.join([userName, request.path, request.query_string])
+    digest = hashlib.sha1(view.encode('utf-8')).hexdigest()[:16]
+    return 'W/"%d-%s"' % (version, digest)
+
+
+def etag_matches(etag):
+    """Check if the client already has the response with this ETag.
+
+    :param etag: the ETag of the response
+    :type etag: str
+    :returns: whether If-None-Match has the ETag
+    :rtype: bool
+
+    """
+
+    ifNoneMatch = request.headers.get('If-None-Match', '')
+    tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+    if '*' in tags:
+        return True
+    # Weak comparison, as If-None-Match calls for
+    tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+    return (etag[2:] if etag.startswith('W/') else etag) in tags
+
+
+def not_modified(etag):
+    """Return a 304 Not Modified response for the ETag.
+
+    :param etag: the ETag of the response
+    :type etag: str
+    :returns: the empty response
+    :rtype: HTTPResponse
+
+    """
+
+    return HTTPResponse(status=304, headers=cache_headers(etag))
+
+
+def cache_headers(etag, contentType=None):
+    """Return headers making clients revalidate with the ETag.
+
+    :param etag: the ETag of the response
+    :type etag: str
+    :param contentType: the content type of the response (if any)
+    :type contentType: str
+    :returns: the headers
+    :rtype: dict
+
+    """
+
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if contentType is not None:
+        headers['Content-Type'] = contentType
+    return headers
+
+
 def return_error(status, msg=''):
     """Return a JSON error message.
 
@@ -600,6 +1387,12 @@ def return_error(status, msg=''):
                         header={'Content-Type': 'application/json'})
 
 if __name__ == '__main__':
-    options = ConfigObj(os.environ["CONFIGFILE"])["web server"]
+    settings = ConfigObj(os.environ["CONFIGFILE"])
+    options = settings["web server"]
+    if '--ensure-indexes' in sys.argv:
+        # gunicorn parses the command line too, so keep it out of there
+        sys.argv.remove('--ensure-indexes')
+        AddressServer(options, settings).ensure_indexes()
+        sys.exit(0)
     options['bind'] = options['bind'] + ':' + os.environ["PORT"]
-    AddressServer(options).run()
+    AddressServer(options, settings).run()
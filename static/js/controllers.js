@@ -1,59 +1,120 @@
 var app = angular.module('SimpleAddress', ['ui.bootstrap']);
 
-app.filter('startFrom', function() {
-    return function(input, start) {
-        if(input) {
-            start = +start;
-            return input.slice(start);
-        }
-        return [];
-    }
-});
-
 function AddressListCtrl($scope, $timeout, $http, $modal) {
     // Any alerts that have happened on the page
     $scope.alerts = [];
     
-    // Hold your addresses
+    // Hold the addresses of the current page
     $scope.addresses = [];
     $scope.newaddress = {};
     
-    // Set up filtering and pagination vars
-    $scope.totalItems = 0;
+    // Set up searching and pagination vars
+    $scope.search = '';
     $scope.currentPage = 1;
-    $scope.noOfPages = 1;
-    // max number of pages to display
-    $scope.maxSize = 5;
+    // cursor of each page visited so far, the first page has none
+    $scope.pageCursors = [null];
+    $scope.nextCursor = null;
     // number per page
     $scope.entryLimit = 10;
+    var searchTimer = null;
+    // token to ask the server what changed since the page was loaded
+    var syncToken = null;
+    // how often to check for changes made elsewhere (ms)
+    var syncInterval = 60000;
     
-    $scope.setPage = function(pageNo) {
-        $scope.currentPage = pageNo;
+    // Get the current page from the server
+    $scope.load = function()
+    {
+        var params =
+            {
+                limit: $scope.entryLimit,
+                sort: 'last_name,first_name'
+            };
+        var after = $scope.pageCursors[$scope.currentPage - 1];
+        if (after)
+        {
+            params.after = after;
+        }
+        if ($scope.search)
+        {
+            params.search = $scope.search;
+        }
+
+        $http.get('addresses', {params: params}).success(function(data)
+            {
+                $scope.addresses = data.addresses;
+                $scope.nextCursor = data.next;
+                syncToken = data.token;
+            }).error(function(data, status, headers, config)
+            {
+                $scope.addAlert("Failure getting addresses", status);
+            });
     };
 
-    $scope.filter = function() {
-        $timeout(function() {
-            // wait for 'filtered' to be changed
-            $scope.noOfPages = Math.ceil($scope.filtered.length/$scope.entryLimit);
-            $scope.totalItems = $scope.filtered.length;
-        }, 10);
+    // Cheaply ask for changes made elsewhere, reloading the page if any
+    $scope.refresh = function()
+    {
+        if (!syncToken)
+        {
+            return;
+        }
+        $http.get('addresses', {params: {since: syncToken}}).success(function(data)
+            {
+                syncToken = data.token;
+                if (data.reset || data.addresses.length || data.deleted.length)
+                {
+                    $scope.load();
+                }
+            });
     };
-    
-    // Currently look for first and last name, along with spouse
-    $scope.mySearch = function(address) {
-        var re = new RegExp($scope.search, 'i');
-        return re.test(address.first_name + " " + address.last_name) || re.test(address.spouse);
+
+    function scheduleRefresh()
+    {
+        $timeout(function() {
+            $scope.refresh();
+            scheduleRefresh();
+        }, syncInterval);
+    }
+    scheduleRefresh();
+
+    window.addEventListener('focus', function() {
+        $scope.$apply($scope.refresh);
+    });
+
+    $scope.nextPage = function()
+    {
+        if ($scope.nextCursor)
+        {
+            $scope.pageCursors[$scope.currentPage] = $scope.nextCursor;
+            $scope.currentPage++;
+            $scope.load();
+        }
     };
-    
-    $http.get('addresses').success(function(addresses)
+
+    $scope.previousPage = function()
+    {
+        if ($scope.currentPage > 1)
         {
-            $scope.addresses = addresses;
-            $scope.noOfPages = Math.ceil($scope.addresses.length/$scope.entryLimit);
-            $scope.totalItems = $scope.addresses.length;
-        }).error(function(data, status, headers, config)
+            $scope.currentPage--;
+            $scope.load();
+        }
+    };
+
+    // Search on the server (by first and last name, along with spouse)
+    // once typing pauses, starting over from the first page
+    $scope.filter = function() {
+        if (searchTimer)
         {
-            $scope.addAlert("Failure getting addresses", status);
-        });
+            $timeout.cancel(searchTimer);
+        }
+        searchTimer = $timeout(function() {
+            $scope.currentPage = 1;
+            $scope.pageCursors = [null];
+            $scope.load();
+        }, 300);
+    };
+    
+    $scope.load();
 
     $scope.change = function(address, origAddress)
     {
@@ -89,34 +150,45 @@ function AddressListCtrl($scope, $timeout, $http, $modal) {
             "send_christmas_card": $scope.newaddress.send_christmas_card
         };
         
-        var proceed = true;
-        for (var i=0; i<$scope.addresses.length; i++)
-        {
-            var addr = $scope.addresses[i];
-            if (addr.first_name == newAddress.first_name && addr.last_name == newAddress.last_name)
+        // Only the current page is loaded, so ask the server for matches
+        var params =
             {
-                proceed = confirm("Do you want to create another \"" + addr.first_name + " " + addr.last_name + "\"");
-                break;
-            }
-        }
-
-        if (proceed)
-        {
-            $http.post('addresses', newAddress).success(function(data, status, headers, config)
+                limit: 100,
+                search: (newAddress.first_name || '') + ' ' + (newAddress.last_name || '')
+            };
+        $http.get('addresses', {params: params}).success(function(data)
             {
-                newAddress._id = data._id;
-                $scope.addresses.push(newAddress);
-                
-                clearProps($scope.newaddress);
+                var proceed = true;
+                for (var i=0; i<data.addresses.length; i++)
+                {
+                    var addr = data.addresses[i];
+                    if (addr.first_name == newAddress.first_name && addr.last_name == newAddress.last_name)
+                    {
+                        proceed = confirm("Do you want to create another \"" + addr.first_name + " " + addr.last_name + "\"");
+                        break;
+                    }
+                }
+
+                if (proceed)
+                {
+                    $http.post('addresses', newAddress).success(function(data, status, headers, config)
+                    {
+                        $scope.load();
+                        
+                        clearProps($scope.newaddress);
+                    }).error(function(data, status, headers, config)
+                    {
+                        $scope.addAlert("Failure creating address", status);
+                    });
+                }
+                else
+                {
+                    clearProps($scope.newaddress);
+                }
             }).error(function(data, status, headers, config)
             {
                 $scope.addAlert("Failure creating address", status);
             });
-        }
-        else
-        {
-            clearProps($scope.newaddress);
-        }
     };
     
     function clearProps(obj)
@@ -130,24 +202,30 @@ function AddressListCtrl($scope, $timeout, $http, $modal) {
         }
     }
 
+    // The list only has what it shows, so get the whole address to edit
     $scope.open = function(editAddress)
     {
-        var copyAddress = angular.copy(editAddress);
-        var modalData =
+        $http.get('addresses/' + editAddress._id).success(function(fullAddress)
             {
-                templateUrl: 'editContent.html',
-                controller: ModalEditCtrl,
-                resolve: {
-                    address: function()
+                var modalData =
                     {
-                        return copyAddress;
-                    }
-                }
-            };
-        var modalInstance = $modal.open(modalData);
-        modalInstance.result.then(function (savedAddress)
+                        templateUrl: 'editContent.html',
+                        controller: ModalEditCtrl,
+                        resolve: {
+                            address: function()
+                            {
+                                return fullAddress;
+                            }
+                        }
+                    };
+                var modalInstance = $modal.open(modalData);
+                modalInstance.result.then(function (savedAddress)
+                    {
+                        $scope.change(savedAddress, editAddress);
+                    });
+            }).error(function(data, status, headers, config)
             {
-                $scope.change(savedAddress, editAddress);
+                $scope.addAlert("Failure getting address", status);
             });
     };
 
@@ -163,9 +241,7 @@ function AddressListCtrl($scope, $timeout, $http, $modal) {
             {
                 $http.delete('addresses/' + removeAddress._id).success(function(data, status, headers, config)
                     {
-                        var addresses = $scope.addresses;
-                        var index = addresses.indexOf(removeAddress);
-                        addresses.splice(index, 1);
+                        $scope.load();
                     }).error(function(data, status, headers, config)
                     {
                         $scope.addAlert("Failure deleting address", status);
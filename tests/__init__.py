@@ -0,0 +1,9 @@
+"""
+These are the tests of the address site.
+
+They run against mongomock, an in-memory stand-in for MongoDB, and
+are skipped when it is not installed.
+
+    python -m pytest tests
+
+"""
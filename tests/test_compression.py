@@ -0,0 +1,71 @@
+"""
+This tests the response compression middleware.
+
+"""
+
+from libraries.compression import CompressionMiddleware
+import gzip
+import unittest
+
+
+def application(contentType, body, headers=()):
+    """Return a WSGI application answering with a body."""
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', contentType)] +
+                       list(headers))
+        return [body]
+    return app
+
+
+class CompressionTest(unittest.TestCase):
+
+    def call(self, app, acceptEncoding=None, method='GET'):
+        """Call the middleware and return the headers and body."""
+
+        environ = {'REQUEST_METHOD': method}
+        if acceptEncoding is not None:
+            environ['HTTP_ACCEPT_ENCODING'] = acceptEncoding
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['headers'] = dict((key.lower(), value)
+                                       for key, value in headers)
+
+        body = b''.join(CompressionMiddleware(app, minimumSize=100)(
+            environ, start_response))
+        return response['headers'], body
+
+    def test_compressed(self):
+        headers, body = self.call(
+            application('application/json', b'[1]' * 100), 'gzip')
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(body), b'[1]' * 100)
+
+    def test_vary_without_compression(self):
+        big = application('text/csv', b'a,b\n' * 100)
+        small = application('application/json', b'[]')
+        for app, acceptEncoding, method in ((big, None, 'GET'),
+                                            (big, 'identity', 'GET'),
+                                            (big, 'gzip', 'HEAD'),
+                                            (small, 'gzip', 'GET')):
+            headers, body = self.call(app, acceptEncoding, method)
+            self.assertNotIn('content-encoding', headers)
+            self.assertEqual(headers['vary'], 'Accept-Encoding')
+
+    def test_vary_is_merged(self):
+        app = application('text/html', b'<p>' * 100, [('Vary', 'Cookie')])
+        for acceptEncoding in (None, 'gzip'):
+            headers, body = self.call(app, acceptEncoding)
+            self.assertEqual(headers['vary'], 'Cookie, Accept-Encoding')
+
+    def test_no_vary_for_other_types(self):
+        for acceptEncoding in (None, 'gzip'):
+            headers, body = self.call(
+                application('image/png', b'\0' * 1000), acceptEncoding)
+            self.assertNotIn('vary', headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+This tests that the json backend writes and reads JSON as json
+always has, and, asked to match orjson, the same JSON as orjson.
+
+"""
+
+from bson import json_util
+from bson.objectid import ObjectId
+from bson.tz_util import utc
+from datetime import datetime
+from libraries import jsoncodec
+import json
+import unittest
+
+PAYLOADS = [
+    {'first_name': 'Zoë', 'last_name': 'Ångström', 'city': '東京',
+     'note': 'snow ☃ and \U0001F600', 'separators': '  '},
+    [{'_id': ObjectId('5f1d7a3e9b1e8a3c4d5e6f70'), 'send_christmas_card':
+      True, 'children': None, 'zip': 12345, 'score': 0.1}],
+    {'created': datetime(2020, 5, 17, 12, 30, 15, 250000, tzinfo=utc)},
+    ['quotes " and \\ and \n', '', 0, -1, 1.5, False, [], {}],
+    {'nested': {'list': [1, [2, [3, {'deep': 'ok'}]]]}},
+]
+# These are written exactly, but read back as floats
+BIG_INTS = {'big': 2 ** 64, 'small': -2 ** 63 - 1, 'edge': 2 ** 64 - 1}
+
+TEXTS = ['{"a":"Zoë","b":[1,2.5,true,null]}',
+         '{"$oid":"5f1d7a3e9b1e8a3c4d5e6f70"}',
+         '[{"_id":{"$oid":"5f1d7a3e9b1e8a3c4d5e6f70"},"n":"x"}]',
+         '{"big":18446744073709551616,"edge":18446744073709551615,'
+         '"small":-9223372036854775809}',
+         '"\\u00e9\\u2028"']
+
+
+def backends():
+    """Return every backend that writes JSON the way orjson does."""
+
+    matching = [jsoncodec.StdlibBackend(matchOrjson=True)]
+    if 'orjson' in jsoncodec.BACKENDS:
+        matching.append(jsoncodec.OrjsonBackend())
+    return matching
+
+
+class StdlibTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdlib = jsoncodec.StdlibBackend()
+
+    def test_writes_what_json_always_has(self):
+        unusual = {'nan': float('nan'), 'inf': [float('inf')], 'é': '☃'}
+        for payload in PAYLOADS + [BIG_INTS, unusual]:
+            self.assertEqual(self.stdlib.dumps(payload),
+                             json.dumps(payload, default=json_util.default))
+
+    def test_reads_what_json_always_has(self):
+        texts = TEXTS + ['[NaN, Infinity, -Infinity]', '1e400']
+        for text in texts:
+            expected = json.loads(text, object_hook=json_util.object_hook)
+            self.assertEqual(repr(self.stdlib.loads(text)), repr(expected))
+            self.assertEqual(repr(self.stdlib.loads(text.encode('utf-8'))),
+                             repr(expected))
+
+    def test_reads_its_own_json(self):
+        for backend in (self.stdlib,
+                        jsoncodec.StdlibBackend(matchOrjson=True)):
+            for payload in PAYLOADS:
+                self.assertEqual(backend.loads(backend.dumps(payload)),
+                                 payload)
+
+    def test_use_chooses_the_mode(self):
+        try:
+            jsoncodec.use('json')
+            self.assertEqual(jsoncodec.dumps({'a': 'é'}), '{"a": "\\u00e9"}')
+            jsoncodec.use('json', matchOrjson=True)
+            self.assertEqual(jsoncodec.dumps({'a': 'é'}), '{"a":"é"}')
+        finally:
+            jsoncodec.use()
+
+
+class MatchOrjsonTest(unittest.TestCase):
+
+    def test_non_ascii_is_left_as_utf8(self):
+        for backend in backends():
+            self.assertEqual(backend.dumps({'a': 'é'}), '{"a":"é"}')
+
+    def test_nan_and_infinity_are_refused(self):
+        for backend in backends():
+            for value in (float('nan'), float('inf'), -float('inf')):
+                with self.assertRaises(ValueError):
+                    backend.dumps({'a': [1, value]})
+            for text in ('NaN', '[Infinity]', '{"a":-Infinity}', '1e400'):
+                with self.assertRaises(ValueError):
+                    backend.loads(text)
+
+
+@unittest.skipIf('orjson' not in jsoncodec.BACKENDS, 'orjson is not installed')
+class SameJSONTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdlib = jsoncodec.StdlibBackend(matchOrjson=True)
+        self.orjson = jsoncodec.OrjsonBackend()
+
+    def test_same_bytes(self):
+        for payload in PAYLOADS + [BIG_INTS]:
+            self.assertEqual(self.orjson.dumps(payload),
+                             self.stdlib.dumps(payload))
+
+    def test_same_values(self):
+        texts = TEXTS + [self.stdlib.dumps(payload)
+                         for payload in PAYLOADS + [BIG_INTS]]
+        for text in texts:
+            for data in (text, text.encode('utf-8')):
+                self.assertEqual(self.orjson.loads(data),
+                                 self.stdlib.loads(data))
+
+    def test_exponents_are_the_same_number(self):
+        for value in (1e16, 1e300, 2.5e-8):
+            texts = [self.orjson.dumps([value]), self.stdlib.dumps([value])]
+            self.assertEqual(json.loads(texts[0]), json.loads(texts[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
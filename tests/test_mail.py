@@ -0,0 +1,59 @@
+"""
+This tests delivering queued email to tools/smtp_sink.py.
+
+"""
+
+from libraries import mail
+from libraries.mail import QueuedMailer
+from tools import smtp_sink
+import io
+import json
+import threading
+import unittest
+
+
+class QueuedMailerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.out = io.StringIO()
+        options = smtp_sink.parseOptions(['--port', '0', '--fail-first', '1'])
+        self.sink = smtp_sink.SinkServer(options, self.out)
+        threading.Thread(target=self.sink.serve_forever, daemon=True).start()
+        self.addCleanup(self.sink.server_close)
+        self.addCleanup(self.sink.shutdown)
+        port = self.sink.server_address[1]
+        self.mailer = QueuedMailer('site@example.com',
+                                   'smtp://localhost:%d' % port,
+                                   retries=2, retryDelay=0.01, timeout=5,
+                                   join_timeout=5)
+
+    def received(self):
+        return [json.loads(line) for line in self.out.getvalue().splitlines()]
+
+    def test_retries_a_failed_delivery_and_drains(self):
+        retried = mail.FAILURES.samples().get(('retried',), 0)
+        sent = mail.SENT.samples().get((), 0)
+        self.mailer.send_email('ann@example.com', 'Hello', 'Welcome.')
+        self.mailer.send_email('bob@example.com', 'Hi', 'Welcome too.')
+
+        self.assertTrue(self.mailer.join())
+        self.assertEqual(self.mailer.queue.unfinished_tasks, 0)
+        # The sink failed the first attempt, so one retry got it through
+        self.assertEqual(mail.FAILURES.samples().get(('retried',), 0),
+                         retried + 1)
+        self.assertEqual(mail.SENT.samples().get((), 0), sent + 2)
+        received = self.received()
+        self.assertEqual([entry['to'] for entry in received],
+                         [['ann@example.com'], ['bob@example.com']])
+        self.assertEqual(received[0]['subject'], 'Hello')
+
+    def test_join_gives_up_after_the_timeout(self):
+        self.mailer.join_timeout = 0.1
+        self.mailer.retryDelay = 1
+        self.mailer.send_email('ann@example.com', 'Hello', 'Welcome.')
+        # The first attempt fails and the retry waits longer than that
+        self.assertFalse(self.mailer.join())
+
+
+if __name__ == '__main__':
+    unittest.main()
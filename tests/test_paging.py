@@ -0,0 +1,68 @@
+"""
+This tests keyset paging of the addresses.
+
+"""
+
+from models import connection
+from models.address import AddressModel
+import unittest
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+MONGO_URL = 'mongodb://paging-test'
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class PagingTest(unittest.TestCase):
+
+    def setUp(self):
+        connection.setClient(MONGO_URL, mongomock.MongoClient())
+        self.helper = AddressModel(MONGO_URL, 'test')
+        # The client leaves empty fields out, so some have no last name
+        addresses = [{'first_name': 'Nobody %d' % i} for i in range(5)]
+        addresses += [{'first_name': 'Ann', 'last_name': None}]
+        addresses += [{'first_name': 'First %02d' % i, 'last_name': 'Smith'}
+                      for i in range(12)]
+        addresses += [{'last_name': 'Jones'}, {'last_name': 'Adams'}]
+        self.ids = set(self.helper.createMultiple(addresses, 'user'))
+        self.helper.createMultiple([{'last_name': 'Smith'}], 'someone else')
+
+    def walk(self, pageSize, sortColumn, secondSortColumn, asc):
+        """Return the ids of every page, following the cursors."""
+
+        ids = []
+        after = None
+        while True:
+            items, after = self.helper.getPage('user', pageSize, sortColumn,
+                                               secondSortColumn, asc,
+                                               after=after)
+            self.assertLessEqual(len(items), pageSize)
+            ids.extend(str(item['_id']) for item in items)
+            if after is None:
+                return ids
+
+    def test_every_page_with_missing_sort_values(self):
+        for pageSize in (1, 3, 7, 100):
+            for asc in (True, False):
+                ids = self.walk(pageSize, 'last_name', 'first_name', asc)
+                self.assertEqual(len(ids), len(self.ids))
+                self.assertEqual(set(ids), self.ids)
+
+    def test_pages_keep_the_sort_order(self):
+        whole = [str(item['_id']) for item in self.helper.findMultiple(
+            'user', sortColumn='last_name', secondSortColumn='first_name',
+            limit=100)]
+        self.assertEqual(self.walk(3, 'last_name', 'first_name', True),
+                         whole)
+
+    def test_one_sort_column(self):
+        for asc in (True, False):
+            self.assertEqual(set(self.walk(4, 'last_name', '', asc)),
+                             self.ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,338 @@
+"""
+This tests the address routes through the whole application.
+
+"""
+
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+from models.dataobject import STALE_WRITE_SECONDS
+from unittest import mock
+import io
+import json
+import logging
+import os
+import sys
+import time
+import unittest
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MONGO_URL = 'mongodb://routes-test'
+PASSWORD = 'routes-test'
+
+
+def makeServer():
+    """Return the application, set up against mongomock."""
+
+    from configobj import ConfigObj
+    from models import connection
+
+    os.environ.setdefault('EMAIL_SENDER', 'test@example.com')
+    os.environ.setdefault('EMAIL_PASSWORD', 'unused')
+    os.environ.setdefault('ENCRYPT_KEY', 't' * 32)
+    os.environ['MONGOHQ_DB'] = 'test'
+    os.environ['MONGOHQ_URL'] = MONGO_URL
+    connection.setClient(MONGO_URL, mongomock.MongoClient())
+
+    # gunicorn parses the command line too, so keep the runner's out of it
+    argv = sys.argv
+    sys.argv = argv[:1]
+    try:
+        import show_address_site
+        logging.getLogger().setLevel(logging.WARNING)
+        settings = ConfigObj(os.path.join(ROOT, 'app.config'))
+        server = show_address_site.AddressServer(
+            dict(settings['web server']), settings)
+    finally:
+        sys.argv = argv
+    server.loginPlugin._store.roles['user'] = 100
+    return server
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class RouteTest(unittest.TestCase):
+
+    """
+    This class logs a new user in before each test, for the test to
+    call the routes as.
+
+    """
+
+    server = None
+
+    @classmethod
+    def setUpClass(cls):
+        if RouteTest.server is None:
+            RouteTest.server = makeServer()
+        cls.app = RouteTest.server.load()
+
+    def setUp(self):
+        from models.address import AddressModel
+
+        self.userName = self.id().rsplit('.', 1)[-1]
+        plugin = self.server.loginPlugin
+        now = str(datetime.utcnow())
+        plugin._store.users[self.userName] = {
+            'role': 'user', 'email_addr': self.userName + '@example.com',
+            'desc': self.userName, 'creation_date': now, 'last_login': now,
+            'hash': plugin._hash(self.userName, PASSWORD).decode('ascii')}
+        self.helper = AddressModel(self.server.MONGO_URL,
+                                   self.server.MONGO_DB)
+        body = 'username=%s&password=%s' % (self.userName, PASSWORD)
+        status, headers, _ = self.call(
+            'POST', '/login', body.encode('utf-8'),
+            'application/x-www-form-urlencoded')
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                self.cookie = value.split(';')[0]
+
+    def call(self, method, path, body=b'', contentType='application/json',
+             query='', headers=None):
+        """Call the application and return the status, headers and body."""
+
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+                   'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+                   'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                   'wsgi.url_scheme': 'http',
+                   'wsgi.input': io.BytesIO(body),
+                   'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+                   'wsgi.multiprocess': False, 'wsgi.run_once': False,
+                   'wsgi.version': (1, 0), 'CONTENT_LENGTH': str(len(body)),
+                   'CONTENT_TYPE': contentType}
+        if getattr(self, 'cookie', None):
+            environ['HTTP_COOKIE'] = self.cookie
+        for name, value in (headers or {}).items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = headers
+
+        result = self.app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], body
+
+    def callJSON(self, method, path, data):
+        """Send data as JSON and return the status and decoded body."""
+
+        status, _, body = self.call(method, path,
+                                    json.dumps(data).encode('utf-8'))
+        return status, json.loads(body.decode('utf-8')) if body else None
+
+    def names(self):
+        """Return the first names of the user's addresses, sorted."""
+
+        return sorted(address.get('first_name') for address in
+                      self.helper.table.find({'userName': self.userName}))
+
+
+class BatchTest(RouteTest):
+
+    def test_mixed_successes_and_failures(self):
+        kept, removed = self.helper.createMultiple(
+            [{'first_name': 'Kept'}, {'first_name': 'Removed'}],
+            self.userName)
+        missing = str(ObjectId())
+        status, body = self.callJSON('POST', '/addresses/batch', [
+            {'op': 'create', 'address': {'first_name': 'New'}},
+            {'op': 'update', 'address': {'_id': kept, 'first_name': 'Ann'}},
+            {'op': 'delete', 'address': {'_id': removed}},
+            {'op': 'delete', 'address': {'_id': missing}}])
+        self.assertEqual(status, 400)
+        results = body['results']
+        self.assertEqual([result['success'] for result in results],
+                         [True, True, True, False])
+        self.assertEqual([result['_id'] for result in results[1:]],
+                         [kept, removed, missing])
+        # What worked is kept even though the last operation failed
+        self.assertEqual(self.names(), ['Ann', 'New'])
+
+    def test_every_operation_working(self):
+        status, body = self.callJSON('POST', '/addresses/batch', [
+            {'op': 'create', 'address': {'first_name': 'One'}},
+            {'op': 'create', 'address': {'first_name': 'Two'}}])
+        self.assertEqual(status, 200)
+        self.assertEqual([result['success'] for result in body],
+                         [True, True])
+        self.assertEqual(self.names(), ['One', 'Two'])
+
+    def test_rejects_what_is_not_a_list(self):
+        for data in ({'op': 'create', 'address': {'first_name': 'One'}},
+                     'create', 5):
+            status, body = self.callJSON('POST', '/addresses/batch', data)
+            self.assertEqual(status, 400)
+            self.assertIn('error', body)
+        status, _, _ = self.call('POST', '/addresses/batch', b'[{"op"')
+        self.assertEqual(status, 400)
+        self.assertEqual(self.names(), [])
+
+    def test_rejects_an_invalid_id(self):
+        for address in ({'_id': 'not an id'}, {'_id': 5}, {}):
+            status, body = self.callJSON('POST', '/addresses/batch', [
+                {'op': 'create', 'address': {'first_name': 'One'}},
+                {'op': 'delete', 'address': address}])
+            self.assertEqual(status, 400)
+            self.assertNotIn('results', body)
+        # Nothing is written when any operation is not valid
+        self.assertEqual(self.names(), [])
+
+
+class BulkWriteTest(RouteTest):
+
+    def setUp(self):
+        super(BulkWriteTest, self).setUp()
+        self.ids = self.helper.createMultiple(
+            [{'first_name': 'One'}, {'first_name': 'Two'}], self.userName)
+        self.missing = str(ObjectId())
+
+    def tombstones(self):
+        """Return the ids the user's tombstones are for, sorted."""
+
+        return sorted(str(tombstone['deletedId']) for tombstone in
+                      self.helper.tombstones.find({'userName':
+                                                   self.userName}))
+
+    def test_update_existing_and_missing(self):
+        status, body = self.callJSON('PUT', '/addresses', [
+            {'_id': self.ids[0], 'first_name': 'Ann'},
+            {'_id': self.missing, 'first_name': 'Nobody'},
+            {'_id': self.ids[1], 'first_name': 'Bob'}])
+        self.assertEqual(status, 400)
+        self.assertEqual(body['results'], [
+            {'_id': self.ids[0], 'success': True},
+            {'_id': self.missing, 'success': False},
+            {'_id': self.ids[1], 'success': True}])
+        self.assertEqual(self.names(), ['Ann', 'Bob'])
+
+    def test_update_all_existing(self):
+        status, body = self.callJSON('PUT', '/addresses', [
+            {'_id': self.ids[0], 'first_name': 'Ann'},
+            {'_id': self.ids[1], 'first_name': 'Bob'}])
+        self.assertEqual(status, 200)
+        self.assertEqual([result['success'] for result in body],
+                         [True, True])
+
+    def test_delete_existing_and_missing(self):
+        other = self.helper.create({'first_name': 'Theirs'}, 'someone else')
+        status, body = self.callJSON('DELETE', '/addresses', [
+            {'_id': self.ids[0]}, {'_id': self.missing}, {'_id': other}])
+        self.assertEqual(status, 400)
+        self.assertEqual(body['results'], [
+            {'_id': self.ids[0], 'success': True},
+            {'_id': self.missing, 'success': False},
+            {'_id': other, 'success': False}])
+        self.assertEqual(self.names(), ['Two'])
+        # Only what was deleted leaves a tombstone
+        self.assertEqual(self.tombstones(), [self.ids[0]])
+        self.assertEqual(self.helper.tombstones.count_documents(
+            {'userName': 'someone else'}), 0)
+
+    def test_delete_all_existing(self):
+        status, body = self.callJSON('DELETE', '/addresses',
+                                     [{'_id': thisId} for thisId in self.ids])
+        self.assertEqual(status, 200)
+        self.assertEqual(body, [{'_id': thisId, 'success': True}
+                                for thisId in self.ids])
+        self.assertEqual(self.names(), [])
+        self.assertEqual(self.tombstones(), sorted(self.ids))
+
+    def test_delete_needs_a_list(self):
+        status, body = self.callJSON('DELETE', '/addresses',
+                                     {'_id': self.ids[0]})
+        self.assertEqual(status, 400)
+        self.assertEqual(self.names(), ['One', 'Two'])
+        self.assertEqual(self.tombstones(), [])
+
+
+class ChangesTest(RouteTest):
+
+    def pageToken(self):
+        """Return the sync token of the first page."""
+
+        status, _, body = self.call('GET', '/addresses', query='limit=10')
+        self.assertEqual(status, 200)
+        return json.loads(body.decode('utf-8'))['token']
+
+    def changes(self, token):
+        """Return the changes since a token."""
+
+        status, _, body = self.call('GET', '/addresses',
+                                    query='since=' + token)
+        self.assertEqual(status, 200)
+        return json.loads(body.decode('utf-8'))
+
+    def test_changes_have_the_fields_of_a_page(self):
+        token = self.pageToken()
+        self.helper.create({'first_name': 'Ann', 'spouse': 'Bob'},
+                           self.userName)
+        changes = self.changes(token)
+        self.assertFalse(changes['reset'])
+        self.assertEqual(len(changes['addresses']), 1)
+        address = changes['addresses'][0]
+        self.assertEqual(address['first_name'], 'Ann')
+        for internal in ('userName', '_modified', 'spouse'):
+            self.assertNotIn(internal, address)
+
+    def test_too_many_changes_reset(self):
+        import show_address_site
+
+        token = self.pageToken()
+        self.helper.createMultiple([{'first_name': 'One'},
+                                    {'first_name': 'Two'}], self.userName)
+        with mock.patch.object(show_address_site, 'MAX_CHANGES', 1):
+            changes = self.changes(token)
+        self.assertTrue(changes['reset'])
+        self.assertNotIn('addresses', changes)
+        with mock.patch.object(show_address_site, 'MAX_CHANGES', 2):
+            self.assertEqual(len(self.changes(token)['addresses']), 2)
+
+
+class ETagTest(RouteTest):
+
+    def get(self, etag=None):
+        """Return the status and ETag of the address list."""
+
+        status, headers, _ = self.call(
+            'GET', '/addresses', headers={'If-None-Match': etag or ''})
+        return status, dict((name.lower(), value)
+                            for name, value in headers)['etag']
+
+    def test_etag_changes_with_a_write(self):
+        status, first = self.get()
+        self.assertEqual(status, 200)
+        self.assertEqual(self.get(first), (304, first))
+        self.helper.create({'first_name': 'Ann'}, self.userName)
+        status, second = self.get(first)
+        self.assertEqual(status, 200)
+        self.assertNotEqual(second, first)
+
+    def test_etag_changes_after_a_lost_publish(self):
+        self.helper.create({'first_name': 'Ann'}, self.userName)
+        status, first = self.get()
+        # A write stamped a while ago whose worker died before publishing
+        stamp = ObjectId.from_datetime(datetime.fromtimestamp(
+            time.time() - STALE_WRITE_SECONDS + 20, timezone.utc))
+        self.helper.versions.update_one({'_id': self.userName}, {
+            '$inc': {'version': 1}, '$push': {'writes': stamp}})
+        self.helper.create({'first_name': 'Bob'}, self.userName)
+        # The user keeps writing while the lost write goes stale
+        later = time.time() + 60
+        with mock.patch('models.dataobject.time.time', lambda: later):
+            self.helper.create({'first_name': 'Cy'}, self.userName)
+            status, second = self.get(first)
+            self.assertEqual(status, 200)
+            self.assertNotEqual(second, first)
+            self.assertEqual(self.get(second), (304, second))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+This tests the per-request phase timing.
+
+"""
+
+from libraries import timing
+from libraries.timing import TimingMiddleware
+from unittest import mock
+import unittest
+
+
+class PhaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch('libraries.timing.time.perf_counter',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait(self, milliseconds):
+        self.now += milliseconds / 1000.0
+
+    def call(self, app):
+        """Call the middleware and return its Server-Timing, in ms."""
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response.update(headers)
+
+        body = TimingMiddleware(app)({'REQUEST_METHOD': 'GET'},
+                                     start_response)
+        list(body)
+        body.close()
+        durations = {}
+        for part in response['Server-Timing'].split(', '):
+            name, _, duration = part.partition(';dur=')
+            durations[name] = float(duration)
+        return durations
+
+    def test_nested_phases_count_once(self):
+        def app(environ, start_response):
+            with timing.phase('session'):
+                self.wait(1)
+            with timing.phase('auth'):
+                self.wait(2)
+                # A mongo command cork sends, as the listener records it
+                self.wait(3)
+                timing.record('mongo', 0.003)
+                with timing.phase('render'):
+                    self.wait(4)
+            start_response('200 OK', [])
+            return [b'']
+
+        self.assertEqual(self.call(app), {'session': 1.0, 'auth': 2.0,
+                                          'mongo': 3.0, 'render': 4.0,
+                                          'app': 10.0})
+
+    def test_header_covers_up_to_the_first_byte(self):
+        def app(environ, start_response):
+            with timing.phase('mongo'):
+                self.wait(1)
+            start_response('200 OK', [])
+
+            def stream():
+                with timing.phase('serialize'):
+                    self.wait(5)
+                yield b''
+            return stream()
+
+        self.assertEqual(self.call(app), {'mongo': 1.0, 'app': 1.0})
+
+    def test_outside_a_request(self):
+        with timing.phase('auth'):
+            timing.record('mongo', 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+This tests the per-user versions behind ETags and sync tokens.
+
+"""
+
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+from models import connection
+from models.address import AddressModel
+from models.dataobject import STALE_WRITE_SECONDS
+from unittest import mock
+import time
+import unittest
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+MONGO_URL = 'mongodb://versions-test'
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class VersionTest(unittest.TestCase):
+
+    def setUp(self):
+        connection.setClient(MONGO_URL, mongomock.MongoClient())
+        self.writer = AddressModel(MONGO_URL, 'test')
+        self.writer.create({'first_name': 'Ann'}, 'user')
+
+    def reader(self):
+        """Return a model like a new request of another worker has."""
+
+        return AddressModel(MONGO_URL, 'test')
+
+    def test_version_waits_for_the_write(self):
+        before = self.reader().getVersion('user')
+        with self.writer.writing('user') as version:
+            self.assertGreater(version, before)
+            self.assertEqual(self.reader().getVersion('user'), before)
+        self.assertEqual(self.reader().getVersion('user'), version)
+
+    def test_version_waits_for_overlapping_writes(self):
+        before = self.reader().getVersion('user')
+        first, firstStamp = self.writer.nextVersion('user')
+        second, secondStamp = self.writer.nextVersion('user')
+        # The later write finishing first must not commit the earlier
+        self.writer.publishVersion('user', secondStamp)
+        self.assertEqual(self.reader().getVersion('user'), before)
+        self.writer.publishVersion('user', firstStamp)
+        self.assertEqual(self.reader().getVersion('user'),
+                         max(first, second))
+
+    def test_changes_are_not_skipped(self):
+        token = self.reader().getSyncToken('user')
+        with self.writer.writing('user') as version:
+            self.writer.table.insert_one({'userName': 'user',
+                                          'first_name': 'Bob',
+                                          '_modified': version})
+            # A page read meanwhile must not get a token past the write
+            midway = self.reader().getSyncToken('user')
+        for since in (token, midway):
+            changed, deleted, nextToken = self.reader().getChanges('user',
+                                                                   since)
+            self.assertEqual([item['first_name'] for item in changed],
+                             ['Bob'])
+
+    def loseWrite(self, secondsAgo):
+        """Stamp a write that never publishes, as if its worker died."""
+
+        stamp = ObjectId.from_datetime(datetime.fromtimestamp(
+            time.time() - secondsAgo, timezone.utc))
+        self.writer.versions.update_one({'_id': 'user'}, {
+            '$inc': {'version': 1}, '$push': {'writes': stamp}})
+        return self.writer.versions.find_one({'_id': 'user'})['version']
+
+    def test_a_lost_write_is_committed_later(self):
+        version = self.loseWrite(3600)
+        self.assertEqual(self.reader().getVersion('user'), version)
+
+    def test_writes_after_a_lost_one_commit(self):
+        before = self.reader().getVersion('user')
+        self.loseWrite(STALE_WRITE_SECONDS - 20)
+        self.writer.create({'first_name': 'Bob'}, 'user')
+        # The lost write might still be running, so nothing commits yet
+        self.assertEqual(self.reader().getVersion('user'), before)
+        # Steady writes must not keep the lost one alive
+        later = time.time() + 60
+        with mock.patch('models.dataobject.time.time', lambda: later):
+            self.writer.create({'first_name': 'Cy'}, 'user')
+            counter = self.writer.versions.find_one({'_id': 'user'})
+            version = counter['version']
+            self.assertEqual(self.reader().getVersion('user'), version)
+            with self.writer.writing('user') as inFlight:
+                # Only the lost write is dropped, not one in flight
+                self.assertEqual(self.reader().getVersion('user'), version)
+            self.assertEqual(self.reader().getVersion('user'), inFlight)
+
+
+if __name__ == '__main__':
+    unittest.main()
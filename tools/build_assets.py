@@ -0,0 +1,31 @@
+"""
+This builds the static bundles into static/dist.
+
+Run it whenever the stylesheets or scripts change; deploys run it
+from bin/post_compile.
+
+    python tools/build_assets.py
+
+"""
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from libraries import assets  # noqa: E402
+
+
+def main():
+    staticDir = os.path.join(ROOT, 'static')
+    manifest = assets.build(staticDir, os.path.join(staticDir, 'dist'))
+    for name, fileName in sorted(manifest.items()):
+        path = os.path.join(staticDir, 'dist', fileName)
+        print('%-10s %-28s %8d bytes, %8d gzipped' % (
+            name, fileName, os.path.getsize(path),
+            os.path.getsize(path + '.gz')))
+
+
+if __name__ == '__main__':
+    main()
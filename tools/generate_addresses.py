@@ -0,0 +1,181 @@
+"""
+This fills the database with synthetic users and address books.
+
+Every user is a cork user who can log in (prefix0000, prefix0001...
+all with the same password), with an address book whose size is
+drawn from a distribution: most people keep a few dozen addresses
+and a few keep thousands, so lognormal is the default.  Addresses
+are written through AddressModel, versions and all, so the site
+sees them exactly as if they had been posted.
+
+    python tools/generate_addresses.py --users 1000 --median 80
+        --sigma 1.2 --max 20000 [--reset]
+
+The database comes from MONGOHQ_URL and MONGOHQ_DB, like the site.
+
+"""
+
+from datetime import datetime
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from cork import Cork  # noqa: E402
+from models.address import AddressModel  # noqa: E402
+from models.connection import SharedMongoDBBackend  # noqa: E402
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer',
+               'Michael', 'Linda', 'David', 'Elizabeth', 'William', 'Barbara',
+               'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Carlos', 'Maria', 'Wei', 'Mei', 'Ahmed', 'Fatima', 'Raj',
+               'Priya', 'Olga', 'Ivan', 'Chloe', 'Lucas']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia',
+              'Miller', 'Davis', 'Rodriguez', 'Martinez', 'Hernandez',
+              'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor',
+              'Moore', 'Jackson', 'Martin', 'Lee', 'Perez', 'Thompson',
+              'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis',
+              'Robinson', 'Walker', 'Young', 'Allen', 'King', 'Wright',
+              'Scott', 'Torres', 'Nguyen', 'Hill', 'Flores', "O'Brien",
+              'Van der Berg', 'Schmidt', 'Kowalski', 'Rossi', 'Tanaka']
+STREETS = ['Main Street', 'Oak Avenue', 'Maple Drive', 'Cedar Lane',
+           'Park Road', 'Elm Street', 'Washington Boulevard', 'Lake Shore',
+           'Hillcrest Court', 'Sunset Way']
+CITIES = [('Springfield', 'IL', '627'), ('Columbus', 'OH', '432'),
+          ('Austin', 'TX', '787'), ('Portland', 'OR', '972'),
+          ('Madison', 'WI', '537'), ('Raleigh', 'NC', '276'),
+          ('Denver', 'CO', '802'), ('Boston', 'MA', '021'),
+          ('Tucson', 'AZ', '857'), ('Richmond', 'VA', '232')]
+RELATIONSHIPS = ['Family', 'Friend', 'Work', 'Neighbor', 'School', '']
+
+
+def bookSize(rng, options):
+    """Return the number of addresses of one user.
+
+    :param rng: the random number generator
+    :type rng: Random
+    :param options: the command line options
+    :returns: the size, between --min and --max
+    :rtype: int
+
+    """
+
+    if options.distribution == 'fixed':
+        size = options.median
+    elif options.distribution == 'uniform':
+        size = rng.randint(options.min, options.max)
+    else:
+        size = int(rng.lognormvariate(math.log(options.median),
+                                      options.sigma))
+    return max(options.min, min(options.max, size))
+
+
+def makeAddress(rng):
+    """Return one address, with the optional fields sometimes left out."""
+
+    first = rng.choice(FIRST_NAMES)
+    last = rng.choice(LAST_NAMES)
+    city, state, zipPrefix = rng.choice(CITIES)
+    married = rng.random() < 0.5
+    address = {
+        'first_name': first, 'last_name': last,
+        'spouse': rng.choice(FIRST_NAMES) if married else '',
+        'email_address': '%s.%s%d@example.com' % (
+            first.lower(), last.lower().replace(' ', ''),
+            rng.randint(1, 999)) if rng.random() < 0.7 else '',
+        'street_1': '%d %s' % (rng.randint(1, 9999), rng.choice(STREETS)),
+        'street_2': 'Apt %d' % rng.randint(1, 40)
+                    if rng.random() < 0.15 else '',
+        'city': city, 'state': state,
+        'zip': '%s%02d' % (zipPrefix, rng.randint(0, 99)),
+        'country': 'USA' if rng.random() < 0.95 else 'Canada',
+        'home_phone': '555-%04d' % rng.randint(0, 9999)
+                      if rng.random() < 0.4 else '',
+        'mobile_phone': '555-%04d' % rng.randint(0, 9999)
+                        if rng.random() < 0.8 else '',
+        'relationship': rng.choice(RELATIONSHIPS),
+        'title': '', 'children': '',
+        'send_christmas_card': rng.random() < 0.4,
+    }
+    address['label_name'] = 'The %s Family' % last if married else \
+        '%s %s' % (first, last)
+    return address
+
+
+def reset(db, prefix):
+    """Remove the generated users and everything they own."""
+
+    owned = {'$regex': '^' + prefix + r'\d+$'}
+    db.simpleaddresses.delete_many({'userName': owned})
+    db.simpleaddresses_tombstones.delete_many({'userName': owned})
+    db.simpleaddresses_versions.delete_many({'_id': owned})
+    db.users.delete_many({'login': owned})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--prefix', default='load',
+                        help='user names are the prefix and a number')
+    parser.add_argument('--password', default='load-test')
+    parser.add_argument('--distribution', default='lognormal',
+                        choices=('lognormal', 'uniform', 'fixed'))
+    parser.add_argument('--median', type=int, default=80,
+                        help='typical book size (the size when fixed)')
+    parser.add_argument('--sigma', type=float, default=1.2,
+                        help='spread of the lognormal sizes')
+    parser.add_argument('--min', type=int, default=0)
+    parser.add_argument('--max', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='addresses per bulk write')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true',
+                        help='remove the users of an earlier run first')
+    options = parser.parse_args(argv)
+
+    mongoUrl = os.environ['MONGOHQ_URL']
+    dbName = os.environ['MONGOHQ_DB']
+    backend = SharedMongoDBBackend(dbName, mongoUrl)
+    helper = AddressModel(mongoUrl, dbName)
+    if options.reset:
+        reset(helper.table.database, options.prefix)
+    if 'user' not in backend.roles:
+        backend.roles['user'] = 100
+    hasher = Cork(backend=backend)
+
+    rng = random.Random(options.seed)
+    started = time.time()
+    total = 0
+    sizes = []
+    for i in range(options.users):
+        userName = '%s%04d' % (options.prefix, i)
+        now = str(datetime.utcnow())
+        backend.users[userName] = {
+            'role': 'user', 'email_addr': userName + '@example.com',
+            'desc': 'generated', 'creation_date': now, 'last_login': now,
+            'hash': hasher._hash(userName, options.password).decode('ascii')}
+        size = bookSize(rng, options)
+        for start in range(0, size, options.batch):
+            helper.createMultiple(
+                [makeAddress(rng)
+                 for _ in range(min(options.batch, size - start))], userName)
+        sizes.append(size)
+        total += size
+
+    sizes.sort()
+    elapsed = time.time() - started
+    print('%d users, %d addresses in %.1fs (%.0f addresses/s)' % (
+        options.users, total, elapsed, total / elapsed if elapsed else 0))
+    if sizes:
+        print('book sizes: min %d, median %d, p90 %d, p99 %d, max %d' % (
+            sizes[0], sizes[len(sizes) // 2], sizes[int(len(sizes) * 0.9)],
+            sizes[int(len(sizes) * 0.99)], sizes[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+This drives a running address site with a realistic mix of calls.
+
+Virtual users log in through /login as the users made by
+tools/generate_addresses.py, keep their beaker session cookie and
+replay a weighted mix of:
+
+- list: the first page of /addresses, sorted by name
+- create: POST /addresses with one new address
+- update: PUT /addresses with a few of the user's addresses
+- delete: DELETE /addresses/<id> of one of the user's addresses
+- export: GET /csv
+
+Calls are started at the target rate whether or not earlier ones
+have finished (an open loop), so a slow server shows up as latency
+instead of as fewer calls, and latency is counted from when a call
+was due.  Throughput, latency percentiles and error rates are
+reported per kind of call.
+
+    python tools/load_test.py --url http://localhost:8000 --rate 50
+        --duration 60 --users 100 --mix list=60,create=10,update=10,
+        delete=5,export=15
+
+"""
+
+from http.cookiejar import CookieJar
+import argparse
+import itertools
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from benchmarks.common import percentile, saveResults  # noqa: E402
+from tools.generate_addresses import makeAddress  # noqa: E402
+
+DEFAULT_MIX = 'list=60,create=10,update=10,delete=5,export=15'
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+
+    """This class hands redirects back instead of following them."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class VirtualUser(object):
+
+    """
+    This class is one logged in user of the site.
+
+    Ids of the user's addresses are remembered from the lists and
+    creates, for the updates and deletes to work on.
+
+    """
+
+    def __init__(self, baseUrl, userName, password, rng):
+        self.baseUrl = baseUrl
+        self.userName = userName
+        self.password = password
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.ids = []
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirect())
+
+    def request(self, method, path, body=None, contentType=None):
+        """Make a request and return the status and body.
+
+        :returns: the status and the body of the response
+        :rtype: tuple
+
+        """
+
+        request = urllib.request.Request(self.baseUrl + path, data=body,
+                                         method=method)
+        if contentType:
+            request.add_header('Content-Type', contentType)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def login(self):
+        """Log in, which leaves the session cookie in the cookie jar."""
+
+        body = urllib.parse.urlencode({'username': self.userName,
+                                       'password': self.password})
+        status, _ = self.request('POST', '/login', body.encode('utf-8'),
+                                 'application/x-www-form-urlencoded')
+        # Logging in redirects home, failing redirects back to /login
+        status, _ = self.request('GET', '/addresses?limit=1')
+        if status != 200:
+            raise RuntimeError('Could not log in as %s' % self.userName)
+
+    def rememberIds(self, ids):
+        """Remember ids of the user's addresses, the latest thousand."""
+
+        with self.lock:
+            self.ids.extend(ids)
+            del self.ids[:-1000]
+
+    def takeIds(self, count, remove=False):
+        """Return some remembered ids, forgetting them if removed."""
+
+        with self.lock:
+            ids = self.rng.sample(self.ids, min(count, len(self.ids)))
+            if remove:
+                self.ids = [i for i in self.ids if i not in ids]
+            return ids
+
+    def list(self):
+        status, body = self.request('GET', '/addresses?limit=50&sort='
+                                           'last_name,first_name')
+        if status == 200:
+            self.rememberIds([address['_id'] for address in
+                              json.loads(body)['addresses']])
+        return status
+
+    def create(self):
+        body = json.dumps(makeAddress(self.rng)).encode('utf-8')
+        status, body = self.request('POST', '/addresses', body,
+                                    'application/json')
+        if status == 200:
+            self.rememberIds([json.loads(body)['_id']])
+        return status
+
+    def update(self):
+        ids = self.takeIds(5)
+        if not ids:
+            return self.list()
+        addresses = []
+        for thisId in ids:
+            address = makeAddress(self.rng)
+            address['_id'] = thisId
+            addresses.append(address)
+        status, _ = self.request('PUT', '/addresses',
+                                 json.dumps(addresses).encode('utf-8'),
+                                 'application/json')
+        return status
+
+    def delete(self):
+        ids = self.takeIds(1, remove=True)
+        if not ids:
+            return self.list()
+        status, _ = self.request('DELETE', '/addresses/' + ids[0])
+        return status
+
+    def export(self):
+        status, _ = self.request('GET', '/csv')
+        return status
+
+
+def parseMix(mix):
+    """Return the kinds of calls and their weights from 'list=60,...'."""
+
+    kinds, weights = [], []
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if not hasattr(VirtualUser, kind) or kind in ('request', 'login'):
+            raise ValueError('Unknown kind of call: %s' % kind)
+        kinds.append(kind)
+        weights.append(float(weight or 1))
+    return kinds, weights
+
+
+def run(users, kinds, weights, rate, duration, concurrency, rng):
+    """Run the load and return what happened to every call.
+
+    :param users: the logged in users
+    :type users: list
+    :param kinds: the kinds of calls
+    :type kinds: list
+    :param weights: how often each kind is made
+    :type weights: list
+    :param rate: calls to start per second
+    :type rate: float
+    :param duration: seconds to run for
+    :type duration: float
+    :param concurrency: the most calls in flight at once
+    :type concurrency: int
+    :param rng: the random number generator
+    :type rng: Random
+    :returns: (kind, latency, service time, ok) for each call, and the
+              number of calls started late for lack of a free client
+    :rtype: tuple
+
+    """
+
+    calls = queue.Queue()
+    outcomes = []
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            item = calls.get()
+            if item is None:
+                return
+            due, kind, user = item
+            started = time.perf_counter()
+            try:
+                ok = getattr(user, kind)() < 400
+            except Exception:
+                ok = False
+            finished = time.perf_counter()
+            with lock:
+                outcomes.append((kind, finished - due, finished - started,
+                                 ok))
+
+    threads = [threading.Thread(target=client, daemon=True)
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    late = 0
+    for i in itertools.count():
+        due = start + i / rate
+        if due - start >= duration:
+            break
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        if calls.qsize() >= concurrency:
+            late += 1
+        kind = rng.choices(kinds, weights)[0]
+        calls.put((due, kind, rng.choice(users)))
+    for _ in threads:
+        calls.put(None)
+    for thread in threads:
+        thread.join()
+    return outcomes, late
+
+
+def summarize(outcomes, elapsed):
+    """Return throughput, error rate and latency percentiles per kind.
+
+    :param outcomes: what run returned for each call
+    :type outcomes: list
+    :param elapsed: the seconds the calls took in all
+    :type elapsed: float
+    :returns: one summary per kind, then one for all calls
+    :rtype: list
+
+    """
+
+    byKind = {}
+    for outcome in outcomes:
+        byKind.setdefault(outcome[0], []).append(outcome)
+    summaries = []
+    for kind in sorted(byKind) + ['all']:
+        rows = outcomes if kind == 'all' else byKind[kind]
+        latencies = sorted(row[1] for row in rows)
+        errors = sum(1 for row in rows if not row[3])
+        summaries.append({
+            'kind': kind, 'calls': len(rows), 'errors': errors,
+            'error_rate': float(errors) / len(rows) if rows else 0.0,
+            'throughput': len(rows) / elapsed,
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+            'service_p50': percentile(sorted(row[2] for row in rows), 0.5)})
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--users', type=int, default=10,
+                        help='how many of the generated users to log in')
+    parser.add_argument('--prefix', default='load')
+    parser.add_argument('--password', default='load-test')
+    parser.add_argument('--rate', type=float, default=20,
+                        help='calls to start per second')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='the most calls in flight at once')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='kind=weight of each kind of call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='file to save the results to as JSON')
+    options = parser.parse_args(argv)
+
+    kinds, weights = parseMix(options.mix)
+    rng = random.Random(options.seed)
+    users = []
+    for i in range(options.users):
+        user = VirtualUser(options.url.rstrip('/'),
+                           '%s%04d' % (options.prefix, i), options.password,
+                           random.Random(rng.random()))
+        user.login()
+        user.list()
+        users.append(user)
+
+    started = time.perf_counter()
+    outcomes, late = run(users, kinds, weights, options.rate,
+                         options.duration, options.concurrency, rng)
+    summaries = summarize(outcomes, time.perf_counter() - started)
+
+    print('%-8s %7s %7s %8s %9s %9s %9s %9s' % (
+        'kind', 'calls', 'errors', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms',
+        'max ms'))
+    for s in summaries:
+        print('%-8s %7d %6.1f%% %8.1f %9.1f %9.1f %9.1f %9.1f' % (
+            s['kind'], s['calls'], s['error_rate'] * 100, s['throughput'],
+            (s['p50'] or 0) * 1000, (s['p90'] or 0) * 1000,
+            (s['p99'] or 0) * 1000, (s['max'] or 0) * 1000))
+    if late:
+        print('%d calls started late: raise --concurrency' % late)
+    if options.out:
+        saveResults(options.out, 'load', summaries, vars(options))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+This is a local stand-in SMTP server for trying out outbound email.
+
+It accepts every message and writes one JSON line per message
+(time received, sender, recipients, subject, size) to stdout or
+a file, so delivery and latency can be checked without sending
+real email.  It can also answer slowly or fail some messages (at
+random, or the first few) to exercise the retries of the email
+queue; tests/test_mail.py runs it that way.
+
+Point the site at it with SMTP_URL=smtp://localhost:8025 and run:
+
+    python tools/smtp_sink.py --port 8025 [--delay 2] [--fail-rate 0.2]
+        [--fail-first 3]
+
+"""
+
+from email.parser import Parser
+import argparse
+import json
+import random
+import socketserver
+import sys
+import threading
+import time
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+
+    """This class speaks just enough SMTP for smtplib."""
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('utf-8'))
+
+    def handle(self):
+        self.reply('220 localhost smtp sink')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip('<> '), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip('<> '))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                self.receive(sender, recipients)
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    def receive(self, sender, recipients):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                break
+            if line.startswith(b'..'):
+                line = line[1:]
+            lines.append(line)
+        options = self.server.options
+        if options.delay:
+            time.sleep(options.delay)
+        if self.server.failNext() or random.random() < options.fail_rate:
+            self.reply('451 Temporary failure, try again later')
+            return
+        data = b''.join(lines).decode('utf-8', 'replace')
+        message = Parser().parsestr(data, headersonly=True)
+        self.server.record({'received': time.time(), 'from': sender,
+                            'to': recipients,
+                            'subject': message.get('Subject'),
+                            'bytes': len(data)})
+        self.reply('250 OK')
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+
+    """This class records every accepted message as a JSON line."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, options, out):
+        socketserver.ThreadingTCPServer.__init__(
+            self, (options.host, options.port), SinkHandler)
+        self.options = options
+        self.out = out
+        self.lock = threading.Lock()
+        self.failuresLeft = options.fail_first
+
+    def failNext(self):
+        """Return whether to fail this message, one of the first few."""
+
+        with self.lock:
+            if self.failuresLeft <= 0:
+                return False
+            self.failuresLeft -= 1
+            return True
+
+    def record(self, entry):
+        with self.lock:
+            self.out.write(json.dumps(entry) + '\n')
+            self.out.flush()
+
+
+def parseOptions(argv=None):
+    """Return the command line options."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--delay', type=float, default=0,
+                        help='seconds to wait before accepting a message')
+    parser.add_argument('--fail-rate', type=float, default=0,
+                        help='fraction of messages to fail temporarily')
+    parser.add_argument('--fail-first', type=int, default=0,
+                        help='number of messages to fail before any other')
+    parser.add_argument('--out', help='file to append messages to')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parseOptions(argv)
+    out = open(options.out, 'a') if options.out else sys.stdout
+    server = SinkServer(options, out)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()